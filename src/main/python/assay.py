@@ -1,9 +1,8 @@
 import pandas as pd
 import ntpath
-import xlwings as xw
 import numpy as np
 from datetime import datetime
-from error_handling import RangeNotFoundError
+from f007_reader import get_f007_model, RangeNotFoundError
 import time
 
 
@@ -11,8 +10,9 @@ class Assay:
     """ Class containing all details from F007:
         Date, technician, sponsor, study, samples and plate IDs """
 
-    def __init__(self, f007, qc_file, curve_file, xl_id, files=[]):
-        """ f007 and files as full paths from file picker dialog """
+    def __init__(self, f007, qc_file, curve_file, xl_id, files=[], use_excel=False):
+        """ f007 and files as full paths from file picker dialog.
+            The F007 is read directly from file unless use_excel """
 
         self.f007 = f007  # File path
         self.f007_ref = get_file_from_path(self.f007)  # Standard F007 reference ID
@@ -22,6 +22,8 @@ class Assay:
         self.curve_file = curve_file  # File containing Curve Info
         self.xl_id = xl_id  # PID of Excel application
         self.wb = None  # Assay workbook
+        self.use_excel = use_excel  # Read F007 through Excel (xlwings)
+        self.model = None if use_excel else get_f007_model(f007)  # F007 read from file (shared)
 
         # Get assay details
         self.tech, self.date, self.sponsor, self.study = self.get_assay_details()
@@ -38,22 +40,18 @@ class Assay:
     def get_assay_details(self):
         """ Get technician, date, sponsor and study details"""
 
-        app = self.get_xl_app()  # Get working Excel process by pID
-        self.wb = app.books.open(self.f007)  # Open F007 workbook
+        if self.use_excel:
+            app = self.get_xl_app()  # Get working Excel process by pID
+            self.wb = app.books.open(self.f007)  # Open F007 workbook
 
         # Defined range names to check
         details = {'AnalystName': '', 'AssayStart': '', 'Sponsor': '', 'StudyName': ''}
         
         # getting the details if range exists in workbook
         for d in details.keys():
-            try:
-                rng = self.wb.names(d).refers_to_range
-            except:
-                raise RangeNotFoundError("F007 Range (" + d + ") Not Found")
-                return
-                
+
             # Check that ranges contain a value - if not, return all as none
-            val = rng.value
+            val = self.get_name_value(d)
             if val:
                 details[d] = val
             else:
@@ -76,30 +74,56 @@ class Assay:
         return tech, date, sponsor, study
 
 
-    def get_samplelist(self):
-        """ Get list of plate IDs and samples"""
-        
-        # Get sample table worksheet - can't use dynamic named range
+    def get_name_value(self, name):
+        """ Get the value of a defined name in the F007 """
+
+        if not self.use_excel:
+            return self.model.name_value(name)
+
+        try:
+            rng = self.wb.names(name).refers_to_range
+        except:
+            raise RangeNotFoundError("F007 Range (" + name + ") Not Found")
+
+        return rng.value
+
+    def get_sample_table(self):
+        """ Get the sample table (including header row) as a list of rows """
+
+        # Sample table worksheet - can't use dynamic named range
+        if not self.use_excel:
+            if 'Sample Table' not in self.model.sheet_names:
+                raise RangeNotFoundError("Sheet not found in F007: Sample Table")
+            if self.model.sample_start is None:
+                print("Sample list not found where expected. Please check that sample table is up to date.")
+            return self.model.sample_rows
+
         ws = self.wb.sheets['Sample Table']
 
         # Check empty
         if ws.range('A2').value is None:
             print("Sample list not found where expected. Please check that sample table is up to date.")
+
+        tbl = ws.range('A2').options(numbers=int).current_region
+        return [[row[0].value] + list(row[1:].value) for row in tbl.rows]
+
+    def get_samplelist(self):
+        """ Get list of plate IDs and samples"""
         
         # Sample table
-        tbl = ws.range('A2').options(numbers=int).current_region
+        tbl = self.get_sample_table()
         
         # Empty dictionaries
         first_run = {}
         repeats = {}
         
         # Loop through sample list in F007
-        for idx, row in enumerate(tbl.rows):
+        for idx, row in enumerate(tbl):
             
             # Get plates as keys and samples as values
             if idx != 0:
-                plate = row[0].value  # Plate ID
-                samples = list(row[1:].value)  # List of samples
+                plate = row[0]  # Plate ID
+                samples = row[1:]  # List of samples
                 # If sample ID numeric - round or return as string or EMPTY
                 samples = [round_to0(s) if s else "EMPTY" for s in samples]
                 
@@ -144,6 +168,7 @@ class Assay:
     def get_xl_app(self):
         """ Find Excel app by id and return """
 
+        import xlwings as xw  # Only when reading through Excel
         for app in xw.apps:
             if app.pid == self.xl_id:
                 return app
@@ -0,0 +1,293 @@
+""" Process MARS folders from the command line without the GUI, e.g. for overnight
+    re-processing, benchmarking or running on a server.
+
+    python batch_runner.py --config batch.ini FOLDER [FOLDER ...]
+
+    Each folder contains the MARS files for one F007. The F007 is the single .xlsm
+    in the folder (other than an F093) unless given with --f007.
+
+    Example config:
+
+    [paths]
+    qc_path = C:/ELISA/QC Limits.csv
+    curve_path = C:/ELISA/IgG Curve.csv
+    trending_path = C:/ELISA/Trending.csv
+    f093_path = C:/ELISA/F093.xlsm
+    master_path = C:/ELISA/Master
+
+    [processing]
+    od_upper = 2.0          ; blank - no upper OD limit
+    od_lower = 0.1          ; blank - no lower OD limit
+    lloq = true
+
+    [output]
+    pdf = pdf               ; pdf, deferred or none
+    run_pdf = false
+    print = false
+    print_backend = file    ; win32, cups or file (blank - default for platform)
+    printer =               ; blank - default printer
+    sink_dir = C:/ELISA/Printed
+
+    [backends]
+    excel = none            ; xlwings or none
+    resource_dir =          ; blank - src/main/resources/base
+    wkhtmltopdf =           ; blank - wkhtmltopdf.exe in resource_dir or on PATH
+"""
+
+import argparse
+import configparser
+import json
+import os
+import shutil
+import sys
+import time
+import pandas as pd
+from report_assets import ReportAssets, render_time_summary
+from print_backends import get_print_backend
+from file_coordinator import wait_summary, conflict_summary, skipped_summary
+from processing_run import ProcessingRun, check_ignore_file, REQUIRED_PATHS, PDF_NOW, PDF_DEFERRED, PDF_NONE
+
+# Source tree locations (used when not given in the config)
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESOURCE_DIR = os.path.join(SRC_DIR, 'resources', 'base')
+BUILD_SETTINGS = os.path.join(os.path.dirname(SRC_DIR), 'build', 'settings', 'base.json')
+
+
+class BatchContext:
+    """ Stands in for the application context - the resources used when
+        creating reports """
+
+    def __init__(self, resource_dir=None, wkhtmltopdf=None):
+
+        self.resource_dir = resource_dir or RESOURCE_DIR
+        self.pdf_exe = wkhtmltopdf or self.find_wkhtmltopdf()
+        self.template = self.get_resource('templates', 'template.html')
+        self.r4_template = self.get_resource('templates', 'r4template.html')
+        self.css = self.get_resource('static', 'style.css')
+        self.build_settings = get_build_settings()
+
+        # Read report stylesheet and images once for every render
+        self.report_assets = ReportAssets(self.css, os.path.dirname(self.template))
+
+    def get_resource(self, *path):
+        return os.path.join(self.resource_dir, *path)
+
+    def find_wkhtmltopdf(self):
+        """ wkhtmltopdf bundled with the resources, otherwise on the PATH """
+
+        exe = self.get_resource('wkhtmltopdf.exe')
+        if os.path.isfile(exe):
+            return exe
+
+        return shutil.which('wkhtmltopdf') or exe
+
+
+class XlwingsExcel:
+    """ Hidden Excel process used for reading the F007 and writing the F093
+        (running the format_page macro) instead of reading/writing the files directly """
+
+    name = "xlwings"
+
+    def __init__(self):
+        self.app = None
+
+    def start(self):
+        """ Start Excel and return the process ID """
+
+        import xlwings as xw
+
+        self.app = xw.App(visible=False)
+        self.app.screen_updating = False
+        self.app.display_alerts = False
+        return self.app.pid
+
+    def stop(self):
+        """ Close all books and kill the process """
+
+        if self.app is None:
+            return
+
+        for book in self.app.books:
+            book.close()
+        self.app.kill()
+        self.app = None
+
+
+class NoExcel:
+    """ No Excel - the F007 and F093 are read and written directly """
+
+    name = "none"
+
+    def start(self):
+        return None
+
+    def stop(self):
+        pass
+
+
+def get_excel_backend(name):
+    """ Return an Excel backend by name (xlwings or none) """
+
+    if name == "xlwings":
+        return XlwingsExcel()
+    elif name == "none":
+        return NoExcel()
+    else:
+        raise ValueError("Unknown Excel backend: " + name)
+
+
+def get_build_settings():
+    """ Build settings (app name/version) from the source tree """
+
+    try:
+        with open(BUILD_SETTINGS) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'app_name': 'psrl_elisa', 'version': ''}
+
+
+def read_config(path):
+    """ Read the batch config file """
+
+    config = configparser.ConfigParser(inline_comment_prefixes=(';',))
+
+    if not config.read(path):
+        raise FileNotFoundError("Config file not found: " + path)
+
+    for section in ['paths', 'processing', 'output', 'backends']:
+        if not config.has_section(section):
+            config.add_section(section)
+
+    return config
+
+
+def get_parms(config):
+    """ OD limits and LLOQ from the config (as on the data page) """
+
+    def get_limit(name, default):
+        val = config.get('processing', name, fallback=default)
+        return float(val) if val else None
+
+    return {'OD_Upper': get_limit('od_upper', '2.0'),
+            'OD_Lower': get_limit('od_lower', '0.1'),
+            'LLOQ': config.getboolean('processing', 'lloq', fallback=True)}
+
+
+def find_f007(folder):
+    """ The F007 in a MARS folder - the only .xlsm that isn't an F093 """
+
+    xlsm = [f for f in os.listdir(folder)
+            if f.upper().endswith('.XLSM') and not f.upper().endswith(' F093.XLSM')
+            and not f.startswith('~$')]
+
+    if len(xlsm) != 1:
+        return None
+
+    return os.path.join(folder, xlsm[0])
+
+
+def get_mars_files(folder):
+    """ MARS files in a folder, ignoring pdfs and files created by earlier runs """
+
+    files = sorted(os.path.join(folder, f) for f in os.listdir(folder))
+    return [f for f in files if os.path.isfile(f) and not check_ignore_file(f)]
+
+
+def run_folder(folder, config, ctx, f007_file=None, amendments=None, log=print):
+    """ Process one MARS folder. Returns list of errors (empty if none) """
+
+    f007_file = f007_file or find_f007(folder)
+    mars_files = get_mars_files(folder)
+
+    if not f007_file or not mars_files:
+        return ["F007 or MARS file information missing"]
+
+    # Backends
+    excel = get_excel_backend(config.get('backends', 'excel', fallback='none'))
+    pdf_mode = config.get('output', 'pdf', fallback=PDF_NOW)
+    if pdf_mode not in [PDF_NOW, PDF_DEFERRED, PDF_NONE]:
+        raise ValueError("Unknown pdf option: " + pdf_mode)
+
+    print_backend = None
+    if config.getboolean('output', 'print', fallback=False):
+        print_backend = get_print_backend(config.get('output', 'print_backend', fallback='') or None,
+                                          config.get('output', 'printer', fallback='') or None,
+                                          config.get('output', 'sink_dir', fallback='') or None)
+
+    paths = {name: config.get('paths', name, fallback='') for name in REQUIRED_PATHS}
+    run_pdf = config.getboolean('output', 'run_pdf', fallback=False)
+
+    start = time.perf_counter()
+    xl_id = excel.start()
+
+    try:
+        processing = ProcessingRun(ctx, f007_file, mars_files, paths, get_parms(config),
+                                   xl_id=xl_id, use_excel=xl_id is not None, amendments=amendments,
+                                   pdf_mode=pdf_mode, run_pdf=run_pdf, print_backend=print_backend)
+        errors = processing.run(stage_callback=lambda s: log("  " + s.name))
+
+        # Report timings and F093 cells written
+        if processing.elisa_data is not None:
+            for line in processing.elisa_data.get_diagnostics():
+                log(line)
+
+        # No background thread here - convert any deferred pdfs now
+        if not errors and pdf_mode == PDF_DEFERRED:
+            elisa_data = processing.elisa_data
+            elisa_data.pdf_queue.run()
+            for line in render_time_summary(elisa_data.pdf_queue.render_times):
+                log(line)
+            if run_pdf and elisa_data.pdf_list:
+                elisa_data.create_run_pdf()
+    finally:
+        excel.stop()
+
+    # Time taken by each stage and waiting for shared files
+    for s in processing.stages:
+        log("  %s: %.3fs" % (s.name, s.seconds))
+    if processing.elisa_data is not None:
+        files = processing.elisa_data.files
+        for line in wait_summary(files.waits) + conflict_summary(files.conflicts) + skipped_summary(files.skipped):
+            log("  " + line)
+    log("  total: %.3fs" % (time.perf_counter() - start))
+
+    return errors + processing.print_errors
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Process MARS folders without the GUI")
+    parser.add_argument('folders', nargs='+', help="MARS folders to process")
+    parser.add_argument('--config', required=True, help="Batch config file")
+    parser.add_argument('--f007', help="F007 file (only when processing a single folder)")
+    parser.add_argument('--amendments', help="CSV of amendments to apply")
+    args = parser.parse_args(argv)
+
+    if args.f007 and len(args.folders) > 1:
+        parser.error("--f007 can only be given with a single folder")
+
+    config = read_config(args.config)
+    ctx = BatchContext(config.get('backends', 'resource_dir', fallback='') or None,
+                       config.get('backends', 'wkhtmltopdf', fallback='') or None)
+    amendments = pd.read_csv(args.amendments) if args.amendments else None
+
+    n_failed = 0
+    for folder in args.folders:
+        print(folder)
+
+        # Carry on with the next folder if one fails
+        try:
+            errors = run_folder(os.path.abspath(folder), config, ctx, args.f007, amendments)
+        except Exception as e:
+            errors = ['{0}: {1}'.format(type(e).__name__, e)]
+
+        for err in errors:
+            print("ERROR: " + err)
+        n_failed += 1 if errors else 0
+
+    print(str(len(args.folders) - n_failed) + " of " + str(len(args.folders)) + " folders processed")
+    return 1 if n_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import os
+import zipfile
+import numpy as np
+import pandas as pd
+from file_coordinator import file_version
+
+# Errors reading a sidecar that is missing, partly written or from another version
+CACHE_ERRORS = (OSError, EOFError, ValueError, KeyError, TypeError, zipfile.BadZipFile)
+
+
+def cache_file(csv_file):
+    """ Sidecar file kept next to a CSV """
+
+    return csv_file + '.cache'
+
+
+def read_cache(csv_file):
+    """ Typed dataframe from the sidecar of a CSV. None if there is no sidecar
+        or it wasn't written for the CSV as it is now """
+
+    try:
+        with np.load(cache_file(csv_file), allow_pickle=False) as npz:
+            if tuple(npz['stamp'].tolist()) != file_version(csv_file):
+                return None
+            return from_arrays(npz)
+    except CACHE_ERRORS:
+        return None
+
+
+def write_cache(csv_file, df, stamp):
+    """ Save a typed dataframe as the sidecar of a CSV. stamp is the version of the
+        CSV the dataframe was read from or written to (file_version - taken before
+        reading, or of the temp file about to replace the CSV). Not saved if the
+        sidecar can't be written (the CSV is read next time). The sidecar holds
+        plain arrays (.npz, no pickled objects) so it can't run code when loaded """
+
+    path = cache_file(csv_file)
+
+    if stamp is None:
+        return
+
+    try:
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, stamp=np.array(stamp, dtype=np.int64), **to_arrays(df))
+        os.replace(path + '.tmp', path)
+    except (OSError, ValueError, TypeError):
+        pass
+
+
+def to_arrays(df):
+    """ Dataframe columns as arrays without objects - categoricals as codes and
+        categories, dates as datetime64 and other text as fixed width strings """
+
+    arrays = {'columns': np.array([str(c) for c in df.columns], dtype=str)}
+    kinds = []
+
+    for i, col in enumerate(df.columns):
+        values = df[col]
+        key = 'c' + str(i)
+
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            kinds.append('category')
+            arrays[key] = values.cat.codes.values.astype(np.int32)
+            arrays[key + '_categories'] = np.array([str(c) for c in values.cat.categories], dtype=str)
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            kinds.append('datetime')
+            arrays[key] = values.values
+        elif pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            kinds.append('number')
+            arrays[key] = values.values.astype(np.float64)
+        else:
+            kinds.append('text')
+            missing = values.isnull().values
+            arrays[key] = np.array(['' if m else str(v) for v, m in zip(values, missing)], dtype=str)
+            arrays[key + '_missing'] = missing
+
+    arrays['kinds'] = np.array(kinds, dtype=str)
+
+    return arrays
+
+
+def from_arrays(npz):
+    """ Dataframe from arrays written by to_arrays """
+
+    data = {}
+    columns = npz['columns'].tolist()
+
+    for i, (col, kind) in enumerate(zip(columns, npz['kinds'].tolist())):
+        key = 'c' + str(i)
+
+        if kind == 'category':
+            data[col] = pd.Categorical.from_codes(npz[key], npz[key + '_categories'].astype(object))
+        elif kind == 'text':
+            values = npz[key].astype(object)
+            values[npz[key + '_missing']] = np.nan
+            data[col] = values
+        else:
+            data[col] = npz[key]
+
+    return pd.DataFrame(data, columns=columns)
+
+
+def to_categories(df, columns):
+    """ Columns with repeated text as categoricals (columns not in df are ignored) """
+
+    for col in columns:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+
+    return df
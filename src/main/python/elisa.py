@@ -981,3 +981,30 @@ def round_to3(val):
     return new_val
 
 
+def get_plate_id(filename):
+    """ Get technician, date and plate ID from barcode """
+
+    # Extract barcode from filename
+    barcode = os.path.split(filename)[-1]
+
+    # Get rid of protocol name
+    barcode = barcode.split("_")[1].split(".")[0]
+
+    # Check if last character is alpga
+    if barcode[0].isalpha():
+        bstring = barcode[1:]
+    else:
+        bstring = barcode
+
+    # Get details - extract portion of barcode
+
+    if bstring[-2:].isalpha():  # If two letters at end
+        plate_id = bstring[:-10]
+
+    elif bstring[-1].isalpha():  # If one letter at end
+        plate_id = bstring[:-9]
+
+    else:  # If no letters at end
+        plate_id = bstring[:-8]
+
+    return plate_id
@@ -1,16 +1,26 @@
-import time
 import numpy as np
 import pdfkit
 import jinja2
 import csv
-import xlwings as xw
 import ntpath
 import pandas as pd
-import win32print
-import win32api
+from PyPDF2 import PdfFileMerger
+from pdf_queue import PdfQueue
+from elisa import get_plate_id
+from f093_writer import F093Writer
+from f093_store import F093Store
+from master_merge import TESTED_IN_ERROR
+from master_db import MasterDatabase
+from master_journal import MasterJournal
+from trend_store import TrendStore
+from qc_rules import WestgardRules
+from file_coordinator import FileCoordinator
+from report_assets import RenderTimer, render_time_summary
 from pathlib import Path
+import io
 import os
 
+
 # PDF OPTIONS
 pdf_options = {
             'quiet': '',
@@ -24,7 +34,7 @@ class ELISAData:
     """ Class containing functions to process elisa data """
 
     def __init__(self, assay, savedir, trend_file, f093_file, master_file,
-                 xl_id, parms_dict, ctx):
+                 xl_id, parms_dict, ctx, defer_pdf=False, use_excel=False):
 
         self.assay = assay
         self.savedir = savedir  # Dir when ELISA data is stored
@@ -32,21 +42,37 @@ class ELISAData:
         self.trend_file = trend_file  # QC Trending file
         self.f093 = f093_file  # F093 Excel template
         self.master_file = os.path.abspath(master_file)  # Study master file
+        self.files = FileCoordinator()  # Locks and writes shared output files
+        self.master_db = MasterDatabase(self.master_file, self.files)  # Study master results
+        self.master_journal = MasterJournal(self.master_db)  # Master changes to apply
+        self.trend_store = TrendStore(trend_file, self.files)  # QC trending partitions
+        self.qc_rules = WestgardRules(self.trend_store, self.files)  # QC trend checks
         self.xl_id = xl_id  # ID of working Excel process
-        self.printer = win32print.GetDefaultPrinter()  # Default printer
+        self.use_excel = use_excel  # Write F093 through Excel (runs format_page macro)
         self.parms_dict = parms_dict  # The parameters used for processing (OD/LLOQ)
         self.ctx = ctx  # Application Context (for resources)
         # A summary table of plate fails to check for R35s
         self.df_plates = pd.DataFrame(
             columns=['Plate', 'Sample1', 'Sample2', 'Sample3', 'Sample4', 'Fail'])
 
-        # PDF configuration (wkhtmltopdf)
-        self.pdf_config = pdfkit.configuration(wkhtmltopdf=ctx.pdf_exe)
+        # PDF configuration (wkhtmltopdf - created when first needed, so runs without
+        # pdfs don't need it) and stylesheet/images loaded at startup
+        self.pdf_config = None
+        self.assets = ctx.report_assets
+        self.template_env = None  # jinja2 environment (compiled templates are cached)
+        self.tables = None  # Table macros (tables.html)
+        self.render_times = []  # Timing breakdown for each report
+        self.f093_cells = None  # F093 cells written (when written without Excel)
+
+        # If deferred - save html and queue pdfs to be created in the background
+        self.defer_pdf = defer_pdf
+        self.pdf_queue = PdfQueue(self.get_pdf_config, pdf_options)
 
         self.warnings = []  # List of warnings
         self.plate_fails = 0  # Plate fail counter
         self.plate_list = []  # List of plate IDs
         self.results_list = []  # List of sample results for every plate
+        self.pdf_list = []  # List of plate IDs and pdf paths created
 
         self.trend_data = []  # List of trending data
 
@@ -56,28 +82,50 @@ class ELISAData:
         self.f093_save_name = os.path.join(os.path.abspath(self.savedir),
                                  f093_save_name)
 
-        # If json file exists - import - else create empty dataframe        
-        if os.path.isfile(self.f093_save_name + ".json"):
+        # Working copy of the F093 table (json snapshot from older versions)
+        self.f093_store = F093Store(self.f093_save_name + ".f093")
+
+        # If F093 stored - import - else create empty dataframe
+        if self.f093_store.exists():
+            self.f093_df = self.f093_store.load()
+            self.f093_written = self.f093_df.copy()  # Last state written to F093
+
+        elif os.path.isfile(self.f093_save_name + ".json"):
             self.f093_df = import_f093_json(self.f093_save_name)
-            self.df_names = self.f093_df.columns.tolist()
+            self.f093_written = self.f093_df.copy()  # Last state written to F093
 
         else:
             self.f093_df = pd.DataFrame()
-            self.df_names = []
+            self.f093_written = None
+
+        # F093 results as a matrix of samples x serotype columns (created with first plate)
+        self.f093_layout = {}  # Result column name: column in matrix (F093 order)
+        self.f093_results = None  # Results matrix
+        self.f093_used = None  # Result columns with results
+        self.f093_samples = None  # Sample ID of each row
+        self.f093_plates = None  # Plate ID of each row
+
+    def get_pdf_config(self):
+        """ pdfkit configuration (wkhtmltopdf), created on first use """
+
+        if self.pdf_config is None:
+            self.pdf_config = pdfkit.configuration(wkhtmltopdf=self.ctx.pdf_exe)
+
+        return self.pdf_config
 
     def get_html_template(self, template_file):
-        """ Get configurations for pdfkit and jinja2 """
+        """ Get a jinja2 template. The environment is created once so each
+            template is only compiled once """
 
-        # Get the parent path of the template file
-        template = self.ctx.template
-        searchpath = os.path.join(Path(template).parent).replace("\\", "/")
+        if self.template_env is None:
+            # Get the parent path of the template file
+            searchpath = os.path.join(Path(self.ctx.template).parent).replace("\\", "/")
 
-        # CREATE TEMPLATE ENVIRONMENT FOR JINJA2
-        templateLoader = jinja2.FileSystemLoader(searchpath=searchpath)
-        templateEnv = jinja2.Environment(loader=templateLoader)
-        template = templateEnv.get_template(template_file)
+            # CREATE TEMPLATE ENVIRONMENT FOR JINJA2
+            templateLoader = jinja2.FileSystemLoader(searchpath=searchpath)
+            self.template_env = jinja2.Environment(loader=templateLoader)
 
-        return template
+        return self.template_env.get_template(template_file)
 
     def input_plate_data(self, elisa, to_pdf=True):
         """ Inputs data to html template and saves to pdf (if to_pdf = True) """
@@ -119,32 +167,113 @@ class ELISAData:
             # Increase fail if plate fail
             self.plate_fails += 1 if elisa.plate_fail else 0
 
-        # Create pdf
+        # Create pdf (or html to be converted later)
         if to_pdf:
-            self.create_pdf(template_file, elisa)
+            if self.defer_pdf:
+                self.create_html(template_file, elisa)
+            else:
+                self.create_pdf(template_file, elisa)
+            self.pdf_list.append((elisa.barc_id, elisa.pdf_path))
 
     def create_pdf(self, template_file, elisa):
         """ Create a pdf from an html template"""
 
+        # Render html and save as PDF
+        timer = RenderTimer(elisa.barc_id)
+        rendered = self.render_html(template_file, elisa, timer)
+        pdfkit.from_string(rendered, elisa.pdf_path, configuration=self.get_pdf_config(), options=pdf_options)
+        timer.lap("pdf")
+        self.render_times.append(timer)
+
+    def create_html(self, template_file, elisa):
+        """ Save the rendered html template next to where the pdf will be
+            and queue for conversion to pdf """
+
+        # Render html and save with the pdf file name
+        timer = RenderTimer(elisa.barc_id)
+        rendered = self.render_html(template_file, elisa, timer)
+        html_path = os.path.splitext(elisa.pdf_path)[0] + ".html"
+
+        with open(html_path, 'w', encoding='utf-8') as html_file:
+            html_file.write(rendered)
+
+        self.pdf_queue.add(html_path, elisa.pdf_path)
+        timer.lap("html")
+        self.render_times.append(timer)
+
+    def render_html(self, template_file, elisa, timer):
+        """ Render the plate data to an html string with the stylesheet and
+            images embedded """
+
         # Get html template file
         template = self.get_html_template(template_file)
 
-        # Get save name
-        pdf_path = elisa.pdf_path
-
-        # Get ods and concs tables
-        ods, concs = get_table_details(elisa.data)
-        od_html = ods.to_html(classes='od_table', table_id='od_tbl')
-        concs_html = concs.to_html(classes='concs_table', table_id='concs_tbl')
+        # Get ods and concs tables (rendered by macro straight from arrays)
+        od_array, conc_array, rows, columns = get_table_arrays(elisa.data)
+        if self.tables is None:
+            self.tables = self.get_html_template('tables.html').module
+        od_html = self.tables.plate_table(od_array, rows, columns, 'od_table', 'od_tbl')
+        concs_html = self.tables.plate_table(conc_array, rows, columns, 'concs_table', 'concs_tbl')
+        timer.lap("tables")
 
         # Render html template to string
         version = self.ctx.build_settings['version']
         rendered = template.render(elisa=elisa, assay=self.assay, version=version,
                                    tables=[od_html, concs_html],
-                                   titles=ods.columns.values)
+                                   titles=columns)
+        timer.lap("template")
+
+        # Add preloaded stylesheet and images
+        rendered = self.assets.embed(rendered)
+        timer.lap("assets")
+
+        return rendered
+
+    def get_diagnostics(self):
+        """ Timing breakdown for every report rendered and number of F093 cells
+            written, as a list of strings (reported by the caller) """
 
-        # Save rendered template as PDF
-        pdfkit.from_string(rendered, pdf_path, configuration=self.pdf_config, css=self.ctx.css, options=pdf_options)
+        lines = render_time_summary(self.render_times)
+        if self.f093_cells is not None:
+            lines.append("F093: " + str(self.f093_cells) + " cells written")
+
+        return lines
+
+    def create_run_pdf(self):
+        """ Create a single bookmarked pdf for the run. A summary page is rendered
+            from the run_details data and the plate pdfs already created are
+            appended without being re-rendered """
+
+        # Render summary page to pdf in memory
+        template = self.get_html_template('run_summary.html')
+        version = self.ctx.build_settings['version']
+        rendered = template.render(assay=self.assay, version=version,
+                                   details=self.get_testing_summary(),
+                                   warnings=[w for w in self.warnings if w],
+                                   plates=self.plate_list)
+        rendered = self.assets.embed(rendered)
+        summary_pdf = pdfkit.from_string(rendered, False, configuration=self.get_pdf_config(),
+                                         options=pdf_options)
+
+        # File name to save
+        file_name = "run_report " + self.assay.f007_ref + ".pdf"
+        file_name = os.path.join(os.path.abspath(self.savedir), file_name)
+
+        # Summary first, then one bookmark per plate
+        merger = PdfFileMerger()
+        merger.append(io.BytesIO(summary_pdf), bookmark="Run Summary")
+
+        for plate_id, pdf_path in self.pdf_list:
+            if os.path.isfile(pdf_path):
+                merger.append(pdf_path, bookmark=plate_id)
+
+        # Write the whole run in one go
+        with open(file_name, 'wb') as pdf_file:
+            merger.write(pdf_file)
+
+        merger.close()
+
+        return file_name
 
     def data_to_table(self, elisa):
         """ Creates f093 dataframe if first plate or updates dataframe. """
@@ -157,83 +286,137 @@ class ELISAData:
         if elisa.barcode[-1] == "R":
             return
 
-        # If first file then initialise dataframe
-        # Else add to dataframe
-        if self.f093_df.empty:
-            self.create_f093_df(elisa.serotype)
-
-        # Check for serotype in existing dataframe
-        serotype_check = "_" + elisa.serotype + "$"
-        checklist = self.f093_df.filter(regex=serotype_check).columns.tolist()
-
-        # If serotype not shown in dataframe, get new columns and input dates
-        if not checklist:
-            get_new_colnames(self.df_names, elisa.serotype)
-            self.f093_df = self.f093_df.reindex(columns=self.df_names)
+        # If first file then create results matrix
+        if self.f093_results is None:
+            self.create_f093_table()
 
         # Input results
         self.input_f093_results(elisa)
 
-    def create_f093_df(self, serotype):
-        """ Initialises the f093 dataframe based on study, samples and plate IDs """
+    def create_f093_table(self):
+        """ Create the results matrix with a column for every serotype already in
+            the F093 or in the run, in F093 order. Previous results are added """
+
+        # Samples and plates from previous results, otherwise from the F007
+        if not self.f093_df.empty:
+            sample_list = self.f093_df['Sample ID'].astype(str).tolist()
+            key_list = self.f093_df['Plate ID'].astype(str).tolist()
+        else:
+            # Get list of samples and the plates on which they were run
+            sample_list = list(self.assay.first_list.values())
+
+            # Plate ID*4
+            key_list = [list(k)*4 for k in self.assay.first_list.keys()]
+
+            # Convert to string
+            sample_list = [str(item) for sublist in sample_list for item in sublist]
+            key_list = [str(item) for sublist in key_list for item in sublist]
 
-        # Get list of samples and the plates on which they were run
-        sample_list = list(self.assay.first_list.values())
+        # Serotypes already in F093 and those in this run
+        existing = [c for c in self.f093_df.columns if c.startswith("Result_")]
+        serotypes = [c[7:] for c in existing] + get_run_serotypes(self.assay.files)
+        serotypes = sort_serotypes(serotypes, self.assay.curve_vals.index)
 
-        # Plate ID*4
-        key_list = [list(k)*4 for k in self.assay.first_list.keys()]
+        self.f093_layout = {"Result_" + s: idx for idx, s in enumerate(serotypes)}
+        self.f093_results = np.full((len(sample_list), len(serotypes)), np.nan, dtype=object)
+        self.f093_used = np.zeros(len(serotypes), dtype=bool)
+        self.f093_samples = np.array(sample_list, dtype=object)
+        self.f093_plates = np.array(key_list, dtype=object)
 
-        # Convert to string
-        sample_list = [str(item) for sublist in sample_list for item in sublist]
-        key_list = [str(item) for sublist in key_list for item in sublist]
+        # Previous results
+        for col in existing:
+            idx = self.f093_layout[col]
+            self.f093_results[:, idx] = self.f093_df[col].values
+            self.f093_used[idx] = True
 
-        # Get the column names for the data table
-        self.df_names = get_f093_colnames(serotype, init=True)
-        # Create empty dataframe based on n samples
-        self.f093_df = pd.DataFrame(index=range(0, len(sample_list)),
-                                    columns=['Sample ID', 'Plate ID'])
+    def add_f093_column(self, serotype):
+        """ Add a serotype that wasn't found in the run file names """
 
-        # Input general testing details (study, sample plates, dates)
-        self.f093_df['Sample ID'] = sample_list
-        self.f093_df['Plate ID'] = key_list
+        serotypes = sort_serotypes([c[7:] for c in self.f093_layout] + [serotype],
+                                   self.assay.curve_vals.index)
+        idx = serotypes.index(serotype)
+
+        self.f093_results = np.insert(self.f093_results, idx, np.nan, axis=1)
+        self.f093_used = np.insert(self.f093_used, idx, False)
+        self.f093_layout = {"Result_" + s: i for i, s in enumerate(serotypes)}
+
+        return idx
 
     def input_f093_results(self, elisa):
-        """ Input results to f093 dataframe """
+        """ Input results for a plate to the results matrix """
+
+        # Column for serotype
+        col = self.f093_layout.get("Result_" + elisa.serotype)
+        if col is None:
+            col = self.add_f093_column(elisa.serotype)
 
-        # Get index of result column from dataframe for serotype
-        result_col = "Result_" + elisa.serotype
-        col_ref = self.f093_df.columns.get_loc(result_col)
+        self.f093_used[col] = True
 
         # IF plate fail, can just remove results, lab date and technician from plate
         if elisa.plate_fail:
 
             # Plate fail code for formatting
-            self.f093_df.loc[self.f093_df['Plate ID'] == elisa.barc_id[-1],
-                             self.f093_df.columns[col_ref]] = elisa.plate_fail
-
+            self.f093_results[self.f093_plates == elisa.barc_id[-1], col] = elisa.plate_fail
             return
 
         # Get ids, values and sample fails
         ids, results, fails = zip(*[get_sample_info(s) for s in elisa.Samples])
 
-        # Boolean array where sample IDs match
-        sample_bool = self.f093_df['Sample ID'].isin(ids)
-
-        # Row index of samples
-        sample_rows = self.f093_df.index[sample_bool].tolist()
+        # Rows where sample IDs match
+        rows = pd.Index(self.f093_samples).isin(ids)
 
         # Input results
-        self.f093_df.loc[sample_rows, self.f093_df.columns[col_ref]] = results
+        self.f093_results[rows, col] = np.array(results, dtype=object)
+
+    def get_f093_df(self):
+        """ Results matrix as the F093 dataframe - sample and plate IDs then
+            serotypes with results """
+
+        names = [name for name, idx in sorted(self.f093_layout.items(), key=lambda x: x[1])
+                 if self.f093_used[idx]]
+
+        df = pd.DataFrame(self.f093_results[:, self.f093_used], columns=names)
+        df.insert(0, 'Plate ID', self.f093_plates)
+        df.insert(0, 'Sample ID', self.f093_samples)
+
+        return df
+
+    def save_f093_table(self):
+        """ Store the F093 table and export it as json (the F093 snapshot format
+            read by earlier versions) """
+
+        self.f093_store.save(self.f093_df)
+        self.f093_store.export_json(self.f093_save_name + ".json")
 
     def f093_to_excel(self):
         """ Save dataframe as table in F093 and format """
 
-        # Rename dataframe columns
-        self.f093_df.columns = self.f093_df.columns.str.replace(
-                "Result_", "PnC-IgG-ELISA type ")
+        # Results from this run
+        if self.f093_results is not None:
+            self.f093_df = self.get_f093_df()
+
+        # Column names as shown in the F093
+        f093_df = self.f093_df.rename(columns=get_f093_name)
+
+        # Write and format without Excel - if already written, only write the changes.
+        # The table (state the changes are found from) is stored once written
+        if not self.use_excel:
+            writer = F093Writer(self.f093, self.files)
+            save_name = self.f093_save_name + ".xlsm"
+
+            with self.files.locked(save_name):
+                if self.f093_written is not None and os.path.isfile(save_name):
+                    old_df = self.f093_written.rename(columns=get_f093_name)
+                    n_cells = writer.update(old_df, f093_df, self.assay.f007_ref, save_name)
+                else:
+                    n_cells = writer.write(f093_df, self.assay.f007_ref, save_name)
+
+            self.f093_cells = n_cells
+            self.save_f093_table()
+            return
 
-        # Save dataframe to json
-        self.f093_df.to_json(self.f093_save_name + ".json", orient='table')
+        # Store table
+        self.save_f093_table()
 
         # Get working Excel process based on pid
         app = self.get_xl_app()
@@ -242,7 +425,7 @@ class ELISAData:
 
         # Add dataframe to sheet
         ws = wb.sheets['Results']
-        ws.range('A6').options(index=False).value = self.f093_df
+        ws.range('A6').options(index=False).value = f093_df
 
         # Run macro in workbook
         formatting = wb.macro('format_page')
@@ -260,233 +443,79 @@ class ELISAData:
         test_list = self.get_testing_summary()
 
         # File name to save
-        file_name = "run_details " + self.assay.f007_ref + ".csv"
-        file_name = os.path.join(os.path.abspath(self.savedir),
-                                 file_name)
-
-        # Write lists and plate dataframe to CSV
-        with open(file_name, 'a', newline='') as csvFile:
-
-            writer = csv.writer(csvFile)
-
-            # Testing details
-            for r in test_list:
-                writer.writerow(r)
-
-            # Warnings
-            self.warnings.append("")
-            self.warnings.append("")
-
-            # Loop through warnings and write
-            for idx, w in enumerate(self.warnings):
-
-                if idx == 0:
-                    writer.writerow(["Warnings:", w])
-                else:
-                    writer.writerow(["", w])
-#
-            # plate list column names
-            writer.writerow([
-                    "Plate",
-                    "Read Time",
-                    "Sample 1",
-                    "Sample 2",
-                    "Sample 3",
-                    "Sample 4",
-                    "Plate Fail"])
-
-            # plate details
-            for r in self.plate_list:
-                writer.writerow(r)
-
-            csvFile.close()
-
-    def create_master(self):
-        """ Create a master study file if doesn't exist. Create headers and
-            write sample results """
-
-        time_ctr = 0
-        while time_ctr < 20:
-            time.sleep(1)
-            time_ctr += 1
-
-            # Open master_details so it will be locked for editing
-            try:
-                with open(self.master_file, 'w', newline='') as csvFile:
-
-                    writer = csv.writer(csvFile)
-                    # headers
-                    headers = ['Sample ID',	'PnC Serotype', 'Plate ID',
-                               'Result', 'Amended Result', 'LABDT', 'Technician', 'Test Run']
-                    writer.writerow(headers)
-
-                    # Write results
-                    for l in self.results_list:
-                        for row in l:
-                            writer.writerow(row)
-
-                    csvFile.close()
-                    break
-            except PermissionError:
-                print("Already open")
-
-    def update_master(self):
-        """ Update the master study file. Remove duplicate entries.
-            Detect NRs """
-
-        # Get dataframe with new data (will remove duplicates and format)
-        df = self.fill_master_details()
-
-        time_ctr = 0
-
-        # check each second whether the master csv file is open and write when it becomes free (timeout at 20 seconds)
-        while time_ctr < 20:
-            time.sleep(1)
-            time_ctr += 1
-
-            # Open master_details so it will be locked for editing
-            try:
-                with open(self.master_file, 'w', newline='') as csvFile:
-
-                    # Save dataframe to csv
-                    df.to_csv(self.master_file, index=False)
-                    csvFile.close()
-                    break
-
-            except PermissionError:
-                print("Already open")
+        file_name = self.get_summary_name()
 
-    def fill_master_details(self):
-        """ Fill master details with sample results. 
-            Create a dataframe as easier to find duplicates """
+        # Write lists and plate dataframe to CSV (through a temp file)
+        def write_summary(path):
 
-        # Import master_details file
-        df = self.get_master_df()
+            with open(path, 'w', newline='') as csvFile:
 
-        # Write results to dataframe if not there
-        for l in self.results_list:
-            for row in l:
-                # If row already in master - continue
-                if not df[(df == row).all(axis=1)].empty:
-                    continue
+                writer = csv.writer(csvFile)
 
-                # CHECK WHETHER SHOULD AMEND
-                amend_row, amend_result = check_edit_master(row, df)
-                # If an amendment returned, edit result
-                if amend_result:
-                    df.loc[df.index[amend_row], 'Result'] = amend_result
-                    continue
+                # Testing details
+                for r in test_list:
+                    writer.writerow(r)
 
-                # CHECK WHETHER TESTED IN ERROR
-                tested_in_error = check_tested_inerror(row, df)
-                # If tested in error - append to warnings list
-                if tested_in_error:
-                    self.append_test_error_warning(row)
+                # Warnings
+                self.warnings.append("")
+                self.warnings.append("")
 
-                # If here then input entire row
-                df.loc[len(df.index)] = row
+                # Loop through warnings and write
+                for idx, w in enumerate(self.warnings):
 
-        # Input NRs
-        df = self.get_nrs(df)
-
-        # Add test run number
-        df = self.add_test_run(df)
-
-        # Format date column
-        df.sort_values(by=['LABDT', 'Sample ID', 'PnC Serotype', 'Technician'], inplace=True)
-        df['LABDT'] = pd.to_datetime(df['LABDT'])
-        df['LABDT'] = df['LABDT'].dt.strftime('%d-%b-%y')
-
-        return df
-
-    def get_master_df(self):
-        """ Get the master details dataframe. 
-            If exists - import, if not - create """
-
-        try:
-            # Import master_details file
-            df = pd.read_csv(self.master_file,
-                             dtype={'Sample ID': 'str', 'PnC Serotype': 'str'},
-                             parse_dates=['LABDT'], infer_datetime_format=True)
-
-        except pd.errors.EmptyDataError:  # If no data found - create
-
-            headers = ['Sample ID', 'PnC Serotype', 'Plate ID',
-                       'Result', 'Amended Result', 'LABDT', 'Technician', 'Test Run']
-
-            df = pd.DataFrame(columns=headers)
-
-        df['Sample ID'] = df['Sample ID'].astype(str)
-        df['PnC Serotype'] = df['PnC Serotype'].astype(str)
-        df['LABDT'] = pd.to_datetime(df['LABDT'])
-
-        # Format date column
-        # df['LABDT'] = df['LABDT'].dt.strftime('%d-%b-%y')
-        df.fillna(value='', inplace=True)
-
-        return df
-
-    def get_nrs(self, df):
-        """ Detect and input NR samples """
-
-        # Drop Duplicates (sample plate will have been re-printed)
-        df.drop_duplicates(keep='first', inplace=True)
-
-        # Sort by date if more than one date
-        # df['LABDT'] = pd.to_datetime(df['LABDT'])
-        # df['LABDT'] = df['LABDT'].dt.strftime('%Y-%m-%d')
-        df.sort_values(by=['LABDT', 'Sample ID', 'PnC Serotype'], inplace=True)
-
-        # Get NP duplicates and assign second one to 'NR'
-        dups = df[df['Result'].eq('NP')].duplicated(subset=[
-            'Sample ID', 'PnC Serotype', 'Result'], keep='first')
-
-        nr_idx = dups[dups == True].index
-        df.loc[nr_idx, 'Amended Result'] = 'NR'
-
-        return df
-
-    def add_test_run(self, df):
-        """ Add test run number to master file """
-
-        # Sort by date, sample, serotype
-        # df.sort_values(by=['LABDT', 'Sample ID', 'PnC Serotype'], inplace=True)
+                    if idx == 0:
+                        writer.writerow(["Warnings:", w])
+                    else:
+                        writer.writerow(["", w])
+#
+                # plate list column names
+                writer.writerow([
+                        "Plate",
+                        "Read Time",
+                        "Sample 1",
+                        "Sample 2",
+                        "Sample 3",
+                        "Sample 4",
+                        "Plate Fail"])
 
-        # Columns to check test run (sample and seortype)
-        col_list = ['Sample ID', 'PnC Serotype']
+                # plate details
+                for r in self.plate_list:
+                    writer.writerow(r)
 
-        # Get nth instance for each sample/sero combo
-        df['Test Run'] = df.groupby(col_list).cumcount() + 1
+                csvFile.close()
 
-        # Get maximum number for each combo
-        max_counts = df.groupby(col_list).size()
-        max_counts = max_counts.to_frame(name='Max')
+        self.files.write(file_name, write_summary)
 
-        # Set index to match that of max_counts
-        df.set_index(col_list, inplace=True)
+    def update_master(self):
+        """ Update the master study with the sample results. Results are checked
+            for tested in error and added to the master journal - the master
+            database and CSV are updated from the journal by compact_master """
 
-        # Merge
-        df = df.merge(max_counts, how='left', left_index=True, right_index=True)
+        rows = [row for l in self.results_list for row in l]
+        outcomes = self.master_db.classify(rows, self.master_journal.pending_rows())
 
-        # Format
-        df['Test Run'] = df['Test Run'].astype(str)
-        df.Max = df.Max.astype(str)
+        # If tested in error - append to warnings list
+        for row, outcome in zip(rows, outcomes):
+            if outcome == TESTED_IN_ERROR:
+                self.append_test_error_warning(row)
 
-        # Create test run column
-        df['Test Run'] = df['Test Run'] + " of " + df['Max']
+        self.master_journal.append(rows)
 
-        # Reset index and drop max column
-        df.drop(columns='Max', inplace=True)
-        df.reset_index(inplace=True)
+    def compact_master(self):
+        """ Apply the master journal to the master database and write the CSV """
 
-        return df
+        self.master_journal.compact()
 
     def update_summary(self):
         """ Update the run_details summary file when printing extra plates 
             or re-printing plates """
 
-        # Import run_details as dataframe
-        df, save_name = self.import_summary()
+        # Import run_details, update and save (updated again if written by another run first)
+        self.files.update(self.get_summary_name(), lambda: self.import_summary()[0],
+                          self.fill_summary, lambda df, tmp: df.to_csv(tmp, header=False, index=False))
+
+    def fill_summary(self, df):
+        """ Add new plates and warnings to the run_details dataframe """
 
         # Update data frame with new plates, plate counts and fail counts
         df = update_plate_summary(df, self.plate_list)
@@ -498,17 +527,21 @@ class ELISAData:
         # if warning relates to a plate that is in the plate list, remove warning
         df = check_warnings(df)
 
-        # Reset index and Save
+        # Reset index
         df.reset_index(drop=True, inplace=True)
-        df.to_csv(save_name, header=False, index=False)
+
+        return df
+
+    def get_summary_name(self):
+        """ File name of run_details based on data directory """
+
+        file_name = "run_details " + self.assay.f007_ref + ".csv"
+        return os.path.join(os.path.abspath(self.savedir), file_name)
 
     def import_summary(self):
         """ Import the run_details file for the assay """
 
-        # Get file name of run_details based on data directory
-        file_name = "run_details " + self.assay.f007_ref + ".csv"
-        file_name = os.path.join(os.path.abspath(self.savedir),
-                                 file_name)
+        file_name = self.get_summary_name()
 
         # Import existing run_details file
         headers = ['ref', 'val', 'smp1', 'smp2', 'smp3', 'smp4', 'fail']
@@ -569,63 +602,23 @@ class ELISAData:
         self.trend_data.append(t_data)  # Append to master trending data list
 
     def update_trending(self):
-        """ Update the master trending file. Remove duplicate entries. """
-
-        # Get dataframe with new data (will remove duplicates and format)
-        df = self.fill_trending_details()
-
-        time_ctr = 0
+        """ Add this run's QC results to the trending store (only the partitions for
+            the run's years/serotypes are touched - re-printed plates are ignored),
+            check new plates against the Westgard rules then add them to the
+            trending file """
 
-        # check each second whether the trending csv file is open and write when it becomes free (timeout at 20 seconds)
-        while time_ctr < 20:
-            time.sleep(1)
-            time_ctr += 1
+        new_rows = self.trend_store.append(self.trend_data)
 
-            # Open trending file so it will be locked for editing
-            try:
-                with open(self.trend_file, 'w', newline='') as csvFile:
+        # QC trend warnings for the new plates
+        for w in self.qc_rules.update(new_rows):
+            self.warnings.append(w)
 
-                    # Save dataframe to csv
-                    df.to_csv(self.trend_file, index=False)
-                    csvFile.close()
-                    break
-
-            except PermissionError:
-                print("Already open")
-
-    def fill_trending_details(self):
-        """ Fill trending details with sample QC results. 
-            Create a dataframe as easier to find duplicates """
-
-        # Import trending file
-        df = self.get_trend_df()
-
-        # Write results
-        for row in self.trend_data:
-            df.loc[len(df)] = row
-
-        # Sort by date
-        df['Lab Date'] = pd.to_datetime(df['Lab Date'])
-        df.sort_values(by=['Lab Date'], inplace=True)
-        df['Lab Date'] = df['Lab Date'].dt.strftime('%d-%b-%y')
-
-        # Drop Duplicates (will have been re-printed)
-        df.drop_duplicates(keep='first', inplace=True)
-        return df
-
-    def get_trend_df(self):
-        """ Import the trending CSV file """
-
-        # Import trending (only get here if found at startup)        
-        df = pd.read_csv(self.trend_file,
-                         parse_dates=['Lab Date'],
-                         infer_datetime_format=True)
-
-        return df
+        self.trend_store.export()
 
     def get_xl_app(self):
         """ Find Excel app by id and return """
 
+        import xlwings as xw  # Only when writing the F093 through Excel
         for app in xw.apps:
             if app.pid == self.xl_id:
                 return app
@@ -690,58 +683,34 @@ def get_file_from_path(path):
     return f
 
 
-def get_f093_colnames(serotype, init=False):
-    
-    """ Return the column names for the f093 dataframe for result input.
-    If initialising, will contain study, sample and plate ID columns """
+def get_run_serotypes(files):
+    """ Serotypes of the plates in a run from the MARS file names """
 
-    serotype = str(serotype)
-    colnames = ['Result_' + serotype]
+    serotypes = []
 
-    # If initialising the F093
-    if init:
+    for f in files:
+        try:
+            plate_id = get_plate_id(f)
+        except IndexError:
+            continue
 
-        init_colnames = ['Sample ID',
-                         'Plate ID']
+        if len(plate_id) > 1 and plate_id[:-1] not in serotypes:
+            serotypes.append(plate_id[:-1])
 
-        colnames = init_colnames + colnames
+    return serotypes
 
-    return colnames
 
+def sort_serotypes(serotypes, curve_serotypes):
+    """ Unique serotypes in F093 order - by number, then as ordered in the curve file """
 
-def get_new_colnames(current_names, new_serotype):
-    ''' Get the column names for a new serotype for entry into f093 dataframe.
-        Returns a new list of columns names, after sorting the serotypes by
-        numerical order '''
+    curve_order = {str(s): idx for idx, s in enumerate(curve_serotypes)}
 
-    idx = 0
-    # Get new serotype as string and integer for sorting
-    new_serotype = str(new_serotype)
-    new_sero_num = int(new_serotype[:-1]) if new_serotype[-1].isalpha() else int(new_serotype)
-    
-    # Loop through existing names to get a list of existing serotypes
-    # If result column - get the serotype as a number
-    for idx, s in enumerate(current_names):
-        if "Result_" in s:
-            serotype = s[7:]
-            sero_num = serotype[:-1] if serotype[-1].isalpha() else serotype
-            sero_num = int(sero_num)
-
-            # If the serotype is already in the list - return
-            # If the serotype found > new serotype then break as should be
-            # inserted at this index
-            if new_serotype == serotype:
-                return
-            elif sero_num > new_sero_num:
-                idx -= 1
-                break
-
-    # Get the column names for the new serotype
-    new_column = "Result_" + new_serotype
-
-    current_names.insert(idx+1,new_column)
-        
-    return current_names
+    def sort_key(serotype):
+        num = serotype[:-1] if serotype[-1].isalpha() else serotype
+        num = int(num) if num.isdigit() else float('inf')
+        return num, curve_order.get(serotype, len(curve_order)), serotype
+
+    return sorted(set(str(s) for s in serotypes), key=sort_key)
 
 
 def get_sample_info(sample):
@@ -804,9 +773,9 @@ def create_table(ax, cell_text, columns, rows):
     return ax
 
 
-def get_table_details(data):
-    """ Return array of values to be used to create OD or Conc table
-        Input data as column from dataframe """
+def get_table_arrays(data):
+    """ Return arrays of values to be used to create OD and Conc tables,
+        with the row and column labels. Input data as plate dataframe """
 
     # Create array of 8x12
     ods = data['BlankCorrect'].unstack()
@@ -816,18 +785,17 @@ def get_table_details(data):
     columns = ods.columns.tolist()
     rows = ods.index.tolist()
 
-    # Replace NaN with 0
-    ods.fillna(0, inplace=True)
-    concs.fillna(0, inplace=True)
+    # Replace NaN with 0, round and report to 3dp
+    od_array = format_array(ods.fillna(0).values)
+    conc_array = format_array(concs.fillna(0).values)
+
+    return od_array, conc_array, rows, columns
 
-    # Round and report to 3dp
-    od_array = ods.apply(np.vectorize(round_to3)).values
-    conc_array = concs.apply(np.vectorize(round_to3)).values
 
-    od_df = pd.DataFrame(data=od_array, index=rows, columns=columns)
-    conc_df = pd.DataFrame(data=conc_array, index=rows, columns=columns)
+def format_array(values):
+    """ Return a 2D array as nested lists of 3dp strings """
 
-    return od_df, conc_df
+    return [[round_to3(v) for v in row] for row in values]
 
 
 def round_to3(val):
@@ -1055,6 +1023,12 @@ def check_warnings(df):
 
     return df
 
+def get_f093_name(name):
+    """ Column name as shown in the F093 (result columns by serotype) """
+
+    return name.replace("Result_", "PnC-IgG-ELISA type ")
+
+
 def import_f093_json(file_path):
     """ Import an existing F093 json file. """
     
@@ -1066,55 +1040,3 @@ def import_f093_json(file_path):
             "PnC-IgG-ELISA type ", "Result_")
     
     return df
-
-
-def check_edit_master(data_list, df):
-    """ IF NEED TO UPDATE DATAFRAME WITH NEW RESULT
-        This will only occur if everything is identical bar the result
-        i.e. same sample/serotype/plate/test date and technician.
-        Takes a list of plate data as input """
-
-    # Get the result from the list
-    new_result = data_list[3]
-    # Check list of everything bar result/amended result
-    check_list = list(data_list[i] for i in [0, 1, 2, 5, 6])
-
-    # Create a 'check' dataframe to see if everything but result has been input before
-    df_check = df.drop(columns=['Result', 'Amended Result', 'Test Run'])
-
-    # See if found matched plate and get df index
-    check_row = df_check[(df_check == check_list).all(axis=1)]
-    if not check_row.empty:
-        # Get the index of the plate
-        row_idx = check_row.index.values[0]
-        return row_idx, new_result
-    else:
-        return None, None
-
-
-def check_tested_inerror(data_list, df):
-    """ Check whether a valid sample has been returned previously
-        If it has then this sample is possibly tested in error and
-        should be amended """
-
-    # Check list of Sample and Serotype
-    check_list = list(data_list[i] for i in [0, 1])
-
-    # Create a 'check' dataframe to see if sample has been tested on this serotype before
-    df_check = df[['Sample ID', 'PnC Serotype']]
-
-    # See if found matched plate and get df index
-    check_row = df_check[(df_check == check_list).all(axis=1)]
-
-    if not check_row.empty:
-        # Get the index of the plate
-        row_idx = check_row.index.values
-        # Get original result(s)
-        orig_results = df.loc[df.index[row_idx], 'Result'].tolist()
-
-        # If the first letter of every result is not a letter
-        # At least one valid result previously
-        if not all(result[0].isalpha() for result in orig_results):
-            return True
-        else:
-            return False
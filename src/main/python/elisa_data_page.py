@@ -8,22 +8,24 @@ from PyQt5.QtWidgets import QMainWindow, QLabel, QGridLayout, QWidget, QVBoxLayo
 from win32api import GetSystemMetrics
 from datetime import datetime
 from settings_page import get_default_dir, PageSettings
-from assay import Assay
-from elisa_data import ELISAData
-from elisa import ELISA
+from report_assets import render_time_summary
+from file_coordinator import wait_summary, conflict_summary, skipped_summary
+from print_backends import get_print_backend
+from f007_reader import get_f007_model, READ_ERRORS
+from elisa import get_plate_id
+from processing_run import ProcessingRun, check_ignore_file, REQUIRED_PATHS, PDF_NOW, PDF_DEFERRED
 # from error_handling import show_exception_box
-from error_handling import RangeNotFoundError
-import time
 import os
 import pandas as pd
 from pathlib import Path
 import xlwings as xw
 import traceback
-import win32api
-import win32print
 import sys
 import re
 
+# Checkboxes for outputs that remain user options for all parameter settings
+OUTPUT_OPTIONS = ["cb_print", "cb_run_pdf", "cb_defer_pdf"]
+
 class WorkerSignals(QObject):
 
     finished = pyqtSignal()
@@ -33,6 +35,13 @@ class WorkerSignals(QObject):
     progress = pyqtSignal(int)
 
 
+class RunSignals(QObject):
+    """ Signals from processing stages to update the GUI """
+
+    stage = pyqtSignal(str)  # Stage started - text for progress label
+    pdfs_ready = pyqtSignal(object, bool)  # Plate reports rendered (elisa_data, run_pdf)
+
+
 class Worker(QRunnable):
 
     def __init__(self, fn, *args, **kwargs):
@@ -180,6 +189,8 @@ class DataTab(QWidget):
         self.cb_print = QCheckBox(objectName="cb_print", text="Print plate data")
         self.cb_print.setEnabled(True)
         self.cb_print.toggled.connect(lambda: self.print_checkbox_changed(self.cb_print))
+        self.cb_run_pdf = QCheckBox(objectName="cb_run_pdf", text="Create single run PDF")
+        self.cb_defer_pdf = QCheckBox(objectName="cb_defer_pdf", text="Create PDFs in background")
 
         # OD text boxes
         self.txt_od_upper = QLineEdit(objectName="txt_upper_od")
@@ -198,6 +209,8 @@ class DataTab(QWidget):
         group_layout.addWidget(self.cb_lower_od, 3, 0, 1, 1)
         group_layout.addWidget(self.cb_lloq, 4, 0, 1, 1)
         group_layout.addWidget(self.cb_print, 5, 0, 1, 1)
+        group_layout.addWidget(self.cb_run_pdf, 6, 0, 1, 1)
+        group_layout.addWidget(self.cb_defer_pdf, 7, 0, 1, 1)
         group_layout.addWidget(self.txt_od_upper, 2, 1, 1, 1)
         group_layout.addWidget(self.txt_od_lower, 3, 1, 1, 1)
 
@@ -221,11 +234,22 @@ class DataTab(QWidget):
         self.set_progress_transparent()
         self.progress_bar.setFormat(u"(%v / %m)")
 
+        # Background pdf progress (deferred pdfs) - own threadpool so it is not
+        # reset with each run
+        self.pdf_label = QLabel("")
+        self.pdf_pool = QThreadPool()
+
+        # Stage updates from the run worker
+        self.run_signals = RunSignals()
+        self.run_signals.stage.connect(self.progress_label.setText)
+        self.run_signals.pdfs_ready.connect(self.pdf_queue_worker)
+
         # Add to layout
         # layout_run.addWidget(self.progress_bar, 0,0)
         layout_run.addLayout(self.progress_layout, 0, 0, 2, 1)
         # layout_run.addItem(hor_spacer,0,1)
         layout_run.addWidget(self.btn_run, 1, 2)
+        layout_run.addWidget(self.pdf_label, 2, 0)
 
         # All layout
         layout_main.addLayout(layout_files)
@@ -247,30 +271,15 @@ class DataTab(QWidget):
         """ Initialise all parameters - used at startup and when Run Button clicked again """
 
         # Data objects and constants
-        self.QC_FILE = ''
-        self.CURVE_FILE = ''
-        self.XL_FILE = ''
-        self.TREND_FILE = ''
-        self.F093_FILE = ''
-        self.MASTER_PATH = ''
-        self.assay = None
-        self.elisa = None
-        self.elisa_data = None
-        self.savedir = ''
+        self.processing = None  # Current processing run
         self.cut_high_ods = 2
         self.cut_low_ods = 0.1
         self.apply_lloq = True
+        self.run_pdf = False
+        self.defer_pdf = False
 
         # Threadpool
         self.threadpool = QThreadPool()
-        self.file_check_errors = ""
-        self.object_errors = []
-        self.write_files_errors = []
-        self.trending_done = False
-        self.summary_done = False
-        self.master_done = False
-        self.f093_done = False
-        self.pdf_names = []
 
     def combo_changed(self, selection):
         """ Function to change checkboxes dependent on combobox settings"""
@@ -293,8 +302,8 @@ class DataTab(QWidget):
             for c in self.group_box.children():
                 name = c.objectName()
 
-                # If it's a checkbox or text and not print - check and disable
-                if name[:2] == "cb" and name[-5:] != "print":
+                # If it's a checkbox or text and not an output option - check and disable
+                if name[:2] == "cb" and name not in OUTPUT_OPTIONS:
                     c.setEnabled(False)
                     c.setChecked(True)
                 elif name[:2] == "tx":
@@ -311,18 +320,11 @@ class DataTab(QWidget):
         self.parms['OD_Upper'] = self.cut_high_ods
         self.parms['OD_Lower'] = self.cut_low_ods
         self.parms['LLOQ'] = self.apply_lloq
+        self.run_pdf = self.cb_run_pdf.isChecked()
+        self.defer_pdf = self.cb_defer_pdf.isChecked()
 
-        app = xw.App(visible=False)
-        app.screen_updating = False
-        app.display_alerts = False
-        self.xl_id = app.pid
-
-        # Show the progress bar and progress label
-        self.progress_bar.setValue(0)
-        worker = Worker(self.show_bar_prog)  # Any other args, kwargs are passed to the run function
-        worker.signals.finished.connect(self.done_show_bar)
-        self.threadpool.start(worker)
-        # self.threadpool.waitForDone()
+        # F007 and F093 are read/written without Excel
+        self.xl_id = None
 
         # Check F007 and MARS FILES not empty
         if not self.f007_file or not self.mars_files:
@@ -330,26 +332,45 @@ class DataTab(QWidget):
             self.write_errors_to_log(["F007 or MARS file information missing"])
             return
 
-        # Check that the files exist and add to constants if so
-        self.file_check_worker()
+        # Show the progress bar and progress label
+        self.set_button_states(False)  # Buttons disabled
+        self.progress_bar.setMaximum(100)
+        self.percent_progress(0)
+        self.progress_label.setVisible(True)
+        self.progress_label.setText("Checking required files...")
+        self.set_progress_opaque()
+
+        # Required file paths from the settings page
+        paths = {name: self.find_required_file(name) for name in REQUIRED_PATHS}
+
+        # Only get a printer if printing selected
+        print_backend = get_print_backend() if self.cb_print.isChecked() else None
+
+        self.processing = ProcessingRun(self.ctx, self.f007_file, self.mars_files, paths,
+                                        self.parms, xl_id=self.xl_id, amendments=self.amendments,
+                                        pdf_mode=PDF_DEFERRED if self.defer_pdf else PDF_NOW,
+                                        run_pdf=self.run_pdf, print_backend=print_backend,
+                                        pdfs_ready=self.run_signals.pdfs_ready.emit)
+
+        # Run the processing stages on a worker thread
+        worker = Worker(self.run_stages)
+        worker.signals.result.connect(self.done_run)  # List of errors (empty if none)
+        worker.signals.error.connect(self.thread_error)  # If an uncaught error occurs
+        worker.signals.progress.connect(self.percent_progress)  # Progress as percentage
+        self.threadpool.start(worker)
+
+    def run_stages(self, progress_callback):
+        """ Run the processing stages. Each stage starts once the stages it depends on
+            have finished, so printing and writing the summary files and F093 run
+            at the same time. Returns list of errors from the first stage to fail """
 
-        # Create data objects
+        return self.processing.run(progress_callback.emit, self.stage_started)
 
-        # Process plates
-        # self.threadpool.waitForDone()
-        # print(self.assay.study)
+    def stage_started(self, stage):
+        """ Show the stage label (if any) when a stage starts """
 
-        # print(str(self.threadpool.waitForDone()) + str(time.time() - self.start))
-        # print("i waited "+ str(time.time() - self.start))
-        # # # Check formatting of required files
-        # # file_formats_ok = self.check_file_formats()
-        #
-        # Process plate data
-        # self.process_plates_worker()
-        # self.process_plates()
-        #
-        # # Write to master files (trending, run_details, master study file)
-        # self.write_to_files()
+        if stage.label:
+            self.run_signals.stage.emit(stage.label)
 
     def get_parms(self):
         """ Get the OD limits and application of LLOQ """
@@ -397,71 +418,26 @@ class DataTab(QWidget):
             self.init_parms()
             self.kill_xl()
 
-    def show_bar_prog(self, progress_callback):
-
-        time.sleep(0.02)
-        return
-
-    def done_show_bar(self):
-        """ When finished displaying progress bar on btn_run_clicked """
-
-        # Format progress bar
-        self.set_button_states(False)  # Buttons disabled
-        self.progress_label.setVisible(True)
-        self.progress_label.setText("Checking required files...")
-        self.set_progress_opaque()
-
-    def done_file_check(self):
-        """ When file check has completed """
-
-        self.threadpool.waitForDone()
-        self.progress_label.setText("Creating data objects...")
-        self.data_object_worker()  # Create assay and elisa_data objects
-
-    def done_create_objects(self):
-        """ when data object have been created """
-
-        self.threadpool.waitForDone()
-        self.progress_bar.setValue(100)
+    def done_run(self, err_list):
+        """ When all stages have finished (or a stage returned errors) """
 
-        # If the assay object has successfully been created
-        # Begin processing elisa data
-        if self.assay:
-            self.process_plates_worker()
-        else:
+        if err_list:
+            self.result_error(err_list)
             return
 
-    def done_processing_data(self):
-        """ When finished processing elisa objects """
-
-        # Get default printer and check when printing is enabled
-        printer = win32print.GetDefaultPrinter()
-        do_print = self.cb_print.isChecked()
-
-        # If printing to pdf/XPS are default or print not selected - don't print
-        no_print = ['Print to PDF', 'XPS', 'Fax', 'OneNote']
-        if any(x.upper() in printer.upper() for x in no_print):
-            self.done_print_data()
-        elif not do_print:
-            self.done_print_data()
-        else:
-            self.progress_label.setText("Printing pdfs....")
-            self.print_worker()  # Begin printing PDFs
-
-    def done_print_data(self):
-        """ When PDFs have been printed """
+        # Report any print jobs that weren't accepted by the printer
+        if self.processing.print_errors:
+            self.write_errors_to_log(self.processing.print_errors)
 
-        # Begin writing summary data files (master study, trending, run_details
-        self.progress_label.setText("Writing summary data to file...")
-        self.write_files_worker()
+        # Report timings and F093 cells written
+        self.write_info_to_log(self.processing.elisa_data.get_diagnostics())
 
-    def done_write_files(self):
-        """ When finished writing files create F093"""
+        # Time waited for shared output files (master, trending, run details, F093)
+        files = self.processing.elisa_data.files
+        self.write_info_to_log(wait_summary(files.waits) + conflict_summary(files.conflicts) +
+                               skipped_summary(files.skipped))
 
-        # If not a repeated assay save data to Excel template
-        if self.assay.run_type != "repeats":
-            self.elisa_data.f093_to_excel()
-        self.progress_bar.setValue(100)
+        self.percent_progress(100)
         self.progress_label.setText("Finished")
         self.set_button_states(True)  # Re-enable buttons
 
@@ -485,439 +461,54 @@ class DataTab(QWidget):
         self.progress_label.setText("Operation cancelled")
         self.set_button_states(True)
 
-    def file_check_countdown(self, progress_callback):
-        """ A timer to run and update progress bar on file check progress
-            unless an error occurs """
-
-        # 0 to 100%
-        for n in range(0, 101):
-
-            # If any errors - add to list and return to run_error function
-            if self.file_check_errors:
-                err_list = self.file_check_errors
-                return err_list
-
-            # Otherwise - set to 100%
-            elif self.QC_FILE and self.CURVE_FILE and self.TREND_FILE and self.F093_FILE and self.MASTER_PATH:
-                progress_callback.emit(100)
-                return
-            else:
-                time.sleep(0.02)
-                progress_callback.emit(n)  # emit progress of file check
+    def pdf_queue_worker(self, elisa_data, run_pdf):
+        """ Convert deferred html reports to pdf in the background.
+            Carries on after the run has finished """
 
-    def get_object_countdown(self, progress_callback):
-        """ A timer to run and update progress bar on creation of data objects
-            unless an error occurs """
+        queue = elisa_data.pdf_queue
+        self.pdf_progress(0, queue.n_jobs)
 
-        # Format progress bar
-        self.progress_label.setText("Creating objects...")
-
-        # 0 to 100%
-        for n in range(0, 101):
-
-            # If gets to above 85 and still not created objects - slow down
-            if n > 85:
-                delay = 0.0125
-            else:
-                delay = 0.005
-
-            if self.object_errors:  # If any error has been picked up when creating objects - return as result
-                err_list = self.object_errors
-                return err_list
-            elif self.assay and self.elisa_data:  # Else if the objects exist - set progress to 100% and return
-                progress_callback.emit(100)
-                return
-            else:
-                time.sleep(delay)
-                progress_callback.emit(n)
-
-    def write_files_countdown(self, progress_callback):
-        """ A timer to run and update progress bar on writing files progress
-            unless an error occurs """
-
-        # Delay based on calculated time per file
-        delay = (len(self.mars_files) * 0.0474) + 4.023
-        delay /= 100
-
-        for n in range(0, 101):
-
-            if self.write_files_errors:  # If errors - return to run_error function
-                err_list = self.write_files_errors
-                return err_list
-
-            elif self.trending_done and self.summary_done and self.master_done:
-
-                # If created quickly, run remainder of progress
-                for m in range(n, 100):
-                    time.sleep(delay/12)
-                    progress_callback.emit(m)
-                return
-
-            else:
-                time.sleep(delay)
-                progress_callback.emit(n)  # Emit progress
-
-    def file_check_worker(self):
-        """ Start the progress worker object.
-            Check files and add to data constants if file check ok """
-
-        # COUNTDOWN
-        worker = Worker(self.file_check_countdown)  # Check file countdown
-        worker.signals.result.connect(self.result_error)  # When the function returns
-        worker.signals.error.connect(self.thread_error)  # If an uncaught error occurs
-        worker.signals.finished.connect(self.done_file_check)  # Finished file check
-        worker.signals.progress.connect(self.percent_progress)  # Emit progress
-
-        # RUN THE FUNCTION
-        worker2 = Worker(self.check_files_exist)  # Check required files exist
-        worker2.signals.error.connect(self.thread_error)  # If an uncaught error occurs
+        # Pass the data object and options as the run attributes will be reset
+        worker = Worker(self.convert_pdfs, elisa_data, run_pdf)
+        worker.signals.result.connect(self.write_info_to_log)
+        worker.signals.error.connect(self.pdf_thread_error)  # Uncaught error
+        worker.signals.progress.connect(lambda n: self.pdf_progress(n, queue.n_jobs))
+        worker.signals.finished.connect(self.done_convert_pdfs)
 
         # Execute
-        self.threadpool.start(worker)
-        self.threadpool.start(worker2)
+        self.pdf_pool.start(worker)
 
-    def data_object_worker(self):
-        """ Create assay and elisa_data objects on worker threads """
+    def convert_pdfs(self, elisa_data, run_pdf, progress_callback):
+        """ Convert all queued html reports then create the run pdf if required """
 
-        # COUNTDOWN
-        worker = Worker(self.get_object_countdown)  # Emit to progress bar
-        worker.signals.result.connect(self.result_error)  # When the function returns
-        worker.signals.error.connect(self.thread_error)  # If an uncaught error occurs
-        worker.signals.finished.connect(self.done_create_objects)  # Finished creating objects
-        worker.signals.progress.connect(self.percent_progress)  # Progress as percentage
+        elisa_data.pdf_queue.run(progress_callback)
 
-        # CREATE OBJECTS
-        worker2 = Worker(self.create_data_objects)  # Create data objects
-        worker2.signals.result.connect(self.result_error)  # When the function returns something
-        worker2.signals.error.connect(self.thread_error)  # When an uncaught error occurs
+        if run_pdf and elisa_data.pdf_list:
+            elisa_data.create_run_pdf()
 
-        # Execute
-        self.threadpool.start(worker)
-        self.threadpool.start(worker2)
-
-    def process_plates_worker(self):
-        """ Process the elisa data as worker threads """
-
-        # Change max int value of progress bar to number of files
-        max_cnt = len(self.mars_files)
-        self.progress_bar.setMaximum(max_cnt)
-
-        worker = Worker(self.process_plates)  # Process elisa data
-        worker.signals.result.connect(self.result_error)  # If the function returns
-        worker.signals.error.connect(self.thread_error)  # Uncaught error
-        worker.signals.finished.connect(self.done_processing_data)  # Finished processing data
-        worker.signals.progress.connect(self.int_progress)  # Emit as integer
-
-        # Execute worker
-        self.threadpool.start(worker)
-
-    def write_files_worker(self):
-        """ Write summary data - trending, master study data, run_details """
-
-        self.progress_bar.setMaximum(100)
-
-        # COUNTDOWN
-        worker = Worker(self.write_files_countdown)  # Countdown for writing files
-        worker.signals.result.connect(self.result_error)  # If function returns
-        worker.signals.error.connect(self.thread_error)  # If uncaught error in thread
-        worker.signals.finished.connect(self.done_write_files)  # Finished writing files
-        worker.signals.progress.connect(self.percent_progress)
-
-        # WRITE FILES
-        worker2 = Worker(self.write_to_files)  # Write data
-        worker2.signals.error.connect(self.thread_error)  # If uncaught error
+        # Conversion times for the background pdfs (written to log)
+        return render_time_summary(elisa_data.pdf_queue.render_times)
 
-        # Execute
-        self.threadpool.start(worker)
-        self.threadpool.start(worker2)
-
-    def print_worker(self):
-        """ Two workers to print pdfs and to detect jobs coming through """
+    def pdf_progress(self, n, n_jobs):
+        """ Background pdf progress """
 
-        # Set progress bar to number of files to print
-        self.progress_bar.setMaximum(len(self.pdf_names))
+        self.pdf_label.setText("Creating PDFs in background (" + str(n) + " / " + str(n_jobs) + ")")
 
-        # COUNTDOWN
-        worker = Worker(self.count_print_jobs)  # Loop through n jobs
-        worker.signals.result.connect(self.result_error)
-        worker.signals.error.connect(self.thread_error)
-        worker.signals.finished.connect(self.done_print_data)
-        worker.signals.progress.connect(self.int_progress)
+    def done_convert_pdfs(self):
+        """ When deferred pdfs have all been created """
 
-        # PRINT DATA
-        worker2 = Worker(self.print_pdf)  # Print pdfs
-        worker2.signals.error.connect(self.thread_error)  # Uncaught error
-
-        # Execute
-        self.threadpool.start(worker)
-        self.threadpool.start(worker2)
+        self.pdf_label.setText("PDFs created")
 
-    def get_data_constants(self):
-        """ Get a list of constants to assign to main run script """
+    def pdf_thread_error(self, exc_info):
+        """ When error raised creating pdfs in background. The run itself
+            may still be going so only report the error """
 
-        self.savedir = os.path.join(Path(self.mars_files[0]).parent)  # PDF directory
-        self.QC_FILE = self.find_required_file("qc_path")
-        self.CURVE_FILE = self.find_required_file("curve_path")
-        self.TREND_FILE = self.find_required_file("trending_path")
-        self.F093_FILE = self.find_required_file("f093_path")
-        self.MASTER_PATH = self.find_required_file("master_path")
-
-    def create_data_objects(self, progress_callback):
-        """ Create assay and elisa_data objects """
-
-        self.progress_label.setText("Creating data objects...")
-
-        # Assay object
-        try:
-            self.assay = Assay(self.f007_file, self.QC_FILE, self.CURVE_FILE, self.xl_id, self.mars_files)
-            # Master study testing file
-            master_str = self.assay.sponsor + "_" + self.assay.study + "_Master.csv"
-            master_file = os.path.join(self.MASTER_PATH, master_str)
-        except RangeNotFoundError:
-            self.object_errors.append("Error creating assay object - please check F007 file")
-            return self.object_errors
-
-        # Create ELISA Data Object
-        try:
-            self.elisa_data = ELISAData(assay=self.assay, savedir=self.savedir,
-                                        trend_file=self.TREND_FILE, f093_file=self.F093_FILE,
-                                        master_file=master_file, xl_id=self.xl_id,
-                                        parms_dict=self.parms, ctx=self.ctx)
-        except RangeNotFoundError:
-            self.object_errors.append("Error creating elisa data object")
-            return self.object_errors
-
-        return []
-
-    def process_plates(self, progress_callback):
-        """ Loop through elisa files, create elisa object and process data """
-
-        self.progress_label.setText("Processing plate data")
-
-        # Loop through files in assay list
-        n_files = 0
-        progress_callback.emit(0)
-
-        for f in self.assay.files:
-
-            # Check if should ignore file
-            ignore_file = self.check_ignore_file(f)
-            if ignore_file:
-                continue
-
-            n_files += 1
-
-            # Create ELISA Object
-            self.elisa = ELISA(f, self.assay.first_list, self.assay.repeats_list,
-                                   self.assay.qc_limits, self.assay.curve_vals, self.savedir,
-                                   self.cut_high_ods, self.cut_low_ods, self.apply_lloq, self.amendments)
-
-            # Add file to list of names for printing
-            try:
-                self.pdf_names.append(self.elisa.pdf_path)
-            except AttributeError:
-                continue
-
-            # Check data imported correctly
-            if self.elisa.data is None or self.elisa.parameters is None:
-                progress_callback.emit(n_files)
-                continue
-
-            # Check that the assay and ELISA details match
-            f007_ok, f007_details = self.check_f007()
-            if not f007_ok:
-                self.display_error_box()
-                self.write_errors_to_log([f007_details])
-                break
-
-            # Create pdf, F093 and get trending data
-            self.input_data()
-            progress_callback.emit(n_files)
-
-    def input_data(self):
-        """ Create the pdf, create F093 if required, get trending data and add to list """
-
-        # Input data to html template and Create pdf
-        self.elisa_data.input_plate_data(self.elisa)
-
-        # Input data to dataframe
-        if self.assay.run_type != "repeats":
-            self.elisa_data.data_to_table(self.elisa)
-
-        # Save trending data to list
-        if self.elisa.plate_fail == "R4" or not self.elisa.template:
-            return
-        else:
-            self.elisa_data.get_trend_data(self.elisa)
-
-    def print_pdf(self, progress_callback):
-        """ Loop through pdf files and print """
-
-        # Get printer name
-        printer = win32print.GetDefaultPrinter()
-
-        # Loop through pdf names
-        for p in self.pdf_names:
-
-            # Print pdf
-            win32api.ShellExecute(0, "print", p, '/d:"%s"' % printer, ".", 0)
-
-    def count_print_jobs(self, progress_callback):
-        """ Search for print jobs and emit counter """
-
-        default = win32print.GetDefaultPrinter()  # Default printer name
-        phandle = win32print.OpenPrinter(str(default))  # Get printer handle
-
-        jobs_found = 0  # Counter for number of jobs found
-        n_jobs = len(self.pdf_names)  # Total number of jobs to be found
-        job_ids = []  # Unique job ids so don't recount
-
-        # Carry on until all jobs found in queue
-        while jobs_found < n_jobs:
-
-            jobs = win32print.EnumJobs(phandle, 0, -1, 1)  # Get list of jobs for printer
-
-            for job, user in enumerate(j['pUserName'] for j in jobs):
-                if user == os.getlogin():  # If sent by current user - get the job id
-                    job_id = jobs[job]['JobId']
-
-                    if job_id not in job_ids:  # If new job - increase number and add job id to list
-                        jobs_found += 1
-                        progress_callback.emit(jobs_found)  # Emit number of jobs found
-                        job_ids.append(job_id)
-
-            time.sleep(0.1)  # Search for new job every 0.1 seconds
-
-    def write_to_files(self, progress_callback):
-        """ Write to trending file, run_details and master study file """
-
-        # Trend QC data
-        self.elisa_data.update_trending()
-        self.trending_done = True
-
-        # If master study file doesn't exist - create. Else - update
-        if not os.path.isfile(self.elisa_data.master_file):
-            self.elisa_data.create_master()
-        else:
-            self.elisa_data.update_master()
-            print("here")
-        self.master_done = True
-
-        # Summary table of testing details
-        summary_name = os.path.join(os.path.abspath(self.savedir),
-                                    'run_details ' + self.assay.f007_ref + '.csv')
-
-        # Check for suspected R35s
-        df_blocks, block_list = self.get_block_list()
-
-        # If list of blocks (may not be if repeats) - check for R35s
-        if block_list:
-            new_warnings = get_r35s(df_blocks, block_list)
-
-            # Add any R35 warnings that may have been returned
-            for w in new_warnings:
-                self.elisa_data.warnings.append(w)
-
-        # If run_details doesn't exist - create. Else - update
-        if not os.path.isfile(summary_name):
-            self.elisa_data.create_summary()
-        else:
-            self.elisa_data.update_summary()
-            
-        self.summary_done = True
-
-    def get_block_list(self):
-        """ Get a list of blocks to check for R35s """
-
-        # List of all plates processed
-        df = self.elisa_data.df_plates
-
-        block_list = []
-        # Just check sample duplicates (i.e. the same list of samples on different plates)
-        colnames = df.columns[1:-1].tolist()
-        # Get list of duplicates - keep all
-        dup_rows = df.duplicated(subset=colnames, keep=False)
-        # Subset df
-        df_dups = df[dup_rows]
-
-        # If duplicates
-        if not df_dups.empty:
-            # Group by duplicate and create comma separated list of blocks
-            grouped = df_dups.groupby(colnames)
-            r_blocks = grouped.agg(lambda x: ','.join(x))['Plate'].tolist()
-            [block_list.append(f.split(",")) for f in r_blocks]
-
-        return df_dups, block_list
-
-    def check_ignore_file(self, file):
-        """ Check that the file in the assay object is not a pdf, xlsm, json or run_details """
-
-        # Split file name to see if run details file
-        run_split = file.split("\\")[-1]
-        run_split = run_split.split(" ")[0]
-
-        # If file is pdf, xlsm, json or name is run details - ignore
-        if Path(file).suffix.upper() == '.PDF' \
-                or Path(file).suffix.upper() == '.XLSM' \
-                or Path(file).suffix.upper() == '.JSON' \
-                or run_split == "run_details" \
-                or not re.findall('\w{2}\d{6}', run_split):
-            return True
-        else:
-            return False
-
-    def check_f007(self):
-        """ Check that the details on the F007 match those obtained from MARS file """
-
-        # Check F007 details matches read time
-        if self.assay.tech != self.elisa.barc_tech:
-            return False, \
-                   "Technician initials in F007 (" + self.assay.tech + ") " \
-                   + "don't match those in barcode (" + self.elisa.barc_tech + ") "
-        elif self.assay.date != self.elisa.barc_date:
-            return False, \
-                   "Assay date in F007 (" + self.assay.date + ") " \
-                   + "doesn't match that in barcode (" + self.elisa.barc_date + ") "
-        else:
-            return True, ""
-
-    def check_files_exist(self, progress_callback):
-        """ Check that the required files exist """
-
-        # Get settings page
-        page = find_widget("path_settings")
-
-        # List of widgets containing filenames/filepaths to check
-        widget_dict = {"qc_path": "QC Limits file not found",
-                       "curve_path": "IgG Curve concentrations not found",
-                       "trending_path": "Trending file not found",
-                       "f093_path": "F093 template not found"}
-
-        # List of errors
-        err_list = []
-
-        # Loop through file widgets
-        for key, val in widget_dict.items():
-
-            # Get file path from text based on object name
-            path_text = page.findChild(QLineEdit, key).text()
-
-            # Check if is a file
-            if not os.path.isfile(path_text):
-                err_list.append(val)
-
-        # Check that the master study directory exists
-        path_text = page.findChild(QLineEdit, "master_path").text()
-        if not os.path.isdir(path_text):
-            err_list.append("Master study data directory not found")
-
-        # WRite to error log and display error message box
-        if err_list:
-            self.file_check_errors = err_list
-            return err_list
-        else:
-            self.get_data_constants()
-            return []
+        self.error_log.setTextColor(QColor(255, 0, 0))  # Red 'Error' message
+        self.error_log.append("An error occurred creating PDFs:\n")
+        self.error_log.setTextColor(QColor(0, 0, 0))
+        self.error_log.append('{0}: {1}'.format(exc_info[0].__name__, exc_info[1]))
+        self.error_log.append("\n" + exc_info[2] + "\n\n")
+        self.pdf_label.setText("PDF creation cancelled")
 
     def write_errors_to_log(self, error_list):
         """ Take in a list and write out errors to log """
@@ -934,6 +525,15 @@ class DataTab(QWidget):
         self.error_log.append("")
         self.error_log.append("")
 
+    def write_info_to_log(self, lines):
+        """ Write information (e.g. timings) to the log """
+
+        for line in lines:
+            self.error_log.append(line)
+
+        if lines:
+            self.error_log.append("")
+
     def display_error_box(self, warning="An error has occurred", prompt_error=True):
         """ Display a generic error message """
 
@@ -1027,23 +627,29 @@ class DataTab(QWidget):
         """ Loose check to see if expected sheets are in F007 and return
             sample table as dataframe """
 
-        # Excel Object
-        xl = pd.ExcelFile(self.f007_file)
-
-        # Get all sheet names
-        all_sheets = xl.sheet_names
+        # F007 read when selected (or now if not finished/changed since)
+        try:
+            model = get_f007_model(self.f007_file)
+        except READ_ERRORS:
+            return None
 
-        # Test for these three sheets
-        # If detect all, parse sample table
-        test_list = ['Plate Layout', 'Sample Table', 'Sponsors and Study IDs']
-        if all(x in all_sheets for x in test_list):
-            df = xl.parse('Sample Table',
-                          dtype={'Sample 1': 'str', 'Sample 2': 'str',
-                                 'Sample 3': 'str', 'Sample 4': 'str'})
-            return df
+        # Test for expected sheets - if detect all, return sample table
+        if model.is_valid():
+            return model.sample_table()
         else:
             return None
 
+    def read_f007(self, f007_file, progress_callback):
+        """ Read the F007 so it is ready for amendments and processing """
+
+        get_f007_model(f007_file)
+
+    def f007_read_error(self, exc_info):
+        """ F007 couldn't be read in the background - report it (the run will
+            report it again if the file is used) """
+
+        self.write_errors_to_log(["Unable to read F007 - " + '{0}: {1}'.format(exc_info[0].__name__, exc_info[1])])
+
 
     def general_popup(self, message):
         """ A general notice popup box"""
@@ -1082,6 +688,11 @@ class DataTab(QWidget):
             self.f007_file = filename[0].replace("/","\\")
             self.txt_f007.setText(filename[0].replace("/","\\"))
 
+            # Read the F007 in the background
+            worker = Worker(self.read_f007, self.f007_file)
+            worker.signals.error.connect(self.f007_read_error)
+            self.threadpool.start(worker)
+
     def btn_mars_clicked(self):
         """ Search for and select MARS files for processing ELISA data """
 
@@ -1109,7 +720,7 @@ class DataTab(QWidget):
         # Save filenames to attribute
         self.mars_files = filenames[0]
         self.mars_files = [f.replace("/","\\") for f in self.mars_files]
-        self.mars_files = [x for x in self.mars_files if not self.check_ignore_file(x)]
+        self.mars_files = [x for x in self.mars_files if not check_ignore_file(x)]
 
         # Get filenames only and display in lineedit as comma-separated list
         filenames = [f.split('/')[-1] for f in filenames[0]]
@@ -1620,63 +1231,3 @@ def get_geometry():
     height = 800 / 1080 * screen_height
 
     return x, y, width, height
-
-
-def get_plate_id(filename):
-    """ Get technician, date and plate ID from barcode """
-
-    # Extract barcode from filename
-    barcode = os.path.split(filename)[-1]
-
-    # Get rid of protocol name
-    barcode = barcode.split("_")[1].split(".")[0]
-
-    # Check if last character is alpga
-    if barcode[0].isalpha():
-        bstring = barcode[1:]
-    else:
-        bstring = barcode
-
-    # Get details - extract portion of barcode
-
-    if bstring[-2:].isalpha():  # If two letters at end
-        plate_id = bstring[:-10]
-
-    elif bstring[-1].isalpha():  # If one letter at end
-        plate_id = bstring[:-9]
-
-    else:  # If no letters at end
-        plate_id = bstring[:-8]
-
-    return plate_id
-
-
-def get_r35s(df, block_list):
-    """ Check for suspected R35s from list of blocks """
-
-    new_warnings = []
-    # Subset by block
-    for plates in block_list:
-
-        block_df = df[df['Plate'].isin(plates)]
-
-        # Calculate % fail
-        percent_fail = block_df['Fail'].notna().sum() / len(block_df.index) * 100
-
-        # If >70% R35
-        # Check if all plates have same block ID and return just that if so
-        is_r35 = True if percent_fail > 70 else False
-        if is_r35:
-
-            # Check if all plates are in block A for example
-            whole_block = all(plate[-1] == plates[0][-1] for plate in plates)
-
-            if whole_block:
-                block_str = plates[0][-1]
-            else:
-                block_str = '[' + ','.join(plates) + ']'
-
-            r35_string = 'Suspected R35 on block ' + block_str + ' Please check and amend if necessary'
-            new_warnings.append(r35_string)
-
-    return new_warnings
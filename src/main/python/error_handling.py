@@ -1,5 +1,4 @@
 import sys
-import xlwings as xw
 import traceback
 import logging
 from PyQt5 import QtCore, QtWidgets
@@ -36,6 +35,7 @@ def show_exception_box(log_msg):
         log.debug("No QApplication instance available.")
 
     # If there are any non-visible Excel instances - kill upon Error
+    import xlwings as xw
     app_list = []
     for a in xw.apps:
         if not a.visible:
@@ -74,15 +74,6 @@ class UncaughtHook(QtCore.QObject):
             self._exception_caught.emit(log_msg)
 
 
-class RangeNotFoundError(Exception):
-    """ Custom exception when range is not found """
-    def __init__(self, data):
-        self.data = data
-
-    def __str__(self):
-        return repr(self.data)
-
-
 # create a global instance of our class to register the hook
 # def create_hook(text_box):
 qt_exception_hook = UncaughtHook()
\ No newline at end of file
@@ -0,0 +1,389 @@
+import os
+import re
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+# Workbook XML namespaces
+NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+NS_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+NS_PKG = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+# Built-in number formats that are dates/times
+DATE_FORMAT_IDS = set(range(14, 23)) | {45, 46, 47}
+
+# Sheets expected in an F007
+F007_SHEETS = ['Plate Layout', 'Sample Table', 'Sponsors and Study IDs']
+
+# Errors raised reading a file that isn't a valid workbook
+READ_ERRORS = (OSError, KeyError, ValueError, zipfile.BadZipFile, ET.ParseError)
+
+# Models already read - path: F007Model (replaced when the file changes)
+f007_models = {}
+f007_lock = threading.Lock()
+
+
+class RangeNotFoundError(Exception):
+    """ Custom exception when range is not found """
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return repr(self.data)
+
+
+class F007Reader:
+    """ Read cell values from an F007 workbook (.xlsm) without Excel by parsing the
+        workbook XML. Values are returned as xlwings would: numbers as float, date
+        formatted cells as datetime and empty cells as None """
+
+    def __init__(self, path):
+
+        self.path = path  # F007 file path
+        self.sheets = {}  # Sheet name: file in archive
+        self.names = {}  # Defined name (upper case): (sheet name, range)
+        self.shared_strings = []
+        self.date_styles = set()  # Cell style indexes with a date format
+        self.epoch = datetime(1899, 12, 30)
+        self.cells = {}  # Sheet name: {(row, col): value} (read when needed)
+        self.occupied = {}  # Sheet name: set of (row, col) that aren't blank
+
+        with zipfile.ZipFile(path) as zf:
+            self.read_workbook(zf)
+            self.read_shared_strings(zf)
+            self.read_styles(zf)
+
+    def read_workbook(self, zf):
+        """ Sheet files and defined names """
+
+        workbook = ET.fromstring(zf.read('xl/workbook.xml'))
+        rels = ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+        targets = {r.get('Id'): r.get('Target') for r in rels.iter(NS_PKG + 'Relationship')}
+
+        # 1904 date system (older Mac workbooks)
+        props = workbook.find(NS_MAIN + 'workbookPr')
+        if props is not None and props.get('date1904') in ('1', 'true'):
+            self.epoch = datetime(1904, 1, 1)
+
+        for sheet in workbook.iter(NS_MAIN + 'sheet'):
+            target = targets[sheet.get(NS_REL + 'id')]
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = 'xl/' + target
+            self.sheets[sheet.get('name')] = target
+
+        # Workbook level names take priority over sheet level names
+        for name in workbook.iter(NS_MAIN + 'definedName'):
+            key = name.get('name').upper()
+            if key in self.names and name.get('localSheetId') is not None:
+                continue
+
+            ref = split_reference(name.text or '')
+            if ref is not None:
+                self.names[key] = ref
+
+    def read_shared_strings(self, zf):
+        """ Strings table referenced by text cells """
+
+        try:
+            sst = ET.fromstring(zf.read('xl/sharedStrings.xml'))
+        except KeyError:
+            return
+
+        for si in sst.iter(NS_MAIN + 'si'):
+            self.shared_strings.append(get_text(si))
+
+    def read_styles(self, zf):
+        """ Find which cell styles are date formats """
+
+        try:
+            styles = ET.fromstring(zf.read('xl/styles.xml'))
+        except KeyError:
+            return
+
+        # Custom number formats
+        formats = {}
+        for fmt in styles.iter(NS_MAIN + 'numFmt'):
+            formats[int(fmt.get('numFmtId'))] = fmt.get('formatCode', '')
+
+        cell_xfs = styles.find(NS_MAIN + 'cellXfs')
+        if cell_xfs is None:
+            return
+
+        for idx, xf in enumerate(cell_xfs.iter(NS_MAIN + 'xf')):
+            fmt_id = int(xf.get('numFmtId', 0))
+            if fmt_id in DATE_FORMAT_IDS or is_date_format(formats.get(fmt_id, '')):
+                self.date_styles.add(idx)
+
+    def read_sheet(self, sheet):
+        """ Read every cell value in a sheet """
+
+        if sheet in self.cells:
+            return
+
+        if sheet not in self.sheets:
+            raise RangeNotFoundError("Sheet not found in F007: " + sheet)
+
+        cells = {}
+        occupied = set()
+
+        with zipfile.ZipFile(self.path) as zf:
+            root = ET.fromstring(zf.read(self.sheets[sheet]))
+
+        for c in root.iter(NS_MAIN + 'c'):
+            row, col = split_cell(c.get('r'))
+            value, filled = self.get_cell_value(c)
+
+            if filled:
+                occupied.add((row, col))
+                cells[(row, col)] = value
+
+        self.cells[sheet] = cells
+        self.occupied[sheet] = occupied
+
+    def get_cell_value(self, c):
+        """ Value of a cell element and whether the cell is filled """
+
+        cell_type = c.get('t', 'n')
+        v = c.find(NS_MAIN + 'v')
+        text = v.text if v is not None else None
+        filled = v is not None or c.find(NS_MAIN + 'f') is not None
+
+        if cell_type == 'inlineStr':
+            inline = c.find(NS_MAIN + 'is')
+            value = get_text(inline) if inline is not None else None
+            filled = inline is not None
+        elif text is None:
+            value = None
+        elif cell_type == 's':
+            value = self.shared_strings[int(text)]
+        elif cell_type == 'str':
+            value = text
+        elif cell_type == 'b':
+            value = text == '1'
+        elif cell_type == 'e':
+            value = None
+        else:
+            value = float(text)
+            if int(c.get('s', 0)) in self.date_styles:
+                value = self.to_datetime(value)
+
+        # Empty strings are returned as None (as xlwings)
+        if value == '':
+            value = None
+
+        return value, filled
+
+    def to_datetime(self, serial):
+        """ Convert an Excel serial date to datetime """
+
+        # Excel stores times to the millisecond
+        return self.epoch + timedelta(milliseconds=round(serial * 86400000))
+
+    def name_value(self, name):
+        """ Value of a defined name. A single cell as a value, a row or
+            column as a list and anything larger as a list of rows """
+
+        try:
+            sheet, ref = self.names[name.upper()]
+        except KeyError:
+            raise RangeNotFoundError("F007 Range (" + name + ") Not Found")
+
+        self.read_sheet(sheet)
+
+        top, left, bottom, right = split_range(ref)
+        cells = self.cells[sheet]
+        rows = [[cells.get((r, c)) for c in range(left, right + 1)]
+                for r in range(top, bottom + 1)]
+
+        if len(rows) == 1 and len(rows[0]) == 1:
+            return rows[0][0]
+        elif len(rows) == 1:
+            return rows[0]
+        elif len(rows[0]) == 1:
+            return [r[0] for r in rows]
+        else:
+            return rows
+
+    def current_region(self, sheet, ref, numbers=None):
+        """ Values of the block of filled cells around a cell as a list of rows
+            (as Range.current_region). Numbers are converted with numbers() if given """
+
+        self.read_sheet(sheet)
+        occupied = self.occupied[sheet]
+        cells = self.cells[sheet]
+
+        top, left, _, _ = split_range(ref)
+        bottom, right = top, left
+
+        # Expand while any cell next to the region (including diagonals) is filled
+        expanded = True
+        while expanded:
+            expanded = False
+            rows = range(top - 1, bottom + 2)
+            cols = range(left - 1, right + 2)
+
+            if top > 1 and any((top - 1, c) in occupied for c in cols):
+                top -= 1
+                expanded = True
+            if any((bottom + 1, c) in occupied for c in cols):
+                bottom += 1
+                expanded = True
+            if left > 1 and any((r, left - 1) in occupied for r in rows):
+                left -= 1
+                expanded = True
+            if any((r, right + 1) in occupied for r in rows):
+                right += 1
+                expanded = True
+
+        region = []
+        for r in range(top, bottom + 1):
+            row = []
+            for c in range(left, right + 1):
+                value = cells.get((r, c))
+                if numbers is not None and isinstance(value, float):
+                    value = numbers(value)
+                row.append(value)
+            region.append(row)
+
+        return region
+
+    def cell_value(self, sheet, ref):
+        """ Value of a single cell """
+
+        self.read_sheet(sheet)
+        row, col = split_cell(ref)
+        return self.cells[sheet].get((row, col))
+
+
+class F007Model:
+    """ The parts of an F007 used for processing and amendments, read once.
+        Shared by Assay, the amendments window and the F007/barcode check """
+
+    def __init__(self, path):
+
+        self.path = path  # F007 file path
+        self.mtime = os.path.getmtime(path)  # Modified time when read
+        self.reader = F007Reader(path)
+        self.sheet_names = list(self.reader.sheets)
+
+        # Sample table from A2 (header row first) - empty if no sample table sheet
+        if 'Sample Table' in self.reader.sheets:
+            self.sample_start = self.reader.cell_value('Sample Table', 'A2')
+            self.sample_rows = self.reader.current_region('Sample Table', 'A2', numbers=int)
+        else:
+            self.sample_start = None
+            self.sample_rows = []
+
+        # Read the sheets of every defined name now so the model is only read from
+        for sheet, _ in self.reader.names.values():
+            if sheet in self.reader.sheets:
+                self.reader.read_sheet(sheet)
+
+    def name_value(self, name):
+        """ Value of a defined name """
+
+        return self.reader.name_value(name)
+
+    def is_valid(self):
+        """ Loose check that the expected sheets are in the F007 """
+
+        return all(x in self.sheet_names for x in F007_SHEETS)
+
+    def sample_table(self):
+        """ Sample table as a new dataframe with sample IDs as strings """
+
+        if not self.sample_rows:
+            return pd.DataFrame()
+
+        header = self.sample_rows[0]
+        rows = [[r[0]] + [str(x) if x is not None else np.nan for x in r[1:]]
+                for r in self.sample_rows[1:]]
+
+        return pd.DataFrame(rows, columns=header)
+
+
+def get_f007_model(path):
+    """ Return the F007 model for a file, reading it only if it hasn't been
+        read before or has changed since """
+
+    key = os.path.normcase(os.path.abspath(path))
+    mtime = os.path.getmtime(path)
+
+    # Only one thread reads at a time (e.g. background read on selection and a run)
+    with f007_lock:
+        model = f007_models.get(key)
+
+        if model is None or model.mtime != mtime:
+            model = F007Model(path)
+            f007_models[key] = model
+
+    return model
+
+
+def get_text(element):
+    """ Text of a string item, joining rich text runs (ignoring phonetic text) """
+
+    text = []
+    for child in element:
+        if child.tag == NS_MAIN + 't':
+            text.append(child.text or '')
+        elif child.tag == NS_MAIN + 'r':
+            t = child.find(NS_MAIN + 't')
+            if t is not None:
+                text.append(t.text or '')
+
+    return ''.join(text)
+
+
+def is_date_format(code):
+    """ Check if a custom number format code is a date or time """
+
+    # Remove quoted text, escaped characters and colours/conditions
+    code = re.sub(r'"[^"]*"|\\.|\[[^\]]*\]', '', code)
+    return bool(re.search(r'[dmyhs]', code, re.IGNORECASE))
+
+
+def split_reference(text):
+    """ Split a defined name reference ('Sheet Name'!$A$1:$B$2) into sheet and range """
+
+    if '!' not in text or '#REF' in text:
+        return None
+
+    sheet, ref = text.rsplit('!', 1)
+
+    # Remove quotes around sheet names with spaces
+    if sheet.startswith("'") and sheet.endswith("'"):
+        sheet = sheet[1:-1].replace("''", "'")
+
+    return sheet, ref.replace('$', '')
+
+
+def split_cell(ref):
+    """ Row and column numbers of a cell reference (e.g. B3 - 3, 2) """
+
+    # Not a cell (e.g. a whole column or a name defined by a formula)
+    match = re.match(r'([A-Z]{1,3})(\d+)$', ref.replace('$', '').upper())
+    if match is None:
+        raise RangeNotFoundError("F007 reference (" + ref + ") is not a cell range")
+    letters, row = match.groups()
+
+    col = 0
+    for ch in letters:
+        col = col * 26 + ord(ch) - ord('A') + 1
+
+    return int(row), col
+
+
+def split_range(ref):
+    """ Top, left, bottom and right of a range reference (e.g. A2:C4) """
+
+    parts = ref.split(':')
+    top, left = split_cell(parts[0])
+    bottom, right = split_cell(parts[-1])
+
+    return top, left, bottom, right
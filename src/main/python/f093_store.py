@@ -0,0 +1,207 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+MANIFEST = 'manifest.json'
+
+
+class F093Store:
+    """ Working copy of the F093 results table (Sample ID, Plate ID and a result
+        column per serotype) stored as .npy files per column - text cells, number
+        cells (results kept as numbers) and missing cells. New serotype columns
+        are added without rewriting the others """
+
+    def __init__(self, path):
+
+        self.path = path  # Store directory
+        self.manifest = self.read_manifest()  # Columns, files and number of rows
+
+    def read_manifest(self):
+        """ Read the manifest - None if there is no store """
+
+        try:
+            with open(os.path.join(self.path, MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def exists(self):
+        return self.manifest is not None
+
+    def load(self):
+        """ Load the table as a dataframe """
+
+        if not self.exists():
+            return pd.DataFrame()
+
+        # Columns are read whole - pandas holds text as objects so a memory-mapped
+        # string array would be copied anyway
+        data = {}
+        for col in self.manifest['columns']:
+            values = np.load(os.path.join(self.path, col['file'])).astype(object)
+
+            # Results (numbers rather than text)
+            if col['numbers']:
+                numbers = np.load(os.path.join(self.path, col['numbers']))
+                is_number = ~np.isnan(numbers)
+                values[is_number] = numbers[is_number]
+
+            # Cells with no result yet
+            if col['missing']:
+                values[np.load(os.path.join(self.path, col['missing']))] = np.nan
+
+            data[col['name']] = values
+
+        # Columns of results only as float (typed as numbers in the json export)
+        names = [col['name'] for col in self.manifest['columns']]
+        return pd.DataFrame(data, columns=names, index=range(self.manifest['n_rows'])).infer_objects()
+
+    def save(self, df):
+        """ Save a dataframe. Only new columns and columns that have changed
+            since last saved are written """
+
+        os.makedirs(self.path, exist_ok=True)
+
+        # Different rows - every column is written again
+        if self.exists() and self.manifest['n_rows'] == len(df.index):
+            stored = {col['name']: col for col in self.manifest['columns']}
+        else:
+            stored = {}
+
+        columns = []
+        for name in df.columns:
+            values = df[name].values
+            col = stored.get(name)
+
+            if col is None or self.column_changed(col, values):
+                col = self.write_column(name, values)
+
+            columns.append(col)
+
+        self.manifest = {'n_rows': len(df.index), 'columns': columns}
+        write_json(os.path.join(self.path, MANIFEST), self.manifest)
+
+        self.remove_unused()
+
+    def remove_unused(self):
+        """ Remove column files no longer in the manifest (e.g. columns of an
+            earlier layout). Only done once the new manifest is saved """
+
+        used = set()
+        for col in self.manifest['columns']:
+            used.add(col['file'])
+            for f in (col['missing'], col['numbers']):
+                if f:
+                    used.add(f)
+
+        for f in os.listdir(self.path):
+            if f.endswith('.npy') and f not in used:
+                try:
+                    os.remove(os.path.join(self.path, f))
+                except OSError:
+                    pass
+
+    def column_changed(self, col, values):
+        """ Check if a column differs from the stored column """
+
+        stored = np.load(os.path.join(self.path, col['file']), mmap_mode='r')
+        missing = pd.isnull(values)
+
+        if col['missing']:
+            stored_missing = np.load(os.path.join(self.path, col['missing']), mmap_mode='r')
+        else:
+            stored_missing = np.zeros(len(stored), dtype=bool)
+
+        if not np.array_equal(missing, stored_missing):
+            return True
+
+        text, numbers = split_values(values, missing)
+
+        if col['numbers']:
+            stored_numbers = np.load(os.path.join(self.path, col['numbers']), mmap_mode='r')
+            if numbers is None or not np.array_equal(numbers, stored_numbers, equal_nan=True):
+                return True
+        elif numbers is not None:
+            return True
+
+        return not np.array_equal(text, stored)
+
+    def write_column(self, name, values):
+        """ Write a column (and its missing cells if any) and return its manifest entry """
+
+        file_name = column_file(name)
+        missing = pd.isnull(values)
+        text, numbers = split_values(values, missing)
+
+        write_npy(os.path.join(self.path, file_name + '.npy'), text)
+        missing_file = self.write_optional(file_name + '.missing.npy', missing if missing.any() else None)
+        numbers_file = self.write_optional(file_name + '.numbers.npy', numbers)
+
+        return {'name': name, 'file': file_name + '.npy', 'missing': missing_file, 'numbers': numbers_file}
+
+    def write_optional(self, file_name, array):
+        """ Write an array that isn't needed for every column (removed if None).
+            Returns the file name or None """
+
+        path = os.path.join(self.path, file_name)
+
+        if array is None:
+            if os.path.isfile(path):
+                os.remove(path)
+            return None
+
+        write_npy(path, array)
+        return file_name
+
+    def export_json(self, json_file):
+        """ Export the table as json (the F093 snapshot format) """
+
+        df = self.load()
+        df.columns = df.columns.str.replace("Result_", "PnC-IgG-ELISA type ")
+        df.to_json(json_file, orient='table')
+
+
+def split_values(values, missing):
+    """ Column values as a fixed width string array (number and missing cells
+        empty) and a float array of the numbers (NaN if not a number, None if
+        there are no numbers) """
+
+    numeric = np.array([not m and is_number(v) for v, m in zip(values, missing)], dtype=bool)
+
+    text = np.array(['' if m or n else str(v) for v, m, n in zip(values, missing, numeric)], dtype=str)
+    if not numeric.any():
+        return text, None
+
+    numbers = np.full(len(values), np.nan)
+    numbers[numeric] = [float(v) for v, n in zip(values, numeric) if n]
+
+    return text, numbers
+
+
+def is_number(value):
+    """ Check a cell is a number (e.g. a result rather than a fail code) """
+
+    return isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_))
+
+
+def column_file(name):
+    """ File name for a column """
+
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+
+def write_npy(path, array):
+    """ Save an array, replacing any existing file only once fully written """
+
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(path + '.tmp', path)
+
+
+def write_json(path, data):
+    """ Save json, replacing any existing file only once fully written """
+
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
@@ -0,0 +1,178 @@
+import re
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+# Results table position in the F093 template
+RESULTS_SHEET = 'Results'
+TABLE_ROW = 6  # Header row (data starts on the next row)
+TABLE_COL = 1
+
+# Plate fail codes (e.g. R1, R13)
+FAIL_CODE = re.compile(r'^R\d+$')
+
+# Formatting
+THIN = Side(style='thin', color='FF000000')
+BORDER = Border(left=THIN, right=THIN, top=THIN, bottom=THIN)
+HEADER_FONT = Font(bold=True)
+HEADER_FILL = PatternFill(fill_type='solid', start_color='FFD9D9D9', end_color='FFD9D9D9')
+HEADER_ALIGN = Alignment(horizontal='center', vertical='center', wrap_text=True)
+CELL_ALIGN = Alignment(horizontal='center', vertical='center')
+FAIL_FONT = Font(color='FF9C0006', bold=True)
+FAIL_FILL = PatternFill(fill_type='solid', start_color='FFFFC7CE', end_color='FFFFC7CE')
+RESULT_WIDTH = 14
+
+
+class F093Writer:
+    """ Write the F093 results table straight to the .xlsm template (keeping the
+        VBA project) and format it, without Excel """
+
+    def __init__(self, template, files=None):
+
+        self.template = template  # F093 template (.xlsm)
+        self.files = files  # FileCoordinator to save through (saved directly if None)
+
+    def write(self, df, f007_ref, save_name):
+        """ Write the results dataframe to the template, format and save as save_name.
+            Returns the number of cells written """
+
+        wb = load_workbook(self.template, keep_vba=True)
+        ws = wb[RESULTS_SHEET]
+
+        # Header then values (as written by Excel - numeric text as numbers)
+        for col, name in enumerate(df.columns, TABLE_COL):
+            self.write_column(ws, col, name, df[name])
+
+        self.set_print_settings(ws, df, f007_ref)
+
+        self.save(wb, save_name)
+        wb.close()
+
+        return len(df.index) * len(df.columns)
+
+    def update(self, old_df, df, f007_ref, save_name):
+        """ Update an F093 already written from old_df so it shows df. Only cells
+            that have changed are written - if serotype columns not in old_df are
+            added, the table is rewritten from the first new column onward (only
+            the table moves - the template rows above it and merged cells, print
+            settings and formatting outside it are left as they are).
+            Returns the number of cells written """
+
+        # Different samples - write it all again
+        if len(old_df.index) != len(df.index) or \
+                not old_df.columns.isin(df.columns).all() or \
+                list(old_df['Sample ID']) != list(df['Sample ID']):
+            return self.write(df, f007_ref, save_name)
+
+        wb = load_workbook(save_name, keep_vba=True)
+        ws = wb[RESULTS_SHEET]
+        n_cells = 0
+
+        # Columns before the first new (or moved) column are where they were
+        n_same = 0
+        while n_same < len(old_df.columns) and old_df.columns[n_same] == df.columns[n_same]:
+            n_same += 1
+
+        # Changed cells in unmoved columns
+        for idx, name in enumerate(df.columns[:n_same]):
+            col = TABLE_COL + idx
+            old_vals = [to_cell_value(v) for v in old_df[name]]
+            new_vals = [to_cell_value(v) for v in df[name]]
+
+            for row, (old_val, new_val) in enumerate(zip(old_vals, new_vals), TABLE_ROW + 1):
+                if old_val != new_val:
+                    cell = ws.cell(row=row, column=col, value=new_val)
+                    format_result_cell(cell)
+                    n_cells += 1
+
+        # New columns and the columns moved by them
+        for idx, name in enumerate(df.columns[n_same:], n_same):
+            self.write_column(ws, TABLE_COL + idx, name, df[name])
+            n_cells += len(df.index)
+
+        self.set_print_settings(ws, df, f007_ref)
+
+        self.save(wb, save_name)
+        wb.close()
+
+        return n_cells
+
+    def save(self, wb, save_name):
+        """ Save the workbook (through a temp file if coordinated) """
+
+        if self.files is None:
+            wb.save(save_name)
+        else:
+            self.files.replace(save_name, wb.save)
+
+    def write_column(self, ws, col, name, values):
+        """ Write and format the header and values of a single column """
+
+        format_header_cell(ws.cell(row=TABLE_ROW, column=col, value=name))
+
+        for row, val in enumerate(values, TABLE_ROW + 1):
+            format_result_cell(ws.cell(row=row, column=col, value=to_cell_value(val)))
+
+        # Result columns wide enough for the serotype headers
+        if col >= TABLE_COL + 2:
+            ws.column_dimensions[get_column_letter(col)].width = RESULT_WIDTH
+
+    def set_print_settings(self, ws, df, f007_ref):
+        """ Print the table with the header rows on every page """
+
+        last_row = TABLE_ROW + len(df.index)
+        last_col = TABLE_COL + len(df.columns) - 1
+
+        ws.print_area = "A1:" + get_column_letter(last_col) + str(last_row)
+        ws.print_title_rows = "1:" + str(TABLE_ROW)
+        ws.page_setup.orientation = ws.ORIENTATION_LANDSCAPE
+        ws.page_setup.fitToWidth = 1
+        ws.page_setup.fitToHeight = 0
+        ws.sheet_properties.pageSetUpPr.fitToPage = True
+        ws.oddHeader.center.text = f007_ref + " F093"
+
+
+def format_header_cell(cell):
+    """ Format a table header cell """
+
+    cell.font = HEADER_FONT
+    cell.fill = HEADER_FILL
+    cell.alignment = HEADER_ALIGN
+    cell.border = BORDER
+
+
+def format_result_cell(cell):
+    """ Format a result cell, highlighting plate fail codes """
+
+    cell.border = BORDER
+    cell.alignment = CELL_ALIGN
+
+    if isinstance(cell.value, str) and FAIL_CODE.match(cell.value):
+        cell.font = FAIL_FONT
+        cell.fill = FAIL_FILL
+    else:
+        cell.font = Font()
+        cell.fill = PatternFill()
+
+
+def to_cell_value(val):
+    """ Value as Excel would store it when written - blanks as empty and
+        numeric text as numbers """
+
+    if val is None or (not isinstance(val, str) and pd.isnull(val)):
+        return None
+
+    if isinstance(val, str):
+        try:
+            num = float(val)
+        except ValueError:
+            return val
+
+        # Text such as 'nan' or 'inf' stays as text
+        if num != num or num in (float('inf'), float('-inf')):
+            return val
+
+        return int(num) if num.is_integer() and '.' not in val else num
+
+    return val
@@ -0,0 +1,279 @@
+import getpass
+import json
+import os
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+LOCK_SUFFIX = '.lock'
+
+# Seconds to wait for a lock (or for a file open in another program) before giving up
+TIMEOUT = 20
+
+# Locks older than this are left from a run that crashed
+STALE_SECONDS = 600
+
+# Wait between attempts (doubles each time up to the maximum)
+FIRST_BACKOFF = 0.01
+MAX_BACKOFF = 1.0
+
+
+class LockTimeout(TimeoutError):
+    """ A file was still locked by another run after the timeout """
+
+
+class FileCoordinator:
+    """ Coordinates writing shared output files (master, trending, run details and
+        F093) between threads, processes and workstations. A lock file next to
+        the output (<file>.lock) holds who is writing it. Files are written to a
+        temp file and renamed over the output, so readers never see a partly
+        written file. Time spent waiting for each file is kept in waits """
+
+    def __init__(self, timeout=TIMEOUT):
+
+        self.timeout = timeout
+        self.waits = []  # (file, seconds waited for lock)
+        self.conflicts = []  # Files written by another run while being updated
+        self.skipped = []  # (file, reason) left for a later run to write
+        self.owner = get_owner()
+
+    @contextmanager
+    def locked(self, path):
+        """ Hold the lock for a file (e.g. to read, modify and write it) """
+
+        lock_file = path + LOCK_SUFFIX
+
+        start = time.perf_counter()
+        self.acquire(lock_file)
+        self.waits.append((path, time.perf_counter() - start))
+
+        try:
+            yield
+        finally:
+            try:
+                os.remove(lock_file)
+            except OSError:
+                pass
+
+    def acquire(self, lock_file):
+        """ Create the lock file, waiting (with backoff) while another run holds it """
+
+        deadline = time.monotonic() + self.timeout
+        backoff = FIRST_BACKOFF
+
+        while True:
+            try:
+                fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                identity = lock_identity(lock_file)
+                owner = read_owner(lock_file)
+
+                # Left by a run that crashed - remove and try again
+                if identity is not None and is_stale(lock_file, owner):
+                    remove_stale(lock_file, identity, owner)
+                    continue
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise LockTimeout(lock_file[:-len(LOCK_SUFFIX)] + " is locked by " + describe_owner(owner))
+
+                time.sleep(min(backoff, remaining))
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+
+            with os.fdopen(fd, 'w') as f:
+                json.dump(dict(self.owner, time=datetime.now().isoformat()), f)
+            return
+
+    def update(self, path, load_fn, apply_fn, write_fn):
+        """ Optimistic update of a shared file: load_fn() reads it, apply_fn(data) adds
+            this run's changes and write_fn(data, temp file) writes it. Loading and
+            applying happen without the lock - if another run has written the file
+            since (a new version), the changes are applied again to that version
+            before writing. Returns the data written """
+
+        version = file_version(path)
+        data = apply_fn(load_fn())
+
+        with self.locked(path):
+
+            # Written by another run since loaded - apply changes on top of theirs
+            if file_version(path) != version:
+                self.conflicts.append(path)
+                data = apply_fn(load_fn())
+
+            self.replace(path, lambda tmp: write_fn(data, tmp))
+
+        return data
+
+    def write(self, path, write_fn):
+        """ Lock a file and write it with write_fn(temp file) """
+
+        with self.locked(path):
+            self.replace(path, write_fn)
+
+    def replace(self, path, write_fn):
+        """ Write a file (lock already held) with write_fn(temp file) then rename over
+            the file, retrying while it is open in another program """
+
+        tmp = path + '.' + uuid.uuid4().hex[:8] + '.tmp'
+        deadline = time.monotonic() + self.timeout
+        backoff = FIRST_BACKOFF
+
+        try:
+            write_fn(tmp)
+
+            while True:
+                try:
+                    os.replace(tmp, path)
+                    return
+                except PermissionError:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise
+                    time.sleep(min(backoff, remaining))
+                    backoff = min(backoff * 2, MAX_BACKOFF)
+        finally:
+            if os.path.isfile(tmp):
+                os.remove(tmp)
+
+    def write_csv(self, path, df, **kwargs):
+        """ Lock and write a dataframe as CSV """
+
+        self.write(path, lambda tmp: df.to_csv(tmp, **kwargs))
+
+
+def file_version(path):
+    """ Version stamp of a file (None if it doesn't exist) - changes whenever
+        the file is replaced or written """
+
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return stat.st_mtime_ns, stat.st_size
+
+
+def lock_identity(lock_file):
+    """ Identity of a lock file (None if removed) - a new lock created in its
+        place has a different identity """
+
+    try:
+        stat = os.stat(lock_file)
+    except OSError:
+        return None
+
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def remove_stale(lock_file, identity, owner):
+    """ Remove a lock judged stale. Another waiter may have removed it and taken
+        a new lock since, so the lock is first moved (only one waiter can move
+        it) and only removed if it is the lock judged stale - otherwise it is put
+        back without replacing any lock taken since """
+
+    claimed = lock_file + '.' + uuid.uuid4().hex[:8] + '.stale'
+
+    try:
+        os.rename(lock_file, claimed)
+    except OSError:
+        return  # Already removed by another waiter
+
+    if lock_identity(claimed) != identity or read_owner(claimed) != owner:
+        try:
+            os.link(claimed, lock_file)
+        except FileExistsError:
+            pass
+        except OSError:
+            # No hard links (e.g. some network drives) - rename doesn't replace on Windows
+            if os.name == 'nt':
+                try:
+                    os.rename(claimed, lock_file)
+                    return
+                except OSError:
+                    pass
+
+    try:
+        os.remove(claimed)
+    except OSError:
+        pass
+
+
+def get_owner():
+    """ Details of this run written to lock files """
+
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = ''
+
+    return {'host': socket.gethostname(), 'pid': os.getpid(), 'user': user}
+
+
+def read_owner(lock_file):
+    """ Owner details from a lock file (empty if being written or removed) """
+
+    try:
+        with open(lock_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def is_stale(lock_file, owner):
+    """ Check if a lock was left by a run that is no longer running """
+
+    try:
+        age = time.time() - os.path.getmtime(lock_file)
+    except OSError:
+        return False
+
+    if age > STALE_SECONDS:
+        return True
+
+    # Process on this computer that has ended (can't be checked on Windows)
+    if owner.get('host') == socket.gethostname() and owner.get('pid') and os.name != 'nt':
+        try:
+            os.kill(owner['pid'], 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            return False
+
+    return False
+
+
+def describe_owner(owner):
+
+    if not owner:
+        return "another run"
+
+    return "{0} on {1} (since {2})".format(owner.get('user') or 'unknown user',
+                                           owner.get('host', 'unknown computer'), owner.get('time', '?'))
+
+
+def wait_summary(waits):
+    """ Time waited for each file lock, as a list of strings """
+
+    if not waits:
+        return []
+
+    return ["Waited %.3fs for %s" % (secs, os.path.basename(path)) for path, secs in waits] + \
+           ["Total lock wait: %.3fs" % sum(secs for _, secs in waits)]
+
+
+def conflict_summary(conflicts):
+    """ Files updated again because another run wrote them first, as a list of strings """
+
+    return ["Updated by another run while processing - changes re-applied: " + os.path.basename(path)
+            for path in conflicts]
+
+
+def skipped_summary(skipped):
+    """ Files not written this run (written by the next update), as a list of strings """
+
+    return ["Not written - will be written on next update: " + os.path.basename(path) + " (" + reason + ")"
+            for path, reason in skipped]
@@ -0,0 +1,187 @@
+import re
+import pandas as pd
+from openpyxl import load_workbook
+
+# Rows of the master CSV read at a time
+CHUNK_SIZE = 50000
+
+# Header text before the serotype in working file result columns
+SEROTYPE_PREFIX = re.compile(r'^(PnC-IgG-ELISA type|Result_|Serotype|PnC)\s*', re.IGNORECASE)
+
+# Workbook formats that can be read
+WORKBOOK_SUFFIXES = ('.XLSX', '.XLSM')
+
+
+class FinalMasterBuilder:
+    """ Fill the result columns of a working file (a sheet with a Sample ID column
+        and a column per serotype) with the final result of each sample/serotype
+        in a master study file. The master is read a chunk at a time, so the size
+        of the study doesn't matter. The output is a copy of the working file
+        with the results filled in """
+
+    def __init__(self, master_file, working_file, save_name):
+
+        self.master_file = master_file  # Study master CSV
+        self.working_file = working_file  # Working workbook (layout of final master)
+        self.save_name = save_name  # Final master workbook to write
+
+    def build(self, progress_callback=None):
+        """ Build the final master. Returns the number of results filled """
+
+        if not self.working_file.upper().endswith(WORKBOOK_SUFFIXES):
+            raise ValueError("Working file must be an .xlsx or .xlsm workbook")
+
+        def progress(percent):
+            if progress_callback is not None:
+                progress_callback.emit(int(percent))
+
+        # Working file layout and the samples in it
+        header_row, sample_col, serotype_cols, samples, n_rows = self.read_layout()
+        progress(5)
+
+        # Final results of those samples from the master
+        finals = self.read_finals(samples, serotype_cols.values(),
+                                  lambda p: progress(5 + p * 0.45))
+
+        # Write working file rows with results filled in
+        return self.write_output(header_row, sample_col, serotype_cols, finals, n_rows,
+                                 lambda p: progress(50 + p * 0.5))
+
+    def read_layout(self):
+        """ Header row, Sample ID column, serotype columns (column: serotype),
+            set of sample IDs and number of rows in the working file """
+
+        wb = load_workbook(self.working_file, read_only=True, data_only=True)
+        try:
+            ws = wb.worksheets[0]
+            header_row = sample_col = None
+            serotype_cols = {}
+            samples = set()
+            n_rows = 0
+
+            # From the first row and column so positions match write_output
+            for r, row in enumerate(ws.iter_rows(min_row=1, min_col=1, values_only=True)):
+                n_rows += 1
+
+                if header_row is None:
+                    cols = [str(v).strip() if v is not None else '' for v in row]
+                    if 'Sample ID' in cols:
+                        header_row = r
+                        sample_col = cols.index('Sample ID')
+                        serotype_cols = {c: get_serotype(v) for c, v in enumerate(cols)
+                                         if c != sample_col and get_serotype(v)}
+                    continue
+
+                if sample_col < len(row) and row[sample_col] is not None:
+                    samples.add(to_sample_id(row[sample_col]))
+        finally:
+            wb.close()
+
+        if header_row is None:
+            raise ValueError("No Sample ID column found in working file")
+
+        return header_row, sample_col, serotype_cols, samples, n_rows
+
+    def read_finals(self, samples, serotypes, progress):
+        """ Final result (amended result if any) of the latest test run of each
+            sample/serotype in the working file: (sample, serotype): result """
+
+        serotypes = set(serotypes)
+        latest = {}  # (sample, serotype): (test run, result)
+
+        n_rows = count_lines(self.master_file) - 1
+        n_read = 0
+
+        for chunk in pd.read_csv(self.master_file, dtype=str, keep_default_na=False, chunksize=CHUNK_SIZE,
+                                 usecols=['Sample ID', 'PnC Serotype', 'Result', 'Amended Result', 'Test Run']):
+
+            chunk = chunk[chunk['Sample ID'].isin(samples) & chunk['PnC Serotype'].isin(serotypes)]
+
+            runs = [get_run_number(t) for t in chunk['Test Run']]
+            results = [a if a else r for r, a in zip(chunk['Result'], chunk['Amended Result'])]
+
+            for key, run, result in zip(zip(chunk['Sample ID'], chunk['PnC Serotype']), runs, results):
+                if key not in latest or run >= latest[key][0]:
+                    latest[key] = (run, result)
+
+            n_read += CHUNK_SIZE
+            progress(min(100, n_read * 100 / max(n_rows, 1)))
+
+        return {key: result for key, (run, result) in latest.items()}
+
+    def write_output(self, header_row, sample_col, serotype_cols, finals, n_rows, progress):
+        """ Save a copy of the working file (formatting, column widths and other
+            sheets kept) with the results filled in """
+
+        wb = load_workbook(self.working_file)
+        ws = wb.worksheets[0]
+        n_filled = 0
+
+        try:
+            # Rows after the header (openpyxl rows and columns start at 1)
+            for r, row in enumerate(ws.iter_rows(min_row=header_row + 2, min_col=1), header_row + 1):
+                cell = row[sample_col] if sample_col < len(row) else None
+
+                if cell is not None and cell.value is not None:
+                    sample_id = to_sample_id(cell.value)
+                    for c, serotype in serotype_cols.items():
+                        result = finals.get((sample_id, serotype))
+                        if result is not None:
+                            ws.cell(row=r + 1, column=c + 1, value=to_number(result))
+                            n_filled += 1
+
+                if r % 1000 == 0:
+                    progress(r * 100 / max(n_rows, 1))
+
+            wb.save(self.save_name)
+        finally:
+            wb.close()
+
+        progress(100)
+
+        return n_filled
+
+
+def get_serotype(header):
+    """ Serotype from a result column header (e.g. PnC-IgG-ELISA type 6B - 6B).
+        None if not a serotype column """
+
+    text = SEROTYPE_PREFIX.sub('', str(header).strip())
+    return text if re.match(r'^\d+[A-Z]?$', text, re.IGNORECASE) else None
+
+
+def to_sample_id(val):
+    """ Sample ID as text (as in the master - whole numbers without decimals) """
+
+    if isinstance(val, float) and val.is_integer():
+        return str(int(val))
+    return str(val).strip()
+
+
+def to_number(result):
+    """ Numeric results as numbers, other results (e.g. NP, NR, R1) as text """
+
+    try:
+        return float(result)
+    except ValueError:
+        return result
+
+
+def get_run_number(test_run):
+    """ n from a test run 'n of m' (0 if not numbered) """
+
+    try:
+        return int(test_run.split(' of ')[0])
+    except ValueError:
+        return 0
+
+
+def count_lines(path):
+    """ Number of lines in a text file (read in blocks) """
+
+    n = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            n += block.count(b'\n')
+
+    return n
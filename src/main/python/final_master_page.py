@@ -3,7 +3,10 @@ from PyQt5.QtGui import QPalette, QColor
 from PyQt5.QtWidgets import QLabel, QGridLayout, QWidget, QComboBox, QApplication, QPushButton, \
     QTextEdit, QHBoxLayout, QTabWidget, QLineEdit, QSizePolicy, \
     QGroupBox, QCheckBox, QProgressBar, QFileDialog
+from PyQt5.QtCore import QThreadPool
 from pathlib import Path
+from elisa_data_page import Worker
+from final_master import FinalMasterBuilder
 import os
 
 
@@ -21,6 +24,7 @@ class PageFinalMaster(QWidget):
 
         # Working file
         self.working_file = ""
+        self.threadpool = QThreadPool()
 
         # Layouts
         self.layout = QGridLayout(self)
@@ -44,12 +48,16 @@ class PageFinalMaster(QWidget):
         # Run
         self.run_btn = QPushButton(text="Run")
         self.run_btn.clicked.connect(self.run_clicked)
+        self.progress_bar = QProgressBar()
+        self.status = QLabel(text="")
 
         # Add widgets to layout
         self.layout.addWidget(file_label, 0, 0)
         self.layout.addWidget(self.file_combo, 0, 1, 1, 2)
         self.layout.addWidget(working_label, 1, 0)
         self.layout.addWidget(self.working_btn,1,1)
+        self.layout.addWidget(self.status, 22, 0, 1, 2)
+        self.layout.addWidget(self.progress_bar, 22, 2, 1, 2)
         self.layout.addWidget(self.run_btn, 22, 4)
 
 
@@ -77,7 +85,29 @@ class PageFinalMaster(QWidget):
             print(self.working_file)
             
     def run_clicked(self):
-        pass
+        """ Build the final master from the selected master and working file
+            (saved next to the working file) """
+
+        if not self.working_file or not self.file_combo.currentText():
+            self.status.setText("Select a master file and a working file")
+            return
+
+        master_file = os.path.join(self.MASTER_PATH, self.file_combo.currentText())
+        save_name = os.path.join(os.path.dirname(self.working_file),
+                                 Path(self.working_file).stem + " Final Master.xlsx")
+        builder = FinalMasterBuilder(master_file, self.working_file, save_name)
+
+        self.run_btn.setEnabled(False)
+        self.progress_bar.setValue(0)
+        self.status.setText("Creating final master...")
+
+        worker = Worker(builder.build)
+        worker.signals.progress.connect(self.progress_bar.setValue)
+        worker.signals.result.connect(lambda n: self.status.setText(
+            str(n) + " results written to " + os.path.basename(save_name)))
+        worker.signals.error.connect(lambda err: self.status.setText("Final master failed: " + str(err[1])))
+        worker.signals.finished.connect(lambda: self.run_btn.setEnabled(True))
+        self.threadpool.start(worker)
 
     def get_master_files(self):
         """ Retrieve all CSV files in master study file to populate combobox """
@@ -10,10 +10,13 @@ from PyQt5.QtCore import QSettings, QByteArray, Qt, QThreadPool
 from PyQt5.QtWidgets import QApplication, QMainWindow, QStackedWidget, QAction, QSizePolicy, QLineEdit, QStyleFactory, QCheckBox, \
     QComboBox, QSplashScreen
 from final_master_page import PageFinalMaster
-from elisa_data_page import PageData, Worker
+from sample_history_page import PageSampleHistory
+from elisa_data_page import PageData, Worker, OUTPUT_OPTIONS
 from gantt_page import PageGantt
+from trend_page import PageTrend
 from settings_page import PageSettings
 from help_page import PageHelp
+from report_assets import ReportAssets
 import webbrowser
 import sys
 import time
@@ -24,6 +27,9 @@ class AppContext(ApplicationContext):
     def run(self):
         """ Run App Context """
 
+        # Read report stylesheet and images once for every render
+        self.report_assets
+
         # Load main window
         self.main_window.show()
         return self.app.exec_()
@@ -61,6 +67,10 @@ class AppContext(ApplicationContext):
     def css(self):
         return self.get_resource('./static/style.css')
 
+    @cached_property
+    def report_assets(self):
+        return ReportAssets(self.css, str(Path(self.template).parent))
+
     @cached_property
     def colour_map(self):
         return self.get_resource('gantt_color_map.csv')
@@ -143,6 +153,8 @@ class MainWindow(QMainWindow):
         self.get_saved_print_settings()
 
         self.stacked.addWidget(PageFinalMaster(ctx=self.ctx, master_path=self.MASTER_PATH, objectName="final_master"))
+        self.stacked.addWidget(PageSampleHistory(ctx=self.ctx, master_path=self.MASTER_PATH, objectName="sample_history"))
+        self.stacked.addWidget(PageTrend(ctx=self.ctx, objectName="trend_page"))
 
 
         # Create menu bar
@@ -168,6 +180,9 @@ class MainWindow(QMainWindow):
         gantt_action = self.create_action("&Gantt Chart", lambda: self.stacked.setCurrentIndex(2),
                                           'Ctrl+R', "Create a testing Gantt chart")
 
+        trend_action = self.create_action("&QC Trending", lambda: self.stacked.setCurrentIndex(6),
+                                          'Ctrl+L', "Levey-Jennings charts of QC trending")
+
         settings_action = self.create_action("&Change File Paths", lambda: self.stacked.setCurrentIndex(1),
                                              'Ctrl+T', "Edit paths to required files")
 
@@ -177,10 +192,13 @@ class MainWindow(QMainWindow):
         final_master_action = self.create_action("&Create Final Master File", lambda: self.stacked.setCurrentIndex(4),
                                               'Ctrl+F', "Generate a Final Master File")
 
+        history_action = self.create_action("&Sample History", lambda: self.stacked.setCurrentIndex(5),
+                                            'Ctrl+I', "Find a sample in every master study file")
+
         # Add actions
         self.add_actions(file_menu, [None, exit_action])
-        self.add_actions(data_menu, [data_action, final_master_action])
-        self.add_actions(report_menu, [gantt_action])
+        self.add_actions(data_menu, [data_action, final_master_action, history_action])
+        self.add_actions(report_menu, [gantt_action, trend_action])
         self.add_actions(settings_menu, [settings_action])
         self.add_actions(help_menu, [help_action])
 
@@ -259,7 +277,7 @@ class MainWindow(QMainWindow):
         data_page = self.stacked.findChild(PageData, "elisa_data")
 
         # List of widget names
-        checkbox_names = ["cb_upper_od", "cb_lower_od", "cb_lloq", "cb_print"]
+        checkbox_names = ["cb_upper_od", "cb_lower_od", "cb_lloq", "cb_print", "cb_run_pdf", "cb_defer_pdf"]
         textbox_names = ["txt_upper_od", "txt_lower_od"]
 
         # Get combobox index
@@ -275,8 +293,12 @@ class MainWindow(QMainWindow):
                 widget.setChecked(saved_bool[0])
                 widget.setEnabled(saved_bool[1])
             except:
-                widget.setChecked(True)
-                if not obj_name == "cb_print":
+                if obj_name in ["cb_run_pdf", "cb_defer_pdf"]:
+                    widget.setChecked(False)
+                else:
+                    widget.setChecked(True)
+
+                if obj_name not in OUTPUT_OPTIONS:
                     widget.setEnabled(False)
 
         # Get OD values in textboxes (if setting found - use if not, default)
@@ -354,7 +376,7 @@ class MainWindow(QMainWindow):
         settings = QSettings()
 
         # Checkbox values
-        checkbox_names = ["cb_upper_od", "cb_lower_od", "cb_lloq", "cb_print"]
+        checkbox_names = ["cb_upper_od", "cb_lower_od", "cb_lloq", "cb_print", "cb_run_pdf", "cb_defer_pdf"]
         textbox_names = ["txt_lower_od", "txt_upper_od"]
 
         # ComboBox
@@ -0,0 +1,377 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+import pandas as pd
+from master_merge import merge_results, MASTER_COLUMNS
+from csv_cache import read_cache, write_cache, to_categories
+from file_coordinator import FileCoordinator, LockTimeout, file_version
+
+# Database column for each master column
+DB_COLUMNS = ['sample_id', 'serotype', 'plate_id', 'result',
+              'amended_result', 'labdt', 'technician', 'test_run']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    sample_id TEXT NOT NULL,
+    serotype TEXT NOT NULL,
+    plate_id TEXT,
+    result TEXT,
+    amended_result TEXT,
+    labdt TEXT,
+    technician TEXT,
+    test_run TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_sample ON results (sample_id, serotype);
+CREATE INDEX IF NOT EXISTS idx_plate ON results (plate_id, labdt);
+CREATE INDEX IF NOT EXISTS idx_technician ON results (technician);
+CREATE TABLE IF NOT EXISTS info (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS segments (name TEXT PRIMARY KEY);
+"""
+
+# Seconds to wait for another workstation to finish an update
+TIMEOUT = 20
+
+# Order of rows in the CSV
+CSV_ORDER = "labdt, sample_id, serotype, technician, id"
+
+# Master CSV columns loaded as categoricals
+MASTER_CATEGORIES = ['PnC Serotype', 'Plate ID', 'Technician']
+
+
+class MasterDatabase:
+    """ Master study results kept in an SQLite database next to the master CSV
+        (<Sponsor>_<Study>_Master.db). Updates are transactions on the sample/
+        serotype groups in a run and the CSV is written from the database
+        only when it has changed. Changes made to the CSV itself (e.g. Amended
+        Results filled in) are imported before the next update """
+
+    def __init__(self, csv_file, files=None):
+
+        self.csv_file = csv_file  # Master CSV (export)
+        self.files = files or FileCoordinator()  # Locks and writes the CSV
+        self.path = os.path.splitext(csv_file)[0] + '.db'
+
+    def connect(self):
+        """ Open the database, creating tables if needed (autocommit - transactions
+            are started explicitly) """
+
+        conn = sqlite3.connect(self.path, timeout=TIMEOUT, isolation_level=None)
+        conn.executescript(SCHEMA)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """ Write transaction - other workstations wait until it is committed.
+            Results in an existing master CSV are imported the first time """
+
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+
+            if self.needs_import(conn):
+                self.import_csv(conn)
+
+            yield conn
+
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def needs_import(self, conn):
+        """ Check the master CSV has results not in the database - it was written
+            before the database, or changed since exported with no database
+            changes since (if there are, export_csv leaves the CSV as it is) """
+
+        if get_info(conn, 'csv_imported') is None:
+            return True
+
+        return self.csv_edited(conn) and get_info(conn, 'csv_version') == get_info(conn, 'version')
+
+    def csv_edited(self, conn):
+        """ Check the master CSV was changed since written from the database """
+
+        stamp = get_info(conn, 'csv_stamp')
+        return stamp is not None and os.path.isfile(self.csv_file) and \
+            stamp_text(file_version(self.csv_file)) != stamp
+
+    def import_csv(self, conn):
+        """ Import the results of the master CSV, replacing any in the database """
+
+        conn.execute("DELETE FROM results")
+
+        if os.path.isfile(self.csv_file):
+            stamp = file_version(self.csv_file)
+            insert_rows(conn, load_master_csv(self.csv_file))
+            set_info(conn, 'csv_stamp', stamp_text(stamp))
+
+        set_info(conn, 'csv_imported', '1')
+        bump_version(conn)
+
+    def merge(self, conn, rows):
+        """ Merge result rows into the sample/serotype groups they belong to,
+            deriving NR and Test Run for those groups. Returns the outcome of each row """
+
+        old_df = self.read_groups(conn, get_groups(rows))
+
+        df, outcomes = merge_results(old_df.copy(), rows)
+        df = derive_groups(df)
+
+        self.write_changes(conn, old_df, df)
+
+        return outcomes
+
+    def classify(self, rows, pending=()):
+        """ Outcome of merging result rows (duplicate, amendment, tested in error
+            or new) without changing the master. Rows not yet merged (pending)
+            are taken into account """
+
+        groups = get_groups(rows)
+
+        # Read only - doesn't wait for other workstations' updates
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN")
+            df = None if self.needs_import(conn) else self.read_groups(conn, groups)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+        # First time (or CSV changed) - import the CSV first
+        if df is None:
+            with self.transaction() as conn:
+                df = self.read_groups(conn, groups)
+
+        df, _ = merge_results(df, [r for r in pending if (str(r[0]), str(r[1])) in groups])
+        _, outcomes = merge_results(df, rows)
+
+        return outcomes
+
+    def read_groups(self, conn, groups):
+        """ Results for sample/serotype groups as a dataframe (with database id) """
+
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS groups (sample_id TEXT, serotype TEXT)")
+        conn.execute("DELETE FROM groups")
+        conn.executemany("INSERT INTO groups VALUES (?, ?)", list(groups))
+
+        cols = ", ".join("r." + c for c in DB_COLUMNS)
+        rows = conn.execute("SELECT r.id, " + cols + " FROM results r "
+                            "JOIN groups g ON r.sample_id = g.sample_id AND r.serotype = g.serotype "
+                            "ORDER BY r.id").fetchall()
+
+        df = pd.DataFrame(rows, columns=['id'] + MASTER_COLUMNS)
+        df['LABDT'] = pd.to_datetime(df['LABDT'], format='%Y-%m-%d')
+
+        return df
+
+    def write_changes(self, conn, old_df, df):
+        """ Write the changes between results read (old_df) and results updated (df).
+            Rows without an id are inserted. Returns the number of rows changed """
+
+        old_rows = dict(zip(old_df['id'], to_db_rows(old_df)))
+        new_rows = to_db_rows(df)
+
+        # Changed rows
+        kept = set()
+        updates = []
+        for row_id, row in zip(df['id'], new_rows):
+            if pd.isnull(row_id) or row_id == '':
+                continue
+            kept.add(row_id)
+            if row != old_rows[row_id]:
+                updates.append(row + (int(row_id),))
+
+        sets = ", ".join(c + " = ?" for c in DB_COLUMNS)
+        conn.executemany("UPDATE results SET " + sets + " WHERE id = ?", updates)
+
+        # Rows removed (duplicates)
+        removed = [(int(i),) for i in old_rows if i not in kept]
+        conn.executemany("DELETE FROM results WHERE id = ?", removed)
+
+        # New rows
+        added = df[[pd.isnull(i) or i == '' for i in df['id']]]
+        insert_rows(conn, added)
+
+        n_changed = len(updates) + len(removed) + len(added.index)
+        if n_changed:
+            bump_version(conn)
+
+        return n_changed
+
+    def read_all(self, conn):
+        """ Every result as a dataframe in CSV order (dates as datetime) """
+
+        rows = conn.execute("SELECT " + ", ".join(DB_COLUMNS) + " FROM results "
+                            "ORDER BY " + CSV_ORDER).fetchall()
+
+        df = pd.DataFrame(rows, columns=MASTER_COLUMNS)
+        df['LABDT'] = pd.to_datetime(df['LABDT'], format='%Y-%m-%d')
+
+        return df
+
+    def export_csv(self):
+        """ Write the master CSV if the database version has changed since the CSV
+            was written. Returns True if written """
+
+        try:
+            with self.files.locked(self.csv_file):
+                conn = self.connect()
+                try:
+                    # Version and results read together
+                    conn.execute("BEGIN")
+                    version = get_info(conn, 'version')
+                    written = get_info(conn, 'csv_version')
+                    unchanged = written == version and os.path.isfile(self.csv_file)
+                    edited = self.csv_edited(conn)
+                    df = None if unchanged or edited else self.read_all(conn)
+                    conn.execute("COMMIT")
+
+                    # Edited while results were waiting to be written - not overwritten
+                    if edited and not unchanged:
+                        self.files.skipped.append((self.csv_file, "changed while results were waiting to be "
+                                                                  "added - move it aside to write the results, "
+                                                                  "then re-apply the changes"))
+                    if df is None:
+                        return False
+
+                    # Replace the CSV only once fully written
+                    self.files.replace(self.csv_file, lambda tmp: self.write_csv(df, tmp))
+                    set_info(conn, 'csv_version', version)
+                    set_info(conn, 'csv_stamp', stamp_text(file_version(self.csv_file)))
+                finally:
+                    conn.close()
+
+        # Left for next time if locked or open
+        except (LockTimeout, PermissionError) as e:
+            self.files.skipped.append((self.csv_file, str(e)))
+            return False
+
+        return True
+
+    def write_csv(self, df, file_name):
+        """ Write results as the master CSV (and its sidecar) """
+
+        df.to_csv(file_name, index=False, date_format='%d-%b-%y')
+        write_cache(self.csv_file, to_categories(df.copy(), MASTER_CATEGORIES), file_version(file_name))
+
+
+def load_master_csv(csv_file, cache=True):
+    """ Master CSV as a dataframe - text columns, LABDT as datetime and
+        serotype, plate and technician as categoricals. Read from the sidecar
+        if it is up to date, otherwise from the CSV (and the sidecar written
+        if cache - not when only reading, e.g. searching every master) """
+
+    df = read_cache(csv_file)
+    if df is not None:
+        return df
+
+    stamp = file_version(csv_file)
+
+    try:
+        df = pd.read_csv(csv_file, dtype=str, keep_default_na=False)
+    except pd.errors.EmptyDataError:
+        df = pd.DataFrame(columns=MASTER_COLUMNS)
+
+    df = df.reindex(columns=MASTER_COLUMNS, fill_value='')
+    df['LABDT'] = to_datetime(df['LABDT'])
+    df = to_categories(df, MASTER_CATEGORIES)
+
+    if cache:
+        write_cache(csv_file, df, stamp)
+
+    return df
+
+
+def get_groups(rows):
+    """ Sample/serotype groups of result rows """
+
+    return set((str(r[0]), str(r[1])) for r in rows)
+
+
+def derive_groups(df):
+    """ NR and Test Run for the sample/serotype groups in df. Rows in each group
+        are numbered in lab date order ("n of m") and every NP after the first
+        is an NR. Only the groups in df are changed """
+
+    # Drop Duplicates (sample plate will have been re-printed)
+    df = df.drop_duplicates(subset=MASTER_COLUMNS, keep='first')
+    df = df.sort_values(by=['LABDT', 'Sample ID', 'PnC Serotype'], kind='mergesort')
+
+    keys = list(zip(df['Sample ID'], df['PnC Serotype']))
+    amended = df['Amended Result'].tolist()
+
+    counts = {}  # Group: rows so far
+    np_seen = set()  # Groups with an NP so far
+    runs = []
+
+    for pos, (key, result) in enumerate(zip(keys, df['Result'])):
+        counts[key] = counts.get(key, 0) + 1
+        runs.append(counts[key])
+
+        # Second NP is an NR
+        if result == 'NP':
+            if key in np_seen:
+                amended[pos] = 'NR'
+            np_seen.add(key)
+
+    df['Test Run'] = [str(n) + " of " + str(counts[key]) for n, key in zip(runs, keys)]
+    df['Amended Result'] = amended
+
+    return df
+
+
+def insert_rows(conn, df):
+    """ Insert master rows """
+
+    if df.empty:
+        return
+
+    cols = ", ".join(DB_COLUMNS)
+    marks = ", ".join("?" * len(DB_COLUMNS))
+    conn.executemany("INSERT INTO results (" + cols + ") VALUES (" + marks + ")", to_db_rows(df))
+
+
+def to_db_rows(df):
+    """ Master rows as tuples of text (dates as YYYY-MM-DD) """
+
+    dates = [d.strftime('%Y-%m-%d') if not pd.isnull(d) else '' for d in df['LABDT']]
+    cols = [dates if c == 'LABDT' else ['' if pd.isnull(v) else str(v) for v in df[c]]
+            for c in MASTER_COLUMNS]
+
+    return list(zip(*cols))
+
+
+def to_datetime(dates):
+    """ Lab dates from the master CSV (dd-Mon-yy or any other date format) """
+
+    parsed = pd.to_datetime(dates, format='%d-%b-%y', errors='coerce')
+    other = pd.to_datetime(dates[parsed.isnull()], errors='coerce')
+    parsed[parsed.isnull()] = other
+
+    return parsed
+
+
+def get_info(conn, name):
+    row = conn.execute("SELECT value FROM info WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def set_info(conn, name, value):
+    conn.execute("INSERT OR REPLACE INTO info VALUES (?, ?)", (name, value))
+
+
+def stamp_text(stamp):
+    """ File version stamp as stored in info """
+
+    return "" if stamp is None else ":".join(str(x) for x in stamp)
+
+
+def bump_version(conn):
+    """ Increase the version number (the CSV is out of date) """
+
+    version = int(get_info(conn, 'version') or 0) + 1
+    set_info(conn, 'version', str(version))
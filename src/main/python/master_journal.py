@@ -0,0 +1,124 @@
+import json
+import os
+import uuid
+from datetime import datetime
+from file_coordinator import LockTimeout
+
+
+class MasterJournal:
+    """ Append-only journal of result rows for a master study
+        (<Sponsor>_<Study>_Master.journal). Each run appends a small segment
+        that is synced to disk. Compaction merges the segments into the master
+        database (inserts, amendments, NRs and test runs) and writes the master
+        CSV, so recording a run's results doesn't depend on the size of the study """
+
+    def __init__(self, master_db):
+
+        self.master_db = master_db  # MasterDatabase segments are merged into
+        self.path = os.path.splitext(master_db.csv_file)[0] + '.journal'
+
+    def append(self, rows):
+        """ Write result rows to a new segment. Returns the segment file name """
+
+        if not rows:
+            return None
+
+        os.makedirs(self.path, exist_ok=True)
+
+        # Segments are named so they sort in the order written
+        name = datetime.now().strftime('%Y%m%d%H%M%S%f') + '-' + uuid.uuid4().hex + '.seg'
+        seg_file = os.path.join(self.path, name)
+
+        with open(seg_file + '.tmp', 'w') as f:
+            for row in rows:
+                f.write(json.dumps([str(x) for x in row]) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Only visible to compaction once complete
+        os.replace(seg_file + '.tmp', seg_file)
+        sync_dir(self.path)
+
+        return name
+
+    def segments(self):
+        """ Segment file names not yet compacted, oldest first """
+
+        try:
+            return sorted(f for f in os.listdir(self.path) if f.endswith('.seg'))
+        except FileNotFoundError:
+            return []
+
+    def read_segment(self, name):
+        """ Result rows in a segment """
+
+        with open(os.path.join(self.path, name)) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def pending_rows(self):
+        """ Result rows in segments not yet compacted """
+
+        rows = []
+        for name in self.segments():
+            try:
+                rows.extend(self.read_segment(name))
+            except FileNotFoundError:  # Compacted since listed
+                continue
+
+        return rows
+
+    def compact(self):
+        """ Merge every segment into the master database (one transaction each)
+            and write the master CSV. Returns the number of segments merged """
+
+        n_merged = 0
+
+        # One compaction at a time on every workstation (lock file next to the journal).
+        # If another run is compacting for longer than the timeout, it merges this
+        # run's segments (the journal is listed until empty)
+        try:
+            with self.master_db.files.locked(self.path):
+                names = self.segments()
+                while names:
+                    for name in names:
+                        try:
+                            rows = self.read_segment(name)
+                        except FileNotFoundError:  # Removed since listed
+                            continue
+
+                        # Segments are recorded when merged (in case the file can't be removed)
+                        with self.master_db.transaction() as conn:
+                            if not conn.execute("SELECT 1 FROM segments WHERE name = ?", (name,)).fetchone():
+                                self.master_db.merge(conn, rows)
+                                conn.execute("INSERT INTO segments VALUES (?)", (name,))
+                                n_merged += 1
+
+                        try:
+                            os.remove(os.path.join(self.path, name))
+                        except FileNotFoundError:
+                            pass
+
+                    # Segments appended by other runs while compacting
+                    names = self.segments()
+
+                self.master_db.export_csv()
+        except LockTimeout as e:
+            self.master_db.files.skipped.append((self.path, str(e)))
+
+        return n_merged
+
+
+def sync_dir(path):
+    """ Sync a directory so a renamed file is kept (not possible on Windows) """
+
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,150 @@
+import pandas as pd
+
+# Master study file columns
+MASTER_COLUMNS = ['Sample ID', 'PnC Serotype', 'Plate ID', 'Result',
+                  'Amended Result', 'LABDT', 'Technician', 'Test Run']
+
+# Columns that identify a plate result (everything bar result, amended result and test run)
+PLATE_KEY = ['Sample ID', 'PnC Serotype', 'Plate ID', 'LABDT', 'Technician']
+
+# Columns that identify a sample tested on a serotype
+SAMPLE_KEY = ['Sample ID', 'PnC Serotype']
+
+# Merge outcomes
+DUPLICATE = 'duplicate'  # Row already in master
+AMENDMENT = 'amendment'  # Same plate result - result replaced
+TESTED_IN_ERROR = 'tested in error'  # Sample already has a valid result - row added
+NEW = 'new'  # Row added
+
+
+class MasterIndex:
+    """ Hash indexes over the master study dataframe: exact rows, plate results
+        (row without result) and sample/serotype. Used to classify new result
+        rows without comparing each against the whole master """
+
+    def __init__(self, df):
+
+        self.exact = {}  # Exact row: row label
+        self.plate = {}  # Plate result: first row label
+        self.valid = {}  # Sample/serotype: number of valid results
+        self.rows = {}  # Row label: (exact row, sample/serotype, result)
+
+        for label, *keys in zip(df.index, *get_keys(df)):
+            self.add(label, *keys)
+
+    def add(self, label, exact, plate, sample, result):
+        """ Add a row to the indexes """
+
+        self.exact.setdefault(exact, label)
+        self.plate.setdefault(plate, label)
+        self.valid[sample] = self.valid.get(sample, 0) + is_valid_result(result)
+        self.rows[label] = (exact, sample, result)
+
+    def amend(self, label, result):
+        """ Update the indexes for a row where the result has been replaced """
+
+        old_exact, sample, old_result = self.rows[label]
+        exact = amend_key(old_exact, result)
+
+        if self.exact.get(old_exact) == label:
+            del self.exact[old_exact]
+        self.exact.setdefault(exact, label)
+
+        self.valid[sample] += is_valid_result(result) - is_valid_result(old_result)
+        self.rows[label] = (exact, sample, result)
+
+
+def merge_results(df, rows):
+    """ Merge new result rows (lists in master column order) into the master
+        dataframe. Each row is classified against the master and the rows
+        before it (as if merged one at a time):
+
+        - duplicate: identical row already in master - ignored
+        - amendment: same sample/serotype/plate/date/technician - result replaced
+        - tested in error: sample/serotype already has a valid result - row added
+        - new: row added
+
+        Returns the merged dataframe and the outcome of each row """
+
+    if not rows:
+        return df, []
+
+    new_df = pd.DataFrame(rows, columns=MASTER_COLUMNS)
+    new_df['LABDT'] = pd.to_datetime(new_df['LABDT'], format='%d-%b-%y')
+    index = MasterIndex(df)
+
+    outcomes = []
+    amended = {}  # Row label: new result
+    added = []  # Positions in new_df to add
+
+    # Labels for added rows follow on from the master (as appended one at a time)
+    next_label = len(df.index)
+
+    for pos, (exact, plate, sample, result) in enumerate(zip(*get_keys(new_df))):
+
+        # If row already in master - continue
+        if exact in index.exact:
+            outcomes.append(DUPLICATE)
+            continue
+
+        # If everything bar result matches, edit result
+        label = index.plate.get(plate)
+        if label is not None:
+            index.amend(label, result)
+            amended[label] = rows[pos][3]
+            outcomes.append(AMENDMENT)
+            continue
+
+        # Check whether tested in error
+        outcomes.append(TESTED_IN_ERROR if index.valid.get(sample) else NEW)
+
+        # Input entire row
+        index.add(next_label, exact, plate, sample, result)
+        added.append(pos)
+        next_label += 1
+
+    # Replace amended results then add new rows
+    if amended:
+        df.loc[list(amended.keys()), 'Result'] = list(amended.values())
+
+    if added:
+        new_df = new_df.iloc[added]
+        new_df.index = range(len(df.index), len(df.index) + len(added))
+        df = pd.concat([df, new_df])
+
+    return df, outcomes
+
+
+def get_keys(df):
+    """ Exact row, plate result, sample/serotype keys and results of each row """
+
+    dates = get_date_keys(df['LABDT'])
+    cols = {c: df[c].astype(str).tolist() for c in MASTER_COLUMNS if c != 'LABDT'}
+    cols['LABDT'] = dates
+
+    exact = list(zip(*[cols[c] for c in MASTER_COLUMNS]))
+    plate = list(zip(*[cols[c] for c in PLATE_KEY]))
+    sample = list(zip(*[cols[c] for c in SAMPLE_KEY]))
+
+    return exact, plate, sample, cols['Result']
+
+
+def get_date_keys(dates):
+    """ Lab dates as comparable values - master dates are datetimes and new
+        rows are strings (dd-Mon-yy) """
+
+    parsed = pd.to_datetime(dates, format='%d-%b-%y', errors='coerce')
+    return [d if not pd.isnull(d) else str(s) for d, s in zip(parsed, dates)]
+
+
+def amend_key(exact, result):
+    """ Exact row key with the result replaced """
+
+    pos = MASTER_COLUMNS.index('Result')
+    return exact[:pos] + (result,) + exact[pos + 1:]
+
+
+def is_valid_result(result):
+    """ A valid result is numeric (doesn't start with a letter e.g. NP, R1) """
+
+    return not str(result)[:1].isalpha()
@@ -0,0 +1,93 @@
+import os
+import threading
+from collections import OrderedDict
+import pdfkit
+from report_assets import RenderTimer
+
+
+class PdfQueue:
+    """ Queue of rendered html plate reports waiting to be converted to pdf.
+        Reports are converted in order by run() on a background thread or
+        straight away by convert() when a pdf is needed (e.g. for printing).
+        The html already has the report assets embedded """
+
+    def __init__(self, get_pdf_config, options):
+
+        self.get_pdf_config = get_pdf_config  # Returns the pdfkit configuration (wkhtmltopdf)
+        self.options = options  # wkhtmltopdf options
+
+        self.jobs = OrderedDict()  # Waiting jobs - pdf path: html path
+        self.converting = {}  # Jobs being converted - pdf path: event set when done
+        self.lock = threading.Lock()
+        self.n_jobs = 0  # Number of jobs added
+        self.n_done = 0  # Number of pdfs created
+        self.render_times = []  # Timing for each conversion
+
+    def add(self, html_path, pdf_path):
+        """ Add a rendered html file to the queue """
+
+        with self.lock:
+            self.jobs[pdf_path] = html_path
+            self.n_jobs += 1
+
+    def run(self, progress_callback=None):
+        """ Convert every queued report in turn, emitting the number of pdfs
+            created. Returns when the queue is empty """
+
+        while True:
+
+            # Get the next job in line
+            with self.lock:
+                if not self.jobs:
+                    return
+                pdf_path, html_path = self.jobs.popitem(last=False)
+                done = self.converting[pdf_path] = threading.Event()
+
+            self.convert_job(pdf_path, html_path, done)
+
+            if progress_callback is not None:
+                progress_callback.emit(self.n_done)
+
+    def convert(self, pdf_path):
+        """ Make sure a pdf has been created. If it is still waiting in the queue
+            convert it now, if it is being converted wait for it to finish """
+
+        with self.lock:
+            html_path = self.jobs.pop(pdf_path, None)
+
+            if html_path is not None:
+                done = self.converting[pdf_path] = threading.Event()
+            else:
+                done = self.converting.get(pdf_path)
+
+        # Not a queued pdf - nothing to do
+        if done is None:
+            return
+
+        if html_path is not None:
+            self.convert_job(pdf_path, html_path, done)
+        else:
+            done.wait()
+
+    def convert_job(self, pdf_path, html_path, done):
+        """ Convert a single html file to pdf and remove the html file """
+
+        timer = RenderTimer(os.path.basename(pdf_path))
+
+        try:
+            pdfkit.from_file(html_path, pdf_path, configuration=self.get_pdf_config(),
+                             options=self.options)
+            os.remove(html_path)
+            timer.lap("pdf")
+        finally:
+            with self.lock:
+                self.render_times.append(timer)
+                self.n_done += 1
+                del self.converting[pdf_path]
+            done.set()
+
+    def is_empty(self):
+        """ True if there are no pdfs waiting or being converted """
+
+        with self.lock:
+            return not self.jobs and not self.converting
@@ -0,0 +1,247 @@
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Print job statuses reported as events
+COMPLETED = "completed"
+FAILED = "failed"
+
+# Event reported when a print job completes or fails
+PrintEvent = namedtuple('PrintEvent', ['path', 'status', 'message'])
+
+# Windows spooler notification when a job is added (winspool.h)
+PRINTER_CHANGE_ADD_JOB = 0x00000100
+
+
+class PrintError(Exception):
+    """ Custom exception when a print job is not accepted """
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return repr(self.data)
+
+
+class PrintBackend:
+    """ Base class for sending pdfs to a printer. submit() sends a single file and
+        returns once the printer has accepted the job, raising PrintError if it
+        isn't accepted within the timeout """
+
+    name = ""
+
+    def __init__(self, printer=None, timeout=60):
+
+        self.printer = printer or self.default_printer()  # Printer name
+        self.timeout = timeout  # Seconds to wait for each job
+
+    def default_printer(self):
+        """ Name of the default printer """
+
+        return ""
+
+    def submit(self, path):
+        """ Send a file to the printer and return a message once accepted """
+
+        raise NotImplementedError
+
+
+class Win32PrintBackend(PrintBackend):
+    """ Print through the Windows shell. The spooler signals when any job is added
+        to the printer (other users' jobs and our other jobs included) - the job is
+        only taken as ours once a new job has the file name as its document name """
+
+    name = "win32"
+
+    def default_printer(self):
+        import win32print
+        return win32print.GetDefaultPrinter()
+
+    def submit(self, path):
+        import win32api
+        import win32event
+        import win32print
+
+        handle = win32print.OpenPrinter(str(self.printer))
+        job_id = None
+
+        try:
+            # Register for job added before sending so the job can't be missed
+            notify = win32print.FindFirstPrinterChangeNotification(
+                handle, PRINTER_CHANGE_ADD_JOB, 0, None)
+
+            try:
+                seen = set(job['JobId'] for job in win32print.EnumJobs(handle, 0, -1, 1))
+                win32api.ShellExecute(0, "print", path, '/d:"%s"' % self.printer, ".", 0)
+                deadline = time.monotonic() + self.timeout
+
+                while job_id is None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    if win32event.WaitForSingleObject(notify, int(remaining * 1000)) != win32event.WAIT_OBJECT_0:
+                        break
+                    win32print.FindNextPrinterChangeNotification(notify, 0)  # Reset for next job
+
+                    # Jobs added since sending - ours has the file as its document
+                    for job in win32print.EnumJobs(handle, 0, -1, 1):
+                        if job['JobId'] not in seen:
+                            seen.add(job['JobId'])
+                            if is_document(job.get('pDocument'), path):
+                                job_id = job['JobId']
+            finally:
+                win32print.FindClosePrinterChangeNotification(notify)
+        finally:
+            win32print.ClosePrinter(handle)
+
+        if job_id is None:
+            raise PrintError("No print job seen for " + os.path.basename(path))
+
+        return "Sent to " + self.printer + " (job " + str(job_id) + ")"
+
+
+class CupsPrintBackend(PrintBackend):
+    """ Print using CUPS lp. The job is accepted when lp returns its request ID """
+
+    name = "cups"
+
+    def default_printer(self):
+
+        try:
+            out = subprocess.run(["lpstat", "-d"], stdout=subprocess.PIPE,
+                                 universal_newlines=True, timeout=10).stdout
+        except (OSError, subprocess.SubprocessError):
+            return ""
+
+        # e.g. 'system default destination: Lab_Printer'
+        match = re.search(r"destination:\s*(\S+)", out)
+        return match.group(1) if match else ""
+
+    def submit(self, path):
+
+        cmd = ["lp"]
+        if self.printer:
+            cmd += ["-d", self.printer]
+        cmd.append(path)
+
+        try:
+            proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                  universal_newlines=True, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            raise PrintError("lp timed out for " + os.path.basename(path))
+
+        if proc.returncode != 0:
+            raise PrintError(proc.stderr.strip() or "lp failed for " + os.path.basename(path))
+
+        # e.g. 'request id is Lab_Printer-12 (1 file(s))'
+        match = re.search(r"request id is (\S+)", proc.stdout)
+        return match.group(1) if match else proc.stdout.strip()
+
+
+class FileSinkPrintBackend(PrintBackend):
+    """ Stand-in printer that copies each file into a directory. Used where no
+        printer is available and for checking print runs """
+
+    name = "file"
+
+    def __init__(self, sink_dir, timeout=60):
+
+        self.sink_dir = sink_dir  # Directory 'printed' files are copied to
+        super().__init__(printer="File sink (" + sink_dir + ")", timeout=timeout)
+
+    def submit(self, path):
+
+        os.makedirs(self.sink_dir, exist_ok=True)
+        dest = os.path.join(self.sink_dir, os.path.basename(path))
+
+        # Copy then rename so a partly written file is never seen
+        shutil.copyfile(path, dest + ".part")
+        os.replace(dest + ".part", dest)
+
+        return dest
+
+
+class PrintSpooler:
+    """ Send files to a print backend with a bounded number of jobs in flight.
+        An event is reported for each job as it completes or fails """
+
+    def __init__(self, backend, max_jobs=4):
+
+        self.backend = backend  # PrintBackend
+        self.max_jobs = max_jobs  # Maximum jobs being submitted at once
+        self.lock = threading.Lock()
+
+    def print_files(self, paths, callback=None, prepare=None):
+        """ Print a list of files. prepare(path) is called before each file is
+            sent (e.g. to create a pdf still waiting to be made) and callback(event, n)
+            after each job with the number of jobs finished. Returns list of events """
+
+        events = []
+
+        with ThreadPoolExecutor(max_workers=self.max_jobs) as pool:
+            futures = {pool.submit(self.print_file, p, prepare): p for p in paths}
+
+            # Report each job as it finishes
+            for future in as_completed(futures):
+                event = future.result()
+
+                with self.lock:
+                    events.append(event)
+                    n_done = len(events)
+
+                if callback is not None:
+                    callback(event, n_done)
+
+        return events
+
+    def print_file(self, path, prepare=None):
+        """ Print a single file and return the event """
+
+        try:
+            if prepare is not None:
+                prepare(path)
+            message = self.backend.submit(path)
+        except Exception as e:
+            return PrintEvent(path, FAILED, str(e))
+
+        return PrintEvent(path, COMPLETED, message)
+
+
+def is_document(document, path):
+    """ Check if a spooler job's document name is the file (applications show
+        the file name with or without the extension, or the full path). Names
+        are compared whole so similar names (e.g. plate A and AR) don't match """
+
+    if not document:
+        return False
+
+    name = os.path.basename(path).lower()
+    doc_name = re.split(r"[\\/]", document.strip())[-1].lower()
+
+    return doc_name in (name, os.path.splitext(name)[0])
+
+
+def get_print_backend(name=None, printer=None, sink_dir=None, timeout=60):
+    """ Return a print backend by name (win32, cups or file). If no name given,
+        use the Windows spooler on Windows and CUPS elsewhere """
+
+    if name is None:
+        if os.name == 'nt':
+            name = "win32"
+        elif shutil.which("lp"):
+            name = "cups"
+        else:
+            name = "file"
+
+    if name == "win32":
+        return Win32PrintBackend(printer, timeout)
+    elif name == "cups":
+        return CupsPrintBackend(printer, timeout)
+    elif name == "file":
+        return FileSinkPrintBackend(sink_dir or os.path.join(os.getcwd(), "printed"), timeout)
+    else:
+        raise PrintError("Unknown print backend: " + name)
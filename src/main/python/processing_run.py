@@ -0,0 +1,374 @@
+import os
+import re
+from pathlib import Path
+import pandas as pd
+from assay import Assay
+from elisa_data import ELISAData
+from elisa import ELISA
+from print_backends import PrintSpooler, FAILED
+from stage_scheduler import Stage, StageScheduler
+from f007_reader import RangeNotFoundError
+
+# How plate reports are created - straight away, as html converted in the
+# background, or not at all
+PDF_NOW = "pdf"
+PDF_DEFERRED = "deferred"
+PDF_NONE = "none"
+
+# Required files/directories and the error if not found
+REQUIRED_FILES = {"qc_path": "QC Limits file not found",
+                  "curve_path": "IgG Curve concentrations not found",
+                  "trending_path": "Trending file not found",
+                  "f093_path": "F093 template not found"}
+REQUIRED_DIRS = {"master_path": "Master study data directory not found"}
+REQUIRED_PATHS = list(REQUIRED_FILES) + list(REQUIRED_DIRS)
+
+# Printers that write to file rather than paper
+NO_PRINT = ['Print to PDF', 'XPS', 'Fax', 'OneNote']
+
+
+class ProcessingRun:
+    """ Process a set of MARS files against an F007, from checking the required
+        files through to writing the summary files. Holds no GUI state so is used
+        by the data page and the batch runner """
+
+    def __init__(self, ctx, f007_file, mars_files, paths, parms, xl_id=None, use_excel=False,
+                 amendments=None, pdf_mode=PDF_NOW, run_pdf=False, print_backend=None,
+                 pdfs_ready=None):
+
+        self.ctx = ctx  # Application context (or batch context) for resources
+        self.f007_file = f007_file  # F007 path
+        self.mars_files = mars_files  # List of MARS file paths
+        self.paths = paths  # Required file paths by settings name (qc_path etc)
+        self.parms = parms  # OD limits and LLOQ - {'OD_Upper', 'OD_Lower', 'LLOQ'}
+        self.xl_id = xl_id  # PID of working Excel process
+        self.use_excel = use_excel  # Read F007/write F093 through Excel rather than directly
+        self.amendments = amendments if amendments is not None else pd.DataFrame()
+        self.pdf_mode = pdf_mode  # PDF_NOW, PDF_DEFERRED or PDF_NONE
+        self.run_pdf = run_pdf  # Combine plate pdfs into a single run pdf
+        self.print_backend = print_backend  # PrintBackend (None - don't print)
+        self.pdfs_ready = pdfs_ready  # Called with (elisa_data, run_pdf) when deferred reports rendered
+
+        self.savedir = os.path.join(Path(self.mars_files[0]).parent)  # PDF directory
+        self.assay = None
+        self.elisa = None
+        self.elisa_data = None
+        self.run_pdf_path = ''
+        self.pdf_names = []
+        self.print_errors = []
+        self.stages = []
+
+    def get_stages(self):
+        """ Stages of the run and the stages each depends on. Once plates are processed
+            printing, writing the summary files and F093 and compacting the master
+            journal run at the same time """
+
+        return [
+            Stage("check_files", self.check_files_exist,
+                  label="Checking required files..."),
+            Stage("create_objects", self.create_data_objects, ["check_files"],
+                  label="Creating data objects..."),
+            Stage("process_plates", self.process_plates, ["create_objects"],
+                  units=len(self.mars_files), label="Processing plate data"),
+            Stage("print", self.print_pdf, ["process_plates"],
+                  label="Printing pdfs...."),
+            Stage("trending", self.write_trending, ["process_plates"],
+                  label="Writing summary data to file..."),
+            Stage("master", self.write_master, ["process_plates"]),
+            Stage("compact_master", self.compact_master, ["master"],
+                  label="Updating master study..."),
+            Stage("run_details", self.write_run_details, ["master", "trending"]),  # Both add warnings
+            Stage("f093", self.write_f093, ["process_plates"])
+        ]
+
+    def run(self, progress_callback=None, stage_callback=None):
+        """ Run all stages. Returns list of errors from the first stage to fail """
+
+        self.stages = self.get_stages()
+        scheduler = StageScheduler(self.stages)
+
+        return scheduler.run(progress_callback, stage_callback)
+
+    def check_files_exist(self, stage):
+        """ Check that the required files exist """
+
+        err_list = []
+
+        for key, val in REQUIRED_FILES.items():
+            if not os.path.isfile(self.paths.get(key, '')):
+                err_list.append(val)
+
+        for key, val in REQUIRED_DIRS.items():
+            if not os.path.isdir(self.paths.get(key, '')):
+                err_list.append(val)
+
+        return err_list
+
+    def create_data_objects(self, stage):
+        """ Create assay and elisa_data objects """
+
+        # Assay object
+        try:
+            self.assay = Assay(self.f007_file, self.paths["qc_path"], self.paths["curve_path"],
+                               self.xl_id, self.mars_files, use_excel=self.use_excel)
+            # Master study testing file
+            master_str = self.assay.sponsor + "_" + self.assay.study + "_Master.csv"
+            master_file = os.path.join(self.paths["master_path"], master_str)
+        except RangeNotFoundError:
+            return ["Error creating assay object - please check F007 file"]
+
+        # Create ELISA Data Object
+        try:
+            self.elisa_data = ELISAData(assay=self.assay, savedir=self.savedir,
+                                        trend_file=self.paths["trending_path"],
+                                        f093_file=self.paths["f093_path"],
+                                        master_file=master_file, xl_id=self.xl_id,
+                                        parms_dict=self.parms, ctx=self.ctx,
+                                        defer_pdf=self.pdf_mode == PDF_DEFERRED,
+                                        use_excel=self.use_excel)
+        except RangeNotFoundError:
+            return ["Error creating elisa data object"]
+
+        return []
+
+    def process_plates(self, stage):
+        """ Loop through elisa files, create elisa object and process data.
+            Returns list of errors if the F007 doesn't match the plates """
+
+        # Loop through files in assay list
+        for f in self.assay.files:
+
+            # Check if should ignore file
+            ignore_file = check_ignore_file(f)
+            if ignore_file:
+                continue
+
+            # Create ELISA Object
+            self.elisa = ELISA(f, self.assay.first_list, self.assay.repeats_list,
+                               self.assay.qc_limits, self.assay.curve_vals, self.savedir,
+                               self.parms['OD_Upper'], self.parms['OD_Lower'], self.parms['LLOQ'],
+                               self.amendments)
+
+            # Add file to list of names for printing
+            try:
+                self.pdf_names.append(self.elisa.pdf_path)
+            except AttributeError:
+                stage.advance()
+                continue
+
+            # Check data imported correctly
+            if self.elisa.data is None or self.elisa.parameters is None:
+                stage.advance()
+                continue
+
+            # Check that the assay and ELISA details match
+            f007_ok, f007_details = self.check_f007()
+            if not f007_ok:
+                return [f007_details]
+
+            # Create pdf, F093 and get trending data
+            self.input_data()
+            stage.advance()
+
+        # Start creating any deferred pdfs in the background
+        if self.pdf_mode == PDF_DEFERRED and self.pdfs_ready is not None:
+            self.pdfs_ready(self.elisa_data, self.run_pdf)
+
+        # Combine plate pdfs into a single run pdf (when deferred, created once
+        # the background pdfs are done)
+        if self.run_pdf and self.pdf_mode == PDF_NOW and self.elisa_data.pdf_list:
+            self.run_pdf_path = self.elisa_data.create_run_pdf()
+
+        return []
+
+    def input_data(self):
+        """ Create the pdf, create F093 if required, get trending data and add to list """
+
+        # Input data to html template and Create pdf
+        self.elisa_data.input_plate_data(self.elisa, to_pdf=self.pdf_mode != PDF_NONE)
+
+        # Input data to dataframe
+        if self.assay.run_type != "repeats":
+            self.elisa_data.data_to_table(self.elisa)
+
+        # Save trending data to list
+        if self.elisa.plate_fail == "R4" or not self.elisa.template:
+            return
+        else:
+            self.elisa_data.get_trend_data(self.elisa)
+
+    def print_pdf(self, stage):
+        """ Send pdf files to the printer, advancing the stage as each job finishes.
+            Nothing is printed if there is no print backend, no pdfs were created
+            or the printer is a pdf/XPS writer """
+
+        if self.print_backend is None or self.pdf_mode == PDF_NONE:
+            return []
+
+        # If printing to pdf/XPS are default - don't print
+        printer = self.print_backend.printer
+        if any(x.upper() in printer.upper() for x in NO_PRINT):
+            return []
+
+        print_list = self.get_print_list()
+        stage.set_units(len(print_list))
+        spooler = PrintSpooler(self.print_backend)
+
+        # Any pdfs still waiting in the background queue are created before sending
+        events = spooler.print_files(print_list,
+                                     callback=lambda event, n: stage.advance(),
+                                     prepare=self.elisa_data.pdf_queue.convert)
+
+        # Keep failed jobs to report
+        self.print_errors = ["Printing " + e.path + ": " + e.message
+                             for e in events if e.status == FAILED]
+
+        return []
+
+    def get_print_list(self):
+        """ Get the list of pdfs to print - the single run pdf if created,
+            otherwise every plate pdf """
+
+        if self.run_pdf_path:
+            return [self.run_pdf_path]
+        else:
+            return self.pdf_names
+
+    def write_trending(self, stage):
+        """ Write QC data to the trending file """
+
+        self.elisa_data.update_trending()
+        return []
+
+    def write_master(self, stage):
+        """ Update the master study (created if it doesn't exist) """
+
+        self.elisa_data.update_master()
+        return []
+
+    def compact_master(self, stage):
+        """ Apply the master journal to the master database and CSV """
+
+        self.elisa_data.compact_master()
+        return []
+
+    def write_run_details(self, stage):
+        """ Write the run_details summary of testing details and warnings """
+
+        # Summary table of testing details
+        summary_name = os.path.join(os.path.abspath(self.savedir),
+                                    'run_details ' + self.assay.f007_ref + '.csv')
+
+        # Check for suspected R35s
+        df_blocks, block_list = self.get_block_list()
+
+        # If list of blocks (may not be if repeats) - check for R35s
+        if block_list:
+            new_warnings = get_r35s(df_blocks, block_list)
+
+            # Add any R35 warnings that may have been returned
+            for w in new_warnings:
+                self.elisa_data.warnings.append(w)
+
+        # If run_details doesn't exist - create. Else - update
+        if not os.path.isfile(summary_name):
+            self.elisa_data.create_summary()
+        else:
+            self.elisa_data.update_summary()
+
+        return []
+
+    def write_f093(self, stage):
+        """ If not a repeated assay save data to Excel template """
+
+        if self.assay.run_type != "repeats":
+            self.elisa_data.f093_to_excel()
+        return []
+
+    def get_block_list(self):
+        """ Get a list of blocks to check for R35s """
+
+        # List of all plates processed
+        df = self.elisa_data.df_plates
+
+        block_list = []
+        # Just check sample duplicates (i.e. the same list of samples on different plates)
+        colnames = df.columns[1:-1].tolist()
+        # Get list of duplicates - keep all
+        dup_rows = df.duplicated(subset=colnames, keep=False)
+        # Subset df
+        df_dups = df[dup_rows]
+
+        # If duplicates
+        if not df_dups.empty:
+            # Group by duplicate and create comma separated list of blocks
+            grouped = df_dups.groupby(colnames)
+            r_blocks = grouped.agg(lambda x: ','.join(x))['Plate'].tolist()
+            [block_list.append(f.split(",")) for f in r_blocks]
+
+        return df_dups, block_list
+
+    def check_f007(self):
+        """ Check that the details on the F007 match those obtained from MARS file """
+
+        # Check F007 details matches read time
+        if self.assay.tech != self.elisa.barc_tech:
+            return False, \
+                   "Technician initials in F007 (" + self.assay.tech + ") " \
+                   + "don't match those in barcode (" + self.elisa.barc_tech + ") "
+        elif self.assay.date != self.elisa.barc_date:
+            return False, \
+                   "Assay date in F007 (" + self.assay.date + ") " \
+                   + "doesn't match that in barcode (" + self.elisa.barc_date + ") "
+        else:
+            return True, ""
+
+
+def check_ignore_file(file):
+    """ Check that the file in the assay object is not a pdf, xlsm, json or run_details """
+
+    # Split file name to see if run details file
+    run_split = re.split(r"[\\/]", file)[-1]
+    run_split = run_split.split(" ")[0]
+
+    # If file is pdf, xlsm, json or name is run details - ignore
+    if Path(file).suffix.upper() == '.PDF' \
+            or Path(file).suffix.upper() == '.XLSM' \
+            or Path(file).suffix.upper() == '.JSON' \
+            or Path(file).suffix.upper() == '.HTML' \
+            or run_split == "run_details" \
+            or not re.findall(r'\w{2}\d{6}', run_split):
+        return True
+    else:
+        return False
+
+
+def get_r35s(df, block_list):
+    """ Check for suspected R35s from list of blocks """
+
+    new_warnings = []
+    # Subset by block
+    for plates in block_list:
+
+        block_df = df[df['Plate'].isin(plates)]
+
+        # Calculate % fail
+        percent_fail = block_df['Fail'].notna().sum() / len(block_df.index) * 100
+
+        # If >70% R35
+        # Check if all plates have same block ID and return just that if so
+        is_r35 = True if percent_fail > 70 else False
+        if is_r35:
+
+            # Check if all plates are in block A for example
+            whole_block = all(plate[-1] == plates[0][-1] for plate in plates)
+
+            if whole_block:
+                block_str = plates[0][-1]
+            else:
+                block_str = '[' + ','.join(plates) + ']'
+
+            r35_string = 'Suspected R35 on block ' + block_str + ' Please check and amend if necessary'
+            new_warnings.append(r35_string)
+
+    return new_warnings
@@ -0,0 +1,193 @@
+import json
+import math
+import os
+from collections import deque
+from file_coordinator import FileCoordinator
+from trend_store import DATE_COL, PLATE_COL, SEROTYPE_COL, QC_COLS, row_key
+
+# QC levels (trending columns High QC and Low QC)
+QC_LEVELS = ['High', 'Low']
+
+# Results needed for a serotype/level before its mean and SD are used
+MIN_POINTS = 20
+
+# Results kept for each serotype/level (longest rule is 10x)
+WINDOW = 10
+
+# Rules that reject a run (1-2s is a warning only)
+REJECT_RULES = ['1-3s', '2-2s', 'R-4s', '4-1s', '10x']
+
+STATE_FILE = 'westgard.json'
+
+
+class Series:
+    """ Running mean/SD (Welford) and the most recent SD scores of one QC level
+        of a serotype """
+
+    def __init__(self, n=0, mean=0.0, m2=0.0, window=()):
+
+        self.n = n  # Results in mean/SD
+        self.mean = mean
+        self.m2 = m2  # Sum of squared differences from mean
+        self.window = deque(window, maxlen=WINDOW)  # Latest SD scores (oldest first)
+
+    def sd(self):
+
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else 0.0
+
+    def z_score(self, value):
+        """ SD score of a result (None until there are enough results) """
+
+        sd = self.sd()
+        if self.n < MIN_POINTS or sd == 0:
+            return None
+        return (value - self.mean) / sd
+
+    def add(self, value):
+        """ Include a result in the mean/SD """
+
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+    def to_dict(self):
+
+        return {'n': self.n, 'mean': self.mean, 'm2': self.m2, 'window': list(self.window)}
+
+
+class WestgardRules:
+    """ Westgard multi-rules (1-2s, 1-3s, 2-2s, R-4s, 4-1s, 10x) for each serotype
+        and QC level over the trending history. The mean/SD and latest results of
+        each are kept in the trending store (westgard.json) and updated with each
+        run's new plates, so history is only read when the state is first built """
+
+    def __init__(self, trend_store, files=None):
+
+        self.trend_store = trend_store
+        self.files = files or FileCoordinator()
+        self.state_file = os.path.join(trend_store.path, STATE_FILE)
+
+    def update(self, rows):
+        """ Check new trending rows (as stored) against each serotype's history and
+            add them to it. Returns warnings for the rules broken """
+
+        if not rows:
+            return []
+
+        os.makedirs(self.trend_store.path, exist_ok=True)
+
+        with self.files.locked(self.state_file):
+            series = self.load()
+
+            # First run - build from history before these rows
+            if series is None:
+                new_keys = set(row_key(row) for row in rows)
+                series = {}
+                for row in self.trend_store.stored_rows():
+                    if row_key(row) not in new_keys:
+                        check_row(series, row)
+
+            warnings = []
+            for row in sorted(rows, key=lambda r: r[DATE_COL]):
+                warnings.extend(check_row(series, row))
+
+            self.files.replace(self.state_file, lambda tmp: self.save(series, tmp))
+
+        return warnings
+
+    def load(self):
+        """ Series for each serotype/level. None if not built yet (or unreadable) """
+
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        return {key: Series(**s) for key, s in state.items()}
+
+    def save(self, series, file_name):
+
+        with open(file_name, 'w') as f:
+            json.dump({key: s.to_dict() for key, s in series.items()}, f)
+
+
+def check_row(series, row):
+    """ Check a trending row's QC results against the rules then add them to their
+        series (not added to the mean/SD if the run is rejected). Returns warnings """
+
+    serotype = row[SEROTYPE_COL]
+    plate_id = row[PLATE_COL]
+
+    values = {}
+    for level, col in zip(QC_LEVELS, QC_COLS):
+        try:
+            values[level] = float(row[col])
+        except (ValueError, IndexError):
+            continue  # NR or no result
+        if not math.isfinite(values[level]):
+            del values[level]
+
+    z_scores = {}
+    for level, value in values.items():
+        s = series.setdefault(serotype + '|' + level, Series())
+        z = s.z_score(value)
+        if z is not None:
+            z_scores[level] = z
+
+    # Rules within each level (including the latest results)
+    broken = {}
+    for level, z in z_scores.items():
+        window = list(series[serotype + '|' + level].window) + [z]
+        rules = get_broken_rules(window)
+        if rules:
+            broken[level] = rules
+
+    # Range between levels on the same plate
+    if len(z_scores) == 2 and max(z_scores.values()) > 2 and min(z_scores.values()) < -2:
+        for level in z_scores:
+            broken.setdefault(level, []).append('R-4s')
+
+    reject = any(r in REJECT_RULES for rules in broken.values() for r in rules)
+    for level, value in values.items():
+        s = series[serotype + '|' + level]
+        if level in z_scores:
+            s.window.append(z_scores[level])
+        if not reject:
+            s.add(value)
+
+    warnings = []
+    for level, rules in broken.items():
+        warnings.append("QC trend on plate " + plate_id + " (" + serotype + " " + level + " QC, " +
+                        "%.1f SD)" % z_scores[level] + ": Westgard " + ", ".join(rules) +
+                        (" - run rejected. Please check" if reject else " - warning"))
+
+    return warnings
+
+
+def get_broken_rules(window):
+    """ Rules broken by the latest SD score (last in window) given those before it """
+
+    z = window[-1]
+    rules = []
+
+    if abs(z) > 3:
+        rules.append('1-3s')
+    elif abs(z) > 2:
+        rules.append('1-2s')
+
+    if same_side(window[-2:], 2, 2):
+        rules.append('2-2s')
+    if same_side(window[-4:], 4, 1):
+        rules.append('4-1s')
+    if same_side(window[-10:], 10, 0):
+        rules.append('10x')
+
+    return rules
+
+
+def same_side(scores, n, limit):
+    """ Check the last n SD scores are all beyond limit SDs on the same side of the mean """
+
+    return len(scores) == n and (all(z > limit for z in scores) or all(z < -limit for z in scores))
@@ -0,0 +1,145 @@
+import base64
+import mimetypes
+import os
+import re
+import time
+from collections import OrderedDict
+
+# Image types that can be embedded in reports
+IMAGE_TYPES = ['.PNG', '.JPG', '.JPEG', '.GIF', '.SVG']
+
+
+class ReportAssets:
+    """ Stylesheet and images used by the report templates. Read once at startup
+        and embedded in every rendered report so nothing is read from disk per plate """
+
+    def __init__(self, css_file, template_dir):
+
+        self.css_file = css_file  # Report stylesheet
+        self.template_dir = template_dir  # Directory of html templates
+
+        # Images as data URIs by file name (template and stylesheet directories)
+        self.images = get_images([template_dir, os.path.dirname(css_file)])
+
+        # Minified stylesheet with any images inlined
+        self.css = self.get_css()
+        self.style_tag = "<style>" + self.css + "</style>"
+
+    def get_css(self):
+        """ Read and minify the stylesheet, inlining url() images """
+
+        with open(self.css_file, encoding='utf-8') as css_file:
+            css = css_file.read()
+
+        css = minify_css(css)
+
+        # Replace image urls with data URIs
+        return re.sub(r"url\(['\"]?([^'\")]+)['\"]?\)", self.replace_url, css)
+
+    def replace_url(self, match):
+        """ Return url() for an image as a data URI if it has been loaded """
+
+        name = os.path.basename(match.group(1))
+        return "url(" + self.images.get(name, match.group(1)) + ")"
+
+    def replace_src(self, match):
+        """ Return src attribute for an image as a data URI if it has been loaded """
+
+        name = os.path.basename(match.group(1))
+        return 'src="' + self.images.get(name, match.group(1)) + '"'
+
+    def embed(self, html):
+        """ Embed the stylesheet and images in a rendered html report """
+
+        # Images
+        if self.images:
+            html = re.sub(r'src="([^"]+)"', self.replace_src, html)
+
+        # Stylesheet at end of head (as pdfkit would), or at the start if no head
+        if '</head>' in html:
+            return html.replace('</head>', self.style_tag + '</head>', 1)
+        else:
+            return self.style_tag + html
+
+
+class RenderTimer:
+    """ Timing breakdown for rendering a single report """
+
+    def __init__(self, name):
+
+        self.name = name  # Report name (plate ID)
+        self.stages = OrderedDict()  # Stage name: seconds
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        """ Record time taken since the last lap """
+
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0) + now - self.last
+        self.last = now
+
+    def total(self):
+        """ Total time for the report """
+
+        return sum(self.stages.values())
+
+    def __str__(self):
+
+        stages = ", ".join(s + " %.3fs" % t for s, t in self.stages.items())
+        return self.name + ": " + stages + " (total %.3fs)" % self.total()
+
+
+def get_images(dirs):
+    """ Read every image in a list of directories (and sub-directories) as data URIs """
+
+    images = {}
+
+    for d in dirs:
+        for root, _, files in os.walk(d):
+            for f in files:
+                if os.path.splitext(f)[1].upper() in IMAGE_TYPES:
+                    images[f] = to_data_uri(os.path.join(root, f))
+
+    return images
+
+
+def to_data_uri(path):
+    """ Return the contents of a file as a base64 data URI """
+
+    mime = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    with open(path, 'rb') as f:
+        data = base64.b64encode(f.read()).decode('ascii')
+
+    return "data:" + mime + ";base64," + data
+
+
+def minify_css(css):
+    """ Remove comments and unnecessary whitespace from a stylesheet """
+
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL)  # Comments
+    css = re.sub(r"\s+", " ", css)  # Runs of whitespace
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)  # Around delimiters
+    css = re.sub(r":\s+", ":", css)  # After property names
+    css = css.replace(";}", "}")  # Last semi-colon in block
+
+    return css.strip()
+
+
+def render_time_summary(timers):
+    """ Average time per stage for a list of render timers, as a list of strings """
+
+    if not timers:
+        return []
+
+    totals = OrderedDict()
+    for t in timers:
+        for stage, secs in t.stages.items():
+            totals[stage] = totals.get(stage, 0) + secs
+
+    n = len(timers)
+    summary = [str(t) for t in timers]
+    summary.append("Average per report (" + str(n) + "): " +
+                   ", ".join(s + " %.3fs" % (secs / n) for s, secs in totals.items()))
+
+    return summary
@@ -0,0 +1,87 @@
+from PyQt5.QtCore import QThreadPool
+from PyQt5.QtGui import QPalette, QColor
+from PyQt5.QtWidgets import QLabel, QGridLayout, QWidget, QPushButton, QLineEdit, QCheckBox, \
+    QSizePolicy, QTableWidget, QTableWidgetItem, QHeaderView
+from elisa_data_page import Worker
+from sample_index import SampleIndex, RESULT_COLUMNS
+
+
+class PageSampleHistory(QWidget):
+    """ Find the results for a sample (or samples starting with an ID) in every
+        master study file """
+
+    def __init__(self, ctx, master_path, *args, **kwargs):
+        super(PageSampleHistory, self).__init__(*args, **kwargs)
+
+        self.ctx = ctx
+        self.index = SampleIndex(master_path)
+        self.threadpool = QThreadPool()
+        palette = self.palette()
+        palette.setColor(QPalette.Window, QColor(141, 185, 202))
+        self.setAutoFillBackground(True)
+        self.setPalette(palette)
+
+        self.layout = QGridLayout(self)
+
+        # Search
+        sample_label = QLabel(text="Sample ID:")
+        self.sample_edit = QLineEdit(objectName="sample_search")
+        self.sample_edit.returnPressed.connect(self.search_clicked)
+        serotype_label = QLabel(text="Serotype:")
+        self.serotype_edit = QLineEdit(objectName="serotype_search")
+        self.serotype_edit.setSizePolicy(QSizePolicy.Maximum, QSizePolicy.Preferred)
+        self.cb_prefix = QCheckBox(text="Starts with")
+        self.btn_search = QPushButton(text="Search")
+        self.btn_search.setSizePolicy(QSizePolicy.Maximum, QSizePolicy.Maximum)
+        self.btn_search.clicked.connect(self.search_clicked)
+        self.status = QLabel(text="")
+
+        # Results
+        self.table = QTableWidget(0, len(RESULT_COLUMNS))
+        self.table.setHorizontalHeaderLabels(RESULT_COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+
+        self.layout.addWidget(sample_label, 0, 0)
+        self.layout.addWidget(self.sample_edit, 0, 1)
+        self.layout.addWidget(serotype_label, 0, 2)
+        self.layout.addWidget(self.serotype_edit, 0, 3)
+        self.layout.addWidget(self.cb_prefix, 0, 4)
+        self.layout.addWidget(self.btn_search, 0, 5)
+        self.layout.addWidget(self.table, 1, 0, 20, 6)
+        self.layout.addWidget(self.status, 21, 0, 1, 6)
+
+    def search_clicked(self):
+        """ Update the index and search in the background """
+
+        sample_id = self.sample_edit.text().strip()
+        if not sample_id:
+            return
+
+        self.btn_search.setEnabled(False)
+        self.status.setText("Searching...")
+
+        worker = Worker(self.search, sample_id, self.serotype_edit.text().strip(), self.cb_prefix.isChecked())
+        worker.signals.result.connect(self.show_results)
+        worker.signals.error.connect(self.search_error)
+        worker.signals.finished.connect(lambda: self.btn_search.setEnabled(True))
+        self.threadpool.start(worker)
+
+    def search(self, sample_id, serotype, prefix, progress_callback):
+        """ Index masters that have changed then search """
+
+        self.index.update()
+        return self.index.search(sample_id, serotype or None, prefix)
+
+    def show_results(self, rows):
+
+        self.table.setRowCount(len(rows))
+        for r, row in enumerate(rows):
+            for c, val in enumerate(row):
+                self.table.setItem(r, c, QTableWidgetItem(val))
+
+        self.status.setText(str(len(rows)) + " results")
+
+    def search_error(self, err):
+
+        self.status.setText("Search failed: " + str(err[1]))
@@ -0,0 +1,178 @@
+""" Index of every sample result in the master study files, to find where a sample
+    has been tested without opening each master.
+
+    python sample_index.py MASTER_PATH SAMPLE_ID [--prefix] [--serotype SEROTYPE]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+import pandas as pd
+from master_db import load_master_csv
+
+INDEX_NAME = 'sample_index.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    size INTEGER
+);
+CREATE TABLE IF NOT EXISTS samples (
+    sample_id TEXT NOT NULL,
+    study TEXT NOT NULL,
+    serotype TEXT,
+    plate_id TEXT,
+    labdt TEXT,
+    result TEXT,
+    amended_result TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_sample_id ON samples (sample_id, serotype);
+CREATE INDEX IF NOT EXISTS idx_study ON samples (study);
+"""
+
+# Columns returned by a search
+RESULT_COLUMNS = ['Sample ID', 'Study', 'PnC Serotype', 'Plate ID', 'LABDT', 'Result', 'Amended Result']
+
+# Seconds to wait for another update of the index
+TIMEOUT = 20
+
+# Only one thread updates an index at a time
+update_lock = threading.Lock()
+
+
+class SampleIndex:
+    """ Sample ID: study, serotype, plate, date and result for every master
+        study file in the master directory. Kept in an SQLite file in the
+        directory and updated for masters that have changed since last indexed """
+
+    def __init__(self, master_path):
+
+        self.master_path = master_path
+        self.path = os.path.join(master_path, INDEX_NAME)
+
+    def connect(self):
+
+        conn = sqlite3.connect(self.path, timeout=TIMEOUT, isolation_level=None)
+        conn.executescript(SCHEMA)
+        return conn
+
+    def update(self):
+        """ Index masters added or changed since last updated and remove masters
+            deleted. Returns the number of masters indexed """
+
+        masters = {f: os.stat(os.path.join(self.master_path, f)) for f in get_master_files(self.master_path)}
+        n_indexed = 0
+
+        with update_lock:
+            conn = self.connect()
+            try:
+                indexed = {name: (mtime, size) for name, mtime, size in
+                           conn.execute("SELECT name, mtime_ns, size FROM files")}
+
+                # Masters removed
+                for name in indexed:
+                    if name not in masters:
+                        conn.execute("BEGIN IMMEDIATE")
+                        conn.execute("DELETE FROM samples WHERE study = ?", (get_study(name),))
+                        conn.execute("DELETE FROM files WHERE name = ?", (name,))
+                        conn.execute("COMMIT")
+
+                # Masters added or changed (one transaction each)
+                for name, stat in masters.items():
+                    if indexed.get(name) == (stat.st_mtime_ns, stat.st_size):
+                        continue
+
+                    rows = self.read_master(name)
+
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.execute("DELETE FROM samples WHERE study = ?", (get_study(name),))
+                    conn.executemany("INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                    conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                                 (name, stat.st_mtime_ns, stat.st_size))
+                    conn.execute("COMMIT")
+                    n_indexed += 1
+            finally:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                conn.close()
+
+        return n_indexed
+
+    def read_master(self, name):
+        """ Index rows for a master file """
+
+        # Searching doesn't write sidecars into the master folder
+        df = load_master_csv(os.path.join(self.master_path, name), cache=False)
+        dates = [d.strftime('%Y-%m-%d') if not pd.isnull(d) else '' for d in df['LABDT']]
+        study = get_study(name)
+
+        return [(str(s), study, str(sero), str(plate), date, str(res), str(amend))
+                for s, sero, plate, date, res, amend in
+                zip(df['Sample ID'], df['PnC Serotype'], df['Plate ID'], dates,
+                    df['Result'], df['Amended Result'])]
+
+    def search(self, sample_id, serotype=None, prefix=False):
+        """ Results for a sample ID (or sample IDs starting with sample_id if prefix)
+            as a list of rows (RESULT_COLUMNS), by sample, date and study """
+
+        if prefix:
+            where = "sample_id >= ? AND sample_id < ?"
+            params = [sample_id, sample_id + '\uffff']
+        else:
+            where = "sample_id = ?"
+            params = [sample_id]
+
+        if serotype:
+            where += " AND serotype = ?"
+            params.append(serotype)
+
+        conn = self.connect()
+        try:
+            return conn.execute("SELECT sample_id, study, serotype, plate_id, labdt, result, "
+                                "amended_result FROM samples WHERE " + where +
+                                " ORDER BY sample_id, labdt, study", params).fetchall()
+        finally:
+            conn.close()
+
+
+def get_master_files(master_path):
+    """ Master study files (<Sponsor>_<Study>_Master.csv) in the master directory """
+
+    return sorted(f for f in os.listdir(master_path)
+                  if os.path.isfile(os.path.join(master_path, f)) and Path(f).suffix.upper() == '.CSV'
+                  and Path(f).stem.upper().endswith('_MASTER'))
+
+
+def get_study(name):
+    """ Sponsor_Study from a master file name """
+
+    return Path(name).stem[:-len('_Master')]
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Find a sample in the master study files")
+    parser.add_argument('master_path', help="Master study data directory")
+    parser.add_argument('sample_id', help="Sample ID")
+    parser.add_argument('--prefix', action='store_true', help="Find sample IDs starting with SAMPLE_ID")
+    parser.add_argument('--serotype', help="Only results for this serotype")
+    args = parser.parse_args(argv)
+
+    index = SampleIndex(args.master_path)
+    index.update()
+
+    rows = index.search(args.sample_id, args.serotype, args.prefix)
+
+    print(",".join(RESULT_COLUMNS))
+    for row in rows:
+        print(",".join(row))
+
+    return 0 if rows else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
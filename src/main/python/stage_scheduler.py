@@ -0,0 +1,155 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class Stage:
+    """ A step in a processing run. fn(stage) is called once every stage it
+        depends on has completed and should call stage.advance() as each unit
+        of work is done. If fn returns a non-empty list of errors the run stops """
+
+    def __init__(self, name, fn, depends=(), units=1, label=""):
+
+        self.name = name  # Unique stage name
+        self.fn = fn  # Function to run
+        self.depends = list(depends)  # Names of stages that must complete first
+        self.units = units  # Number of work units (e.g. plates)
+        self.label = label  # Text to display when stage starts
+        self.units_done = 0
+        self.seconds = 0  # Time taken to run
+        self.scheduler = None
+
+    def advance(self, n=1):
+        """ Record n units of work completed """
+
+        self.scheduler.advance(self, n)
+
+    def set_units(self, units):
+        """ Change the number of work units once known (e.g. pdfs to print) """
+
+        self.scheduler.set_units(self, units)
+
+
+class StageScheduler:
+    """ Run a set of stages, each as soon as its dependencies have completed, so
+        independent stages run concurrently. Progress is the percentage of
+        work units completed over all stages """
+
+    def __init__(self, stages, max_workers=4):
+
+        self.stages = {s.name: s for s in stages}
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.progress_callback = None
+        self.stage_callback = None
+        self.last_percent = -1
+
+        # Check dependencies before starting anything
+        for s in stages:
+            s.scheduler = self
+            for d in s.depends:
+                if d not in self.stages:
+                    raise ValueError("Stage " + s.name + " depends on unknown stage " + d)
+
+        self.check_cycles()
+
+    def check_cycles(self):
+        """ Raise ValueError if stages depend on each other in a loop """
+
+        done = set()
+        remaining = dict(self.stages)
+
+        while remaining:
+            ready = [n for n, s in remaining.items() if all(d in done for d in s.depends)]
+            if not ready:
+                raise ValueError("Circular stage dependencies: " + ", ".join(sorted(remaining)))
+            for n in ready:
+                done.add(n)
+                del remaining[n]
+
+    def run(self, progress_callback=None, stage_callback=None):
+        """ Run all stages. progress_callback(percent) is called as work units
+            complete and stage_callback(stage) as each stage starts.
+            Returns list of errors from the first stage to fail (empty if none) """
+
+        self.progress_callback = progress_callback
+        self.stage_callback = stage_callback
+
+        done = set()
+        running = {}  # future: stage
+        errors = []
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+
+            while True:
+
+                # Start every stage whose dependencies have completed (unless stopping)
+                if not errors:
+                    for name, stage in self.stages.items():
+                        started = name in done or stage in running.values()
+                        if not started and all(d in done for d in stage.depends):
+                            running[pool.submit(self.run_stage, stage)] = stage
+
+                if not running:
+                    break
+
+                # Wait for a stage to finish
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    stage = running.pop(future)
+
+                    # Uncaught errors are raised (once running stages have finished)
+                    result = future.result()
+
+                    if result:
+                        errors.extend(result)
+                    else:
+                        done.add(stage.name)
+
+        return errors
+
+    def run_stage(self, stage):
+        """ Run a single stage and mark all of its units as done """
+
+        if self.stage_callback is not None:
+            self.stage_callback(stage)
+
+        start = time.perf_counter()
+        result = stage.fn(stage)
+        stage.seconds = time.perf_counter() - start
+
+        if not result:
+            self.advance(stage, stage.units - stage.units_done)
+
+        return result
+
+    def advance(self, stage, n):
+        """ Record units completed for a stage and report progress """
+
+        with self.lock:
+            stage.units_done = min(stage.units_done + n, stage.units)
+        self.report_progress()
+
+    def set_units(self, stage, units):
+        """ Change the number of units for a stage """
+
+        with self.lock:
+            stage.units = units
+            stage.units_done = min(stage.units_done, units)
+        self.report_progress()
+
+    def report_progress(self):
+        """ Call the progress callback if the percentage has changed """
+
+        with self.lock:
+            total = sum(s.units for s in self.stages.values())
+            n_done = sum(s.units_done for s in self.stages.values())
+            percent = int(100 * n_done / total) if total else 100
+
+            if percent == self.last_percent:
+                return
+            self.last_percent = percent
+
+        if self.progress_callback is not None:
+            self.progress_callback(percent)
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+import matplotlib.dates as mpdt
+from matplotlib.figure import Figure
+from trend_store import TrendStore, DATE_COL, PLATE_COL, SEROTYPE_COL, QC_COLS
+from qc_rules import QC_LEVELS, MIN_POINTS, WestgardRules
+
+# Bins across the visible dates - each draws its lowest and highest result
+LOD_BINS = 1000
+
+# SD lines drawn either side of the mean (colour of each)
+SD_LINES = {1: 'green', 2: 'orange', 3: 'red'}
+
+
+class TrendSeries:
+    """ QC results of one level of a serotype in date order, with the mean/SD
+        they are checked against """
+
+    def __init__(self, dates, values, plates, series=None):
+
+        self.x = mpdt.date2num(dates)  # Dates as matplotlib numbers
+        self.y = values
+        self.plates = plates
+
+        # Mean/SD from the Westgard rules if built, else from the results
+        if series is not None and series.n >= MIN_POINTS:
+            self.mean, self.sd = series.mean, series.sd()
+        elif len(values) > 1:
+            self.mean, self.sd = float(np.mean(values)), float(np.std(values, ddof=1))
+        else:
+            self.mean, self.sd = (float(values[0]) if len(values) else 0.0), 0.0
+
+    def visible(self, x_min=None, x_max=None, n_bins=LOD_BINS):
+        """ Results between two dates (all if not given) reduced to the lowest and
+            highest result in each of n_bins bins """
+
+        i0 = 0 if x_min is None else max(np.searchsorted(self.x, x_min) - 1, 0)
+        i1 = len(self.x) if x_max is None else np.searchsorted(self.x, x_max) + 1
+
+        idx = minmax_downsample(self.x[i0:i1], self.y[i0:i1], n_bins) + i0
+        return self.x[idx], self.y[idx]
+
+
+def load_serotypes(trend_file):
+    """ Serotypes in the trending store """
+
+    store = TrendStore(trend_file)
+    store.columns()  # Creates the store from the trending file if needed
+
+    return sorted(set(name for year, name, path in store.partitions()), key=serotype_order)
+
+
+def load_trend(trend_file, serotype):
+    """ High and Low QC results of a serotype from the trending store
+        ({level: TrendSeries}) - only that serotype's partitions are read """
+
+    store = TrendStore(trend_file)
+    df = store.read(serotypes=[serotype])
+    columns = df.columns
+
+    # Partitions of similar names may share a file name - keep the serotype only
+    df = df[df[columns[SEROTYPE_COL]].astype(str) == str(serotype)]
+
+    # Mean/SD each result is checked against (None if not built yet)
+    state = WestgardRules(store).load() or {}
+
+    trend = {}
+    for level, col in zip(QC_LEVELS, QC_COLS):
+        values = pd.to_numeric(df[columns[col]], errors='coerce')
+        keep = values.notnull() & df[columns[DATE_COL]].notnull()
+        trend[level] = TrendSeries(df.loc[keep, columns[DATE_COL]].values,
+                                   values[keep].values.astype(float),
+                                   df.loc[keep, columns[PLATE_COL]].values,
+                                   state.get(str(serotype) + '|' + level))
+
+    return trend
+
+
+def create_lj_chart(trend, serotype):
+    """ Levey-Jennings chart (a plot for each QC level sharing the date axis).
+        Returns the figure and the line drawn for each level """
+
+    fig = Figure(figsize=(10, 6))
+    axes = fig.subplots(len(trend), 1, sharex=True, squeeze=False)[:, 0]
+    lines = {}
+
+    for ax, (level, series) in zip(axes, trend.items()):
+        x, y = series.visible()
+        lines[level], = ax.plot(x, y, marker='.', markersize=3, linewidth=0.6, color='navy')
+
+        ax.axhline(series.mean, color='black', linewidth=0.8)
+        for n, colour in SD_LINES.items():
+            for sign in (1, -1):
+                ax.axhline(series.mean + sign * n * series.sd, color=colour, linestyle='--', linewidth=0.6)
+
+        ax.set_ylabel(level + " QC")
+        ax.set_title("%s %s QC (n = %d, mean = %.3f, SD = %.3f)" %
+                     (serotype, level, len(series.y), series.mean, series.sd), fontsize=9)
+
+    axes[-1].xaxis_date()
+    axes[-1].xaxis.set_major_formatter(mpdt.DateFormatter('%d-%b-%y'))
+    fig.autofmt_xdate()
+
+    return fig, lines
+
+
+def minmax_downsample(x, y, n_bins):
+    """ Positions of the lowest and highest y in each of n_bins equal x ranges, in
+        x order (all positions if there are fewer points than that) """
+
+    n = len(x)
+    if n <= 2 * n_bins:
+        return np.arange(n)
+
+    edges = np.linspace(x[0], x[-1], n_bins + 1)
+    bins = np.clip(np.searchsorted(edges, x, side='right') - 1, 0, n_bins - 1)
+
+    # Sorted by bin then y - the first and last of each bin are its min and max
+    order = np.lexsort((y, bins))
+    sorted_bins = bins[order]
+    firsts = np.flatnonzero(np.r_[True, sorted_bins[1:] != sorted_bins[:-1]])
+    lasts = np.r_[firsts[1:] - 1, n - 1]
+
+    return np.unique(np.r_[order[firsts], order[lasts]])
+
+
+def serotype_order(serotype):
+    """ Sort serotypes by number then letter (e.g. 6A, 6B, 19F, 23F) """
+
+    digits = ''.join(c for c in serotype if c.isdigit())
+    return (int(digits) if digits else 0, serotype)
@@ -0,0 +1,169 @@
+from PyQt5.QtCore import QThreadPool
+from PyQt5.QtGui import QPalette, QColor
+from PyQt5.QtWidgets import QLabel, QGridLayout, QWidget, QPushButton, QComboBox, QLineEdit, \
+    QSizePolicy, QFileDialog
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas, \
+    NavigationToolbar2QT as NavigationToolbar
+from elisa_data_page import Worker, find_widget
+from trend_chart import load_serotypes, load_trend, create_lj_chart
+from trend_store import TrendStore
+import os
+
+
+class PageTrend(QWidget):
+    """ Levey-Jennings charts of the High and Low QC results of a serotype from
+        the trending store. Data is loaded in the background and only the lowest
+        and highest result in each part of the visible dates is drawn, so zooming
+        in shows more detail """
+
+    def __init__(self, ctx, *args, **kwargs):
+        super(PageTrend, self).__init__(*args, **kwargs)
+
+        self.ctx = ctx
+        self.threadpool = QThreadPool()
+        self.trend = {}  # QC level: TrendSeries of the serotype plotted
+        self.lines = {}  # QC level: line drawn
+        self.fig = None
+        self.canvas = None
+        self.toolbar = None
+        palette = self.palette()
+        palette.setColor(QPalette.Window, QColor(141, 185, 202))
+        self.setAutoFillBackground(True)
+        self.setPalette(palette)
+
+        self.layout = QGridLayout(self)
+
+        # Serotype and buttons
+        serotype_label = QLabel(text="Serotype:")
+        serotype_label.setSizePolicy(QSizePolicy.Maximum, QSizePolicy.Maximum)
+        self.combo_serotype = QComboBox(objectName="trend_serotype")
+        self.combo_serotype.setSizePolicy(QSizePolicy.Maximum, QSizePolicy.Maximum)
+        self.combo_serotype.setMinimumContentsLength(6)
+        self.btn_refresh = QPushButton(text="Refresh")
+        self.btn_refresh.clicked.connect(self.refresh_serotypes)
+        self.btn_plot = QPushButton(text="Plot")
+        self.btn_plot.clicked.connect(self.plot_trend)
+        self.btn_save = QPushButton(text="Save")
+        self.btn_save.clicked.connect(self.save_plot)
+        for btn in (self.btn_refresh, self.btn_plot, self.btn_save):
+            btn.setSizePolicy(QSizePolicy.Maximum, QSizePolicy.Maximum)
+        self.status = QLabel(text="")
+
+        self.layout.addWidget(serotype_label, 0, 0)
+        self.layout.addWidget(self.combo_serotype, 0, 1)
+        self.layout.addWidget(self.btn_refresh, 0, 2)
+        self.layout.addWidget(self.btn_plot, 0, 3)
+        self.layout.addWidget(self.btn_save, 0, 4)
+        self.layout.addWidget(self.status, 22, 0, 1, 5)
+
+        widget = QWidget()
+        widget.setStyleSheet("QWidget{background-color: white}")
+        self.layout.addWidget(widget, 2, 0, 20, 5)
+
+    def get_trend_file(self):
+        """ Trending file path from the settings page """
+
+        page = find_widget("path_settings")
+        path_text = page.findChild(QLineEdit, "trending_path").text()
+
+        if not os.path.isfile(path_text) and not os.path.isdir(TrendStore(path_text).path):
+            self.status.setText("Trending file not found")
+            return ""
+
+        return path_text
+
+    def refresh_serotypes(self):
+        """ List the serotypes in the trending store (in the background - the store
+            is created from the trending file the first time) """
+
+        trend_file = self.get_trend_file()
+        if not trend_file:
+            return
+
+        self.set_busy("Loading serotypes...")
+        worker = Worker(lambda progress_callback: load_serotypes(trend_file))
+        worker.signals.result.connect(self.show_serotypes)
+        worker.signals.error.connect(self.load_error)
+        worker.signals.finished.connect(self.set_ready)
+        self.threadpool.start(worker)
+
+    def show_serotypes(self, serotypes):
+
+        current = self.combo_serotype.currentText()
+        self.combo_serotype.clear()
+        self.combo_serotype.addItems(serotypes)
+        if current in serotypes:
+            self.combo_serotype.setCurrentText(current)
+
+        self.status.setText(str(len(serotypes)) + " serotypes")
+
+    def plot_trend(self):
+        """ Load the QC results of the selected serotype in the background then plot """
+
+        trend_file = self.get_trend_file()
+        serotype = self.combo_serotype.currentText()
+        if not trend_file or not serotype:
+            return
+
+        self.set_busy("Loading " + serotype + " QC results...")
+        worker = Worker(lambda progress_callback: (serotype, load_trend(trend_file, serotype)))
+        worker.signals.result.connect(self.show_trend)
+        worker.signals.error.connect(self.load_error)
+        worker.signals.finished.connect(self.set_ready)
+        self.threadpool.start(worker)
+
+    def show_trend(self, result):
+
+        serotype, self.trend = result
+        self.fig, self.lines = create_lj_chart(self.trend, serotype)
+
+        # Replace the previous chart
+        for w in (self.canvas, self.toolbar):
+            if w is not None:
+                self.layout.removeWidget(w)
+                w.deleteLater()
+
+        self.canvas = FigureCanvas(self.fig)
+        self.toolbar = NavigationToolbar(self.canvas, self)
+        self.layout.addWidget(self.toolbar, 1, 0, 1, 5)
+        self.layout.addWidget(self.canvas, 2, 0, 20, 5)
+
+        # Redraw the results in view when zoomed or panned (axes share dates)
+        self.fig.axes[0].callbacks.connect('xlim_changed', self.update_detail)
+        self.canvas.draw()
+
+        n_results = sum(len(s.y) for s in self.trend.values())
+        self.status.setText(serotype + ": " + str(n_results) + " QC results")
+
+    def update_detail(self, ax):
+        """ Downsample the results between the dates in view """
+
+        x_min, x_max = ax.get_xlim()
+        for level, line in self.lines.items():
+            line.set_data(*self.trend[level].visible(x_min, x_max))
+
+        self.canvas.draw_idle()
+
+    def save_plot(self):
+
+        if self.fig is None:
+            return
+
+        path, ext = QFileDialog.getSaveFileName(self, 'Save file', '', "PNG (*.png)")
+        if path:
+            self.fig.savefig(path)
+
+    def set_busy(self, text):
+
+        self.status.setText(text)
+        self.btn_refresh.setEnabled(False)
+        self.btn_plot.setEnabled(False)
+
+    def set_ready(self):
+
+        self.btn_refresh.setEnabled(True)
+        self.btn_plot.setEnabled(True)
+
+    def load_error(self, err):
+
+        self.status.setText("Loading failed: " + str(err[1]))
@@ -0,0 +1,361 @@
+import csv
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+import pandas as pd
+from file_coordinator import FileCoordinator, LockTimeout
+
+# Trending columns (as get_trend_data) used when there is no trending file to copy
+TREND_COLUMNS = ['Lab Date', 'Technician', 'Sponsor', 'Study', 'Plate ID', 'Serotype',
+                 'High QC', 'Low QC', 'Plate Fail']
+
+# Positions of the date, plate, serotype and QC result columns
+DATE_COL = 0
+PLATE_COL = 4
+SEROTYPE_COL = 5
+QC_COLS = [6, 7]
+
+# Positions of columns loaded as categoricals (technician, sponsor, study and serotype)
+TREND_CATEGORIES = [1, 2, 3, 5]
+
+COLUMNS_FILE = 'columns.json'
+EXPORTED_FILE = 'exported.json'  # Bytes of each partition in the trending CSV and its last date
+
+
+class TrendStore:
+    """ QC trending data partitioned by year and serotype (<trending>.trend/<year>/
+        <serotype>.csv). Rows are only ever appended - each partition has an index
+        of row keys so re-printed plates aren't added twice. The trending CSV is
+        an export of every partition in date order - rows added since last
+        exported are added to the end if dated after the rows already in it """
+
+    def __init__(self, trend_file, files=None):
+
+        self.trend_file = trend_file  # Trending CSV (export)
+        self.path = os.path.splitext(trend_file)[0] + '.trend'
+        self.files = files or FileCoordinator()  # Locks and writes partitions and export
+
+    def columns(self):
+        """ Trending column names (store created from the trending CSV if needed) """
+
+        columns_file = os.path.join(self.path, COLUMNS_FILE)
+
+        if not os.path.isfile(columns_file):
+            os.makedirs(self.path, exist_ok=True)
+
+            # Created by one run - any others wait then use it
+            with self.files.locked(columns_file):
+                if not os.path.isfile(columns_file):
+                    self.import_csv(columns_file)
+
+        with open(columns_file) as f:
+            return json.load(f)
+
+    def import_csv(self, columns_file):
+        """ Partition the rows of a trending CSV written before the store """
+
+        columns = TREND_COLUMNS
+        if os.path.isfile(self.trend_file):
+            last_date = ''
+            try:
+                df = pd.read_csv(self.trend_file, dtype=str, keep_default_na=False)
+                columns = df.columns.tolist()
+                df[columns[DATE_COL]] = to_iso_dates(df[columns[DATE_COL]])
+                df = df.drop_duplicates()
+                last_date = df[columns[DATE_COL]].max() if len(df) else ''
+
+                for (year, serotype), part in df.groupby([df[columns[DATE_COL]].str[:4],
+                                                           df[columns[SEROTYPE_COL]]]):
+                    rows = [tuple(r) for r in part.itertuples(index=False)]
+                    self.write_partition(self.partition_file(year, serotype), rows, columns)
+            except pd.errors.EmptyDataError:
+                pass
+
+            # The trending CSV already has these rows
+            exported = {'offsets': {os.path.relpath(path, self.path): os.path.getsize(path)
+                                    for year, name, path in self.partitions()},
+                        'last_date': last_date}
+            self.files.replace(os.path.join(self.path, EXPORTED_FILE), lambda tmp: write_json(tmp, exported))
+
+        self.files.replace(columns_file, lambda tmp: write_json(tmp, columns))
+
+    def append(self, rows):
+        """ Append trending rows (as get_trend_data) to their partitions, ignoring
+            rows already stored. Returns the rows added (as stored) """
+
+        columns = self.columns()
+
+        # Rows for each partition
+        parts = {}
+        for row in rows:
+            row = to_store_row(row)
+            parts.setdefault(self.partition_file(row[DATE_COL][:4], row[SEROTYPE_COL]), []).append(row)
+
+        added = []
+        for part_file, part_rows in parts.items():
+            os.makedirs(os.path.dirname(part_file), exist_ok=True)
+            with self.files.locked(part_file):
+                keys = self.read_keys(part_file)
+
+                new_rows = []
+                for row in part_rows:
+                    key = row_key(row)
+                    if key not in keys:
+                        keys.add(key)
+                        new_rows.append(row)
+
+                self.write_partition(part_file, new_rows, columns)
+                added.extend(new_rows)
+
+        return added
+
+    def partition_file(self, year, serotype):
+
+        name = "".join(c if c.isalnum() else "_" for c in str(serotype)) or "_"
+        return os.path.join(self.path, str(year) or "unknown", name + '.csv')
+
+    def partitions(self):
+        """ Partition files (year, serotype name, path) """
+
+        found = []
+        for year in sorted(os.listdir(self.path)) if os.path.isdir(self.path) else []:
+            year_dir = os.path.join(self.path, year)
+            if not os.path.isdir(year_dir):
+                continue
+            for f in sorted(os.listdir(year_dir)):
+                if f.endswith('.csv'):
+                    found.append((year, f[:-4], os.path.join(year_dir, f)))
+
+        return found
+
+    def read_keys(self, part_file):
+        """ Keys of the rows in a partition. The key index is rebuilt from the rows
+            if it is missing or older than the rows (e.g. a run stopped between the two) """
+
+        key_file = part_file[:-4] + '.keys'
+
+        if not os.path.isfile(part_file):
+            return set()
+
+        if os.path.isfile(key_file) and os.path.getmtime(key_file) >= os.path.getmtime(part_file):
+            with open(key_file) as f:
+                return set(line.strip() for line in f)
+
+        with open(part_file, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            keys = set(row_key(row) for row in reader)
+
+        with open(key_file, 'w') as f:
+            f.writelines(k + '\n' for k in keys)
+
+        return keys
+
+    def write_partition(self, part_file, rows, columns):
+        """ Append rows (and their keys) to a partition, synced to disk """
+
+        if not rows:
+            return
+
+        os.makedirs(os.path.dirname(part_file), exist_ok=True)
+        new_file = not os.path.isfile(part_file)
+
+        with open(part_file, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(columns)
+            writer.writerows(rows)
+            f.flush()
+            os.fsync(f.fileno())
+
+        with open(part_file[:-4] + '.keys', 'a') as f:
+            f.writelines(row_key(r) + '\n' for r in rows)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def stored_rows(self):
+        """ Every stored row (as text) in date order """
+
+        rows = []
+        for year, name, path in self.partitions():
+            with open(path, newline='', encoding='utf-8') as f:
+                reader = csv.reader(f)
+                next(reader, None)
+                rows.extend(tuple(row) for row in reader)
+
+        return sorted(rows, key=lambda row: row[DATE_COL])
+
+    def read(self, serotypes=None, years=None):
+        """ Trending rows as a dataframe sorted by date (dates as datetime and
+            repeated text as categoricals). Only the partitions for the serotypes
+            and years given are read """
+
+        columns = self.columns()
+        names = None if serotypes is None else set(self.partition_file('', s).rsplit(os.sep, 1)[-1][:-4]
+                                                   for s in serotypes)
+
+        frames = [pd.read_csv(path, dtype=str, keep_default_na=False)
+                  for year, name, path in self.partitions()
+                  if (names is None or name in names) and (years is None or year in map(str, years))]
+
+        if not frames:
+            return pd.DataFrame(columns=columns)
+
+        df = pd.concat(frames, ignore_index=True)
+        df[columns[DATE_COL]] = pd.to_datetime(df[columns[DATE_COL]], format='%Y-%m-%d', errors='coerce')
+        df = df.sort_values(by=columns[DATE_COL], kind='mergesort').reset_index(drop=True)
+
+        for col in TREND_CATEGORIES:
+            df[columns[col]] = df[columns[col]].astype('category')
+
+        return df
+
+    def export(self):
+        """ Add the rows added to partitions since last exported to the trending CSV
+            (written to a temp file then replaced). Rows dated on or after the last
+            exported date are added to the end, otherwise (or if there is no CSV)
+            the CSV is written from every partition so it stays in date order.
+            Left for the next export if the CSV is locked or open.
+            Returns the number of rows added """
+
+        columns = self.columns()
+        exported_file = os.path.join(self.path, EXPORTED_FILE)
+
+        try:
+            with self.files.locked(self.trend_file):
+                exported = (read_json(exported_file) or {}) if os.path.isfile(self.trend_file) else {}
+                offsets = exported.get('offsets', {})
+                last_date = exported.get('last_date')
+
+                rows = []
+                for year, name, path in self.partitions():
+                    rel_path = os.path.relpath(path, self.path)
+                    new_rows, offsets[rel_path] = read_new_rows(path, offsets.get(rel_path, 0))
+                    rows.extend(new_rows)
+
+                if not rows and last_date is not None:
+                    return 0
+
+                rows.sort(key=lambda r: r[DATE_COL])
+                n_added = len(rows)
+
+                if last_date is not None and rows[0][DATE_COL] >= last_date:
+                    self.files.replace(self.trend_file, lambda tmp: append_csv(self.trend_file, tmp, rows))
+                else:
+                    # Earlier plates (e.g. re-processed) - write every row in date order
+                    rows = []
+                    for year, name, path in self.partitions():
+                        part_rows, offsets[os.path.relpath(path, self.path)] = read_new_rows(path, 0)
+                        rows.extend(part_rows)
+                    rows.sort(key=lambda r: r[DATE_COL])
+                    self.files.replace(self.trend_file, lambda tmp: write_csv(tmp, columns, rows))
+
+                exported = {'offsets': offsets,
+                            'last_date': max([last_date or ''] + [r[DATE_COL] for r in rows])}
+                self.files.replace(exported_file, lambda tmp: write_json(tmp, exported))
+        except (LockTimeout, PermissionError) as e:
+            self.files.skipped.append((self.trend_file, str(e)))
+            return 0
+
+        return n_added
+
+
+def read_new_rows(path, offset):
+    """ Complete rows written to a partition after offset (bytes) and the offset
+        after them (a row being appended by another run is left for next time) """
+
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+
+    end = data.rfind(b'\n') + 1
+    lines = data[:end].decode('utf-8').splitlines()
+
+    # Header
+    if offset == 0:
+        lines = lines[1:]
+
+    return [tuple(row) for row in csv.reader(lines)], offset + end
+
+
+def append_csv(csv_file, tmp, rows):
+    """ Copy the trending CSV to tmp and add stored rows to the end """
+
+    shutil.copyfile(csv_file, tmp)
+    start_line = not ends_with_newline(tmp)
+
+    with open(tmp, 'a', newline='', encoding='utf-8') as f:
+        if start_line:
+            f.write('\r\n')  # e.g. saved from Excel without one
+        csv.writer(f).writerows(to_export_row(r) for r in rows)
+
+
+def write_csv(tmp, columns, rows):
+    """ Write the trending CSV (stored rows) to tmp """
+
+    with open(tmp, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(to_export_row(r) for r in rows)
+
+
+def ends_with_newline(path):
+
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+def to_export_row(row):
+    """ Stored row with the date as in the trending CSV (dd-Mon-yy) """
+
+    row = list(row)
+    if row[DATE_COL]:
+        row[DATE_COL] = datetime.strptime(row[DATE_COL], '%Y-%m-%d').strftime('%d-%b-%y')
+
+    return row
+
+
+def to_store_row(row):
+    """ Trending row as text with the date as YYYY-MM-DD """
+
+    row = ['' if v is None else str(v) for v in row]
+    row[DATE_COL] = to_iso_dates(pd.Series([row[DATE_COL]])).iloc[0]
+
+    return tuple(row)
+
+
+def to_iso_dates(dates):
+    """ Lab dates (dd-Mon-yy or any other date format) as YYYY-MM-DD text """
+
+    parsed = pd.to_datetime(dates, format='%d-%b-%y', errors='coerce')
+    other = pd.to_datetime(dates[parsed.isnull()], errors='coerce')
+    parsed[parsed.isnull()] = other
+
+    return parsed.dt.strftime('%Y-%m-%d').fillna('')
+
+
+def row_key(row):
+    """ Key of a stored row (all columns) """
+
+    return hashlib.sha1("\x1f".join(row).encode('utf-8')).hexdigest()
+
+
+def read_json(path):
+
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path, data):
+
+    with open(path, 'w') as f:
+        json.dump(data, f)